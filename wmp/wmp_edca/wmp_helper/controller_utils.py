@@ -4,6 +4,11 @@ __author__ = 'Domenico Garlisi'
 EU project WISHFUL
 """
 import types
+import gevent
+import hashlib
+import os
+import gevent.event
+import datetime
 # from runtime.runtime import LocalManager
 # from master.master import GlobalManager
 # from upis.upi_rn import UPI_RN
@@ -109,6 +114,174 @@ def getPlatformInformation(node, log, controller):
     return current_platform_info
 
 
+class PlatformCapabilityCache:
+    """
+    This class defines a cache of the node capabilities returned by getPlatformInformation, so that the radio
+    program activations do not query the nodes (two blocking UPI calls per node) every time. An entry expires after
+    ttl seconds and is removed when the node leaves the experiment (call invalidate in the node exit callback). The
+    cache is filled in the background when the nodes are discovered (call warm in the new node callback): the nodes
+    are queried concurrently, one greenlet per node, and a get during the query waits for it instead of querying again.
+    """
+
+    def __init__(self, controller, log, ttl=300):
+        """
+        :param controller: experiment object controller
+        :param log: experiment logging module attribute
+        :param ttl: validity of the capabilities of a node [s], None for no expiration
+        """
+        self.controller = controller
+        self.log = log
+        self.ttl = ttl
+        # node id -> (time of the query, radio_info_t or False)
+        self.entries = {}
+        # node id -> greenlet of the query in progress
+        self.pending = {}
+
+    def _query(self, node, raise_errors=False):
+        try:
+            info = getPlatformInformation(node, self.log, self.controller)
+        except Exception as e:
+            if raise_errors:
+                raise
+            self.log.warning("Platform information for %s not available : %s" % (str(node), e))
+            return None
+        finally:
+            if self.pending.get(node.id) is gevent.getcurrent():
+                del self.pending[node.id]
+        self.entries[node.id] = (time.time(), info)
+        return info
+
+    def warm(self, nodes):
+        """ Starts the query of the capabilities of the nodes without a valid entry, without waiting for the answers.
+
+        :param nodes: node or nodes list
+        :return: list of the greenlets of the queries in progress
+        """
+        if not isinstance(nodes, (list, tuple)):
+            nodes = [nodes]
+        for node in nodes:
+            if node.id not in self.pending and self.cached(node) is None:
+                self.pending[node.id] = gevent.spawn(self._query, node)
+        return [self.pending[node.id] for node in nodes if node.id in self.pending]
+
+    def warm_all(self, nodes, timeout=None):
+        """ Queries the capabilities of the nodes concurrently and waits for the answers.
+        """
+        gevent.joinall(self.warm(nodes), timeout=timeout)
+
+    def cached(self, node):
+        """ Returns the capabilities of the node if they are in the cache and not expired, None otherwise.
+        """
+        entry = self.entries.get(node.id)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry[0] > self.ttl:
+            del self.entries[node.id]
+            return None
+        return entry[1]
+
+    def get(self, node):
+        """ Returns the capabilities of the node (see getPlatformInformation), querying the node only if they are
+            not in the cache.
+        """
+        info = self.cached(node)
+        if info is not None:
+            return info
+        greenlet = self.pending.get(node.id)
+        if greenlet is not None:
+            greenlet.join()
+            info = self.cached(node)
+            if info is not None:
+                return info
+        return self._query(node, raise_errors=True)
+
+    def invalidate(self, node=None):
+        """ Removes the capabilities of the node, of all the nodes if node is None, and stops their queries in progress.
+        """
+        if node is None:
+            greenlets = list(self.pending.values())
+            self.pending.clear()
+            self.entries.clear()
+        else:
+            greenlets = [self.pending.pop(node.id)] if node.id in self.pending else []
+            self.entries.pop(node.id, None)
+        for greenlet in greenlets:
+            greenlet.kill(block=False)
+
+
+class RadioProgramSlotCache:
+    """
+    This class defines the map, kept by the controller, of the radio programs loaded in the memory slots of the WMP
+    nodes: node id -> slot position -> hash of the radio program. A radio program already loaded in a slot of the node
+    is activated with the slot position only, without injecting it again, so switching between two known radio
+    programs is a single activation command. The hash is computed on the content of the radio program file when it
+    is readable by the controller, on its name and path otherwise. The map of a node is removed when the node leaves
+    the experiment (call invalidate in the node exit callback), since its slots are lost at restart.
+    """
+
+    def __init__(self):
+        # node id -> {position : radio program hash}
+        self.slots = {}
+        # (radio program name, path) -> radio program hash
+        self.hashes = {}
+
+    def program_hash(self, radio_program_name, radio_program_pointer):
+        key = (radio_program_name, radio_program_pointer)
+        program_hash = self.hashes.get(key)
+        if program_hash is None:
+            digest = hashlib.sha1(str(radio_program_name).encode())
+            if os.path.isfile(str(radio_program_pointer)):
+                with open(radio_program_pointer, 'rb') as radio_program_file:
+                    digest.update(radio_program_file.read())
+            else:
+                digest.update(str(radio_program_pointer).encode())
+            program_hash = digest.hexdigest()
+            self.hashes[key] = program_hash
+        return program_hash
+
+    def lookup(self, node, program_hash):
+        """ Returns the slot position of the node in which the radio program is loaded, None if it is not loaded.
+        """
+        for position, loaded_hash in self.slots.get(node.id, {}).items():
+            if loaded_hash == program_hash:
+                return position
+        return None
+
+    def loaded(self, node, position, program_hash):
+        """ Records the radio program injected in a slot of the node, in place of the previous one.
+        """
+        self.slots.setdefault(node.id, {})[position] = program_hash
+
+    def invalidate(self, node=None):
+        """ Removes the map of the node, of all the nodes if node is None.
+        """
+        if node is None:
+            self.slots.clear()
+        else:
+            self.slots.pop(node.id, None)
+
+    def activation_args(self, node, radio_program_name, radio_program_pointer, position):
+        """ Returns the UPI arguments of the activation of the radio program on the node: the slot position only if
+            the radio program is loaded in a slot, otherwise the radio program path to inject it in position.
+
+        :return UPIargs, program_hash: program_hash is None when the radio program is already loaded.
+        """
+        program_hash = self.program_hash(radio_program_name, radio_program_pointer)
+        loaded_position = self.lookup(node, program_hash)
+        if loaded_position is not None:
+            return {'position' : loaded_position, 'interface' : 'wlan0' }, None
+        return {'position' : position, 'radio_program_name' : radio_program_name, 'path' : radio_program_pointer, 'interface' : 'wlan0' }, program_hash
+
+
+def radio_program_activation_args(node, radio_program_name, radio_program_pointer, position, slot_cache=None):
+    """ Returns the UPI arguments of the activation of a radio program and the hash to record in slot_cache after the
+        injection (see RadioProgramSlotCache.activation_args), the injection arguments if slot_cache is None.
+    """
+    if slot_cache is None:
+        return {'position' : position, 'radio_program_name' : radio_program_name, 'path' : radio_program_pointer, 'interface' : 'wlan0' }, None
+    return slot_cache.activation_args(node, radio_program_name, radio_program_pointer, position)
+
+
 def active_CSMA_radio_program(node, log, global_mgr, current_platform_info):
     """ Active CSMA radio program to the node passed by argument parameter.
         To enable a radio program on WMP platform we need two different action, inject the radio program and activate it.
@@ -335,3 +508,230 @@ def set_TDMA_parameters(node, log, global_mgr, tdma_params):
     #     return False
 
     return True
+
+
+class BatchActivationReport:
+    """
+    This class defines the result of activate_radio_program_batch: per node, the inject, parameters and activation
+    latencies and the result of the activation, plus the nodes that failed or were much slower than the others.
+    The injection of WMP also activates the radio program: 'restored' tells whether the node was switched back to
+    its previous slot right after the injection, 'pending' marks the nodes that did not answer in time, whose
+    injection may still complete later on the node and switch its MAC.
+    """
+
+    def __init__(self, radio_program_name, nodes):
+        self.radio_program_name = radio_program_name
+        self.exec_time = None
+        # node id -> {'node', 'position' of the radio program, 'injected', 'restored', 'pending',
+        #             'inject', 'parameters', 'activate' latencies [s], 'result', 'error'}
+        self.nodes = dict((node.id, {'node': node, 'position': None, 'injected': False, 'restored': False,
+                                     'pending': False, 'inject': None, 'parameters': None, 'activate': None,
+                                     'result': None, 'error': None})
+                          for node in nodes)
+        self.stragglers = []
+
+    def ready_nodes(self):
+        return [entry['node'] for entry in self.nodes.values() if entry['error'] is None]
+
+    def activated_nodes(self):
+        return [entry['node'] for entry in self.nodes.values() if entry['result'] == SUCCESS]
+
+    def pending_nodes(self):
+        """ Returns the nodes reported as failed whose injection may still complete and switch their MAC
+        """
+        return [entry['node'] for entry in self.nodes.values() if entry['pending']]
+
+    def find_stragglers(self, straggler_factor):
+        """ Lists the nodes that failed, and the nodes with an inject latency above straggler_factor times the median.
+        """
+        latencies = sorted(entry['inject'] for entry in self.nodes.values() if entry['inject'] is not None)
+        median = latencies[len(latencies) // 2] if latencies else None
+        self.stragglers = []
+        for node_id, entry in self.nodes.items():
+            if entry['error'] is not None or entry['result'] != SUCCESS:
+                self.stragglers.append(node_id)
+            elif median and entry['inject'] > straggler_factor * median:
+                self.stragglers.append(node_id)
+        return self.stragglers
+
+    def log_report(self, log):
+        log.warning('Radio program %s activated at %s on %d/%d nodes' % (self.radio_program_name, str(self.exec_time),
+                                                                         len(self.activated_nodes()), len(self.nodes)))
+        for node_id in sorted(self.nodes):
+            entry = self.nodes[node_id]
+            log.info('  %s : inject %s%s parameters %s activate %s result %s %s'
+                     % (str(entry['node'].name), _format_latency(entry['inject']),
+                        ' (restored)' if entry['restored'] else '', _format_latency(entry['parameters']),
+                        _format_latency(entry['activate']), str(entry['result']), entry['error'] or ''))
+        if self.stragglers:
+            log.warning('Stragglers : %s' % ', '.join(str(self.nodes[node_id]['node'].name) for node_id in self.stragglers))
+        if self.pending_nodes():
+            log.warning('Injection still running, the MAC may switch later : %s'
+                        % ', '.join(str(node.name) for node in self.pending_nodes()))
+
+
+def _format_latency(latency):
+    return '-' if latency is None else '%.3fs' % latency
+
+
+def activate_radio_program_slot_at(nodes, log, controller, position, clock=None, activation_delay=None, timeout=30):
+    """ Activates a radio program already loaded in a memory slot on a list of nodes at one common execution time,
+        so that the nodes switch MAC together. The execution time is activation_delay seconds from now, by default
+        2 seconds, or the margin of clock. With a ClockOffsetEstimator the execution time is given to each node in
+        its own clock and the activation answers are added to the estimator.
+
+    :param nodes: nodes list in which active the radio program
+    :param log: experiment logging module attribute
+    :param controller: experiment object controller
+    :param position: radio memory slot of the radio program, or dictionary node id -> slot
+    :param clock: ClockOffsetEstimator
+    :param activation_delay: delay between now and the activation [s]
+    :param timeout: maximum wait of the activation answers after the activation [s]
+    :return exec_time, answers: controller time of the activation, dictionary node id -> (result, delay of the answer
+                                from exec_time [s]) of the nodes that answered
+    """
+    log.debug('***************** %s ***************' % activate_radio_program_slot_at.__name__)
+
+    if activation_delay is None:
+        activation_delay = 2 if clock is None else clock.margin(nodes)
+    exec_time = datetime.datetime.now() + datetime.timedelta(seconds=activation_delay)
+    node_exec_times = dict((node.id, exec_time if clock is None else clock.node_time(node, exec_time)) for node in nodes)
+    exec_timestamp = time.mktime(exec_time.timetuple()) + exec_time.microsecond / 1e6
+    answers = {}
+    answered = gevent.event.Event()
+
+    def activation_callback(group, node, data):
+        if node.id not in node_exec_times or node.id in answers:
+            return
+        answers[node.id] = (data, time.time() - exec_timestamp)
+        if clock is not None and data == SUCCESS:
+            # the node has run the activation at its exec_time, before this answer
+            clock.add_received(node, node_exec_times[node.id])
+        if len(answers) == len(node_exec_times):
+            answered.set()
+
+    for node in nodes:
+        UPIargs = {'position' : position[node.id] if isinstance(position, dict) else position, 'interface' : 'wlan0' }
+        controller.exec_time(node_exec_times[node.id]).callback(activation_callback).nodes(node).radio.iface("wlan0").activate_radio_program(UPIargs)
+    if nodes:
+        answered.wait(activation_delay + timeout)
+    return exec_time, answers
+
+
+def activate_radio_program_batch(nodes, log, controller, radio_program_name, platform_info, parameters=None,
+                                 position='2', activation_delay=None, timeout=30, straggler_factor=2, slot_cache=None,
+                                 clock=None, restore_position='1'):
+    """ Activates a radio program on a list of nodes at the same time.
+        The radio program is injected in the memory slot `position` of all the nodes in parallel (one greenlet per
+        node). WMP has no inject-only operation, activate_radio_program with the program path loads the slot and
+        activates it at once: each injected node is switched back to the slot restore_position right away, as
+        active_CSMA_radio_program_slot_1 does, so the network does not run mixed MACs while the other nodes are
+        injected. Then the per node parameters are set, and the slot is activated on all the ready nodes at one
+        common execution time, activation_delay seconds after the last node is ready, so the nodes switch MAC
+        together and start with their new parameters.
+        With a ClockOffsetEstimator the execution time is given to each node in its own clock and the delay is the
+        margin of the estimator, tens of milliseconds for the nodes with round trip samples.
+        The nodes that fail or do not answer within timeout seconds are not activated and are reported as stragglers.
+
+    :param nodes: nodes list in which active the radio program
+    :param log: experiment logging module attribute
+    :param controller: experiment object controller
+    :param radio_program_name: name of the radio program in the node capabilities, e.g. 'TDMA'
+    :param platform_info: the radio capabilities of the nodes, a radio_info_t or a PlatformCapabilityCache
+    :param parameters: dictionary node id -> dictionary of the radio program parameters of the node, e.g. the
+                       TDMA_SUPER_FRAME_SIZE TDMA_NUMBER_OF_SYNC_SLOT TDMA_ALLOCATED_SLOT of set_TDMA_parameters
+    :param position: radio memory slot in which store the radio program
+    :param activation_delay: delay between the end of the injection and the activation [s], if None 2 seconds or
+                             the margin of clock
+    :param timeout: maximum duration of each phase [s]
+    :param straggler_factor: a node with an inject latency above straggler_factor times the median is a straggler
+    :param slot_cache: RadioProgramSlotCache, the radio program is not injected on the nodes that have it in a slot,
+                       they are only activated
+    :param clock: ClockOffsetEstimator, the activation time is corrected by the clock offset of each node and the
+                  activation answers are added to the estimator
+    :param restore_position: slot of the radio program running before the batch, activated again after the
+                             injection; None leaves the injected nodes on the new radio program
+    :return report: BatchActivationReport
+    """
+    log.debug('***************** %s ***************' % activate_radio_program_batch.__name__)
+
+    report = BatchActivationReport(radio_program_name, nodes)
+
+    def prepare(node):
+        entry = report.nodes[node.id]
+        capabilities = platform_info.get(node) if isinstance(platform_info, PlatformCapabilityCache) else platform_info
+        radio_program_pointer = ""
+        if capabilities:
+            for radio_program in capabilities.radio_program_list:
+                if radio_program.radio_prg_name == radio_program_name:
+                    radio_program_pointer = radio_program.radio_prg_pointer
+        if radio_program_pointer == "":
+            entry['error'] = '%s radio program not found in node capabilities list' % radio_program_name
+            return
+        UPIargs, program_hash = radio_program_activation_args(node, radio_program_name, radio_program_pointer, position, slot_cache)
+        entry['position'] = UPIargs['position']
+        if 'path' not in UPIargs:
+            # already loaded in a slot of the node, only the activation is needed
+            entry['inject'] = 0.0
+        else:
+            start = time.time()
+            rvalue = controller.nodes(node).radio.iface("wlan0").activate_radio_program(UPIargs)
+            entry['inject'] = time.time() - start
+            if rvalue != SUCCESS:
+                entry['error'] = 'inject failed (%s)' % str(rvalue)
+                return
+            entry['injected'] = True
+            if program_hash is not None:
+                slot_cache.loaded(node, position, program_hash)
+            if restore_position is not None and restore_position != entry['position']:
+                # the injection has also activated the radio program, the node goes back to the previous one
+                UPIargs = {'position' : restore_position, 'interface' : 'wlan0' }
+                rvalue = controller.nodes(node).radio.iface("wlan0").activate_radio_program(UPIargs)
+                if rvalue != SUCCESS:
+                    entry['error'] = 'restore of slot %s failed (%s), %s is running' % (restore_position, str(rvalue), radio_program_name)
+                    return
+                entry['restored'] = True
+        if parameters and node.id in parameters:
+            start = time.time()
+            UPIargs = dict(parameters[node.id])
+            UPIargs['interface'] = 'wlan0'
+            rvalue = controller.nodes(node).radio.iface("wlan0").set_parameters(UPIargs)
+            entry['parameters'] = time.time() - start
+            if rvalue != SUCCESS:
+                entry['error'] = 'set parameters failed (%s)' % str(rvalue)
+
+    # inject the radio program and set the parameters on all nodes in parallel
+    greenlets = dict((node.id, gevent.spawn(prepare, node)) for node in nodes)
+    gevent.joinall(list(greenlets.values()), timeout=timeout)
+    for node_id, greenlet in greenlets.items():
+        entry = report.nodes[node_id]
+        if not greenlet.ready():
+            greenlet.kill(block=False)
+            entry['error'] = 'no answer in %ss' % str(timeout)
+            # the greenlet is stopped, not the UPI call on the node: an injection or a restore still running
+            # on the node may switch its MAC later
+            entry['pending'] = entry['inject'] is None or (entry['injected'] and not entry['restored']
+                                                           and restore_position not in (None, entry['position']))
+        elif greenlet.exception is not None:
+            entry['error'] = 'error %s' % str(greenlet.exception)
+
+    ready_nodes = report.ready_nodes()
+    if not ready_nodes:
+        log.warning('Radio program %s not injected on any node' % radio_program_name)
+        report.find_stragglers(straggler_factor)
+        return report
+
+    # activate the radio program slot on all the ready nodes at the same time
+    positions = dict((node.id, report.nodes[node.id]['position']) for node in ready_nodes)
+    report.exec_time, answers = activate_radio_program_slot_at(ready_nodes, log, controller, positions, clock,
+                                                               activation_delay, timeout)
+    for node in ready_nodes:
+        entry = report.nodes[node.id]
+        if node.id in answers:
+            entry['result'], entry['activate'] = answers[node.id]
+        else:
+            entry['error'] = 'no activation answer in %ss' % str(timeout)
+
+    report.find_stragglers(straggler_factor)
+    report.log_report(log)
+    return report
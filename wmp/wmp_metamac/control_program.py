@@ -12,13 +12,14 @@ import datetime
 import sys
 from sys import stdout
 from ctypes import *
+import ctypes
 import os
 import csv
 import signal
 import threading
 import math
+import json
 import zmq
-import netifaces as ni
 
 
 
@@ -33,7 +34,21 @@ sys.path.append('../../../upis')
 sys.path.append('../../../framework')
 sys.path.append('../../../agent')
 # from agent_modules.wifi_wmp.wmp_structure import UPI_R
-from agent_modules.wifi_wmp.adaptation_module.libb43 import *
+try:
+	from agent_modules.wifi_wmp.adaptation_module.libb43 import *
+except ImportError:
+	#no WMP framework on this host, only the simulated card can be used
+	B43 = None
+	from metamac_helper.b43_sim import monotonic_time
+from metamac_helper.slot_buffer import SlotRingBuffer
+from metamac_helper.slot_handoff import SlotConsumer, LatencyStats
+from metamac_helper.weight_engine import WeightEngine, EnsembleWeightEngine
+from metamac_helper.emulators import DecisionTable
+from metamac_helper.story_log import StoryLogWriter, STORY_CSV_HEADER
+from metamac_helper.visualizer_publisher import VisualizerPublisher, get_node_ip_address
+from metamac_helper.acquisition import SlotReader
+from metamac_helper.rt_acquisition import RealtimeAcquisition
+from metamac_helper.b43_sim import SimulatedB43
 
 # @controller.set_default_callback()
 # def default_callback(cmd, data):
@@ -44,11 +59,14 @@ from agent_modules.wifi_wmp.adaptation_module.libb43 import *
 
 
 story_file = None
+read_stats_file = None
 reading_thread = None
+slot_reader = None
 
 def signal_handler(signal, frame):
 	story_file.close()
-	reading_thread.do_run = False
+	read_stats_file.close()
+	slot_reader.stop()
 	reading_thread.join()
 	time.sleep(2)
 	sys.exit(0)
@@ -64,17 +82,17 @@ def my_local_control_program():
 	FLAG_USE_BUSY = 0
 	FLAG_READONLY = 0
 	FLAG_VERBOSE = 1
+	FLAG_SCALAR_WEIGHTS = 0 #use the per-slot update_weights instead of the batched WeightEngine
+	FLAG_SNAPSHOT_READ = 1 #read the feedback registers 0x00F0-0x00FC in one bulk operation
+	FLAG_BINARY_STORY = 1 #log slots in story.bin (see metamac_helper/story_log.py) instead of story.csv
+	FLAG_VISUALIZER_PUSH = 1 #fire-and-forget visualizer updates (zmq PUSH) instead of REQ/REP
+	FLAG_TSF_SCHEDULE = 1 #plan the reads on the TSF slot phase instead of every read_interval
+	FLAG_HOT_SWAP = 1 #pre-stage the runner-up protocol in the inactive bytecode slot, switch with one activation write
+	FLAG_RT_ACQUISITION = 0 #run the reading loop in a separate process, pinned, SCHED_FIFO, locked memory, no GC (see metamac_helper/rt_acquisition.py)
 	read_interval = 7000 #12000 #(us)
 
-	PACKET_TO_TRANSMIT	=0x00F0
-	MY_TRANSMISSION		=0x00F2
-	SUCCES_TRANSMISSION	=0x00F4
-	OTHER_TRANSMISSION	=0x00F6
-	BAD_RECEPTION		=0x00FA
-	BUSY_SLOT           =0x00FC
-
+	#the feedback and slot counter registers are defined in metamac_helper/feedback_reader.py
 	NEAR_SLOT	=	43
-	COUNT_SLOT	=	43
 	SINC_SLOT_2	=	40
 	SINC_SLOT_1	=	41
 	SINC_SLOT_0	=	42
@@ -225,16 +243,6 @@ def my_local_control_program():
 
 
 
-	def tdma_emulate(param, slot_num, offset):
-		slot_num += offset
-		tdma_params = param
-		if ((slot_num - tdma_params.frame_offset) % tdma_params.frame_length) == tdma_params.slot_assignment :
-			result = 1.0
-		else :
-			result = 0.0
-
-		return result
-
 	def configure_params(b43, slot, param):
 
 		#while (param != N) {
@@ -253,17 +261,35 @@ def my_local_control_program():
 
 
 		#struct options opt;
+		switch_start = time.perf_counter()
 		active = suite.active_slot # Always 0 or 1 since metamac_init will already have run.
 		inactive = 1 - active
 
 		if (protocol == suite.slots[active]) :
 			#This protocol is already running.
 			pass
+		elif FLAG_HOT_SWAP and protocol == suite.slots[inactive] :
+			#Protocol pre-staged in the inactive slot (see stage_protocol), switch to it with one write.
+			activate_slot(b43, inactive)
+			suite.active_slot = inactive
+			switch_stats['staged'] += 1
+		elif FLAG_HOT_SWAP :
+			#All protocols of the suite share the same FSM: write the parameters in the inactive slot
+			#and activate it, the running protocol is not disturbed while the parameters are written.
+			configure_params(b43, inactive, suite.protocols[protocol].fsm_params)
+			activate_slot(b43, inactive)
+			suite.slots[inactive] = protocol
+			suite.active_slot = inactive
+			switch_stats['unstaged'] += 1
 		else :
 			#Protocol in active slot shares same FSM, but is not the same protocol
 			#(already checked). Write the parameters for this protocol.
 			configure_params(b43, active, suite.protocols[protocol].fsm_params)
 			suite.slots[active] = protocol
+			switch_stats['unstaged'] += 1
+
+		if protocol != suite.active_protocol :
+			switch_latency.add(time.perf_counter() - switch_start)
 
 		# elif (protocol == suite.slots[inactive]):
 		# 	#Switch to other slot.
@@ -304,14 +330,31 @@ def my_local_control_program():
 		suite.active_protocol = protocol
 		suite.last_update = monotonic_time()
 
+	def activate_slot(b43, slot):
+		#switch the running FSM to the bytecode slot (0 or 1), as writeAddressBytecode of the bytecode manager
+		b43.writeAddressBytecode(slot)
+
+	def stage_protocol(b43, suite, protocol):
+		#Write the parameters of protocol in the inactive slot while the active one keeps running,
+		#so that a later switch to it is a single activation write.
+		inactive = 1 - suite.active_slot
+		if protocol == suite.slots[inactive] or protocol == suite.slots[suite.active_slot]:
+			return
+		configure_params(b43, inactive, suite.protocols[protocol].fsm_params)
+		suite.slots[inactive] = protocol
+
 
 	def metamac_evaluate(b43, suite):
 
-		#Identify the best protocol.
+		#Identify the best protocol, and the runner-up to pre-stage.
 		best = 0
 		for i in range(suite.num_protocols):
 			if (suite.weights[i] > suite.weights[best]) :
 				best = i
+		runner_up = -1
+		for i in range(suite.num_protocols):
+			if i != best and (runner_up < 0 or suite.weights[i] > suite.weights[runner_up]) :
+				runner_up = i
 
 		if (suite.cycle) :
 			# struct timespec current_time;
@@ -326,6 +369,9 @@ def my_local_control_program():
 		elif (best != suite.active_protocol):
 			load_protocol(b43, suite, best)
 
+		if FLAG_HOT_SWAP and runner_up >= 0 and not suite.cycle:
+			stage_protocol(b43, suite, runner_up)
+
 	#static void metamac_display(unsigned long loop, struct protocol_suite *suite)
 	def metamac_display(loop, suite):
 		# if (loop > 0):
@@ -344,12 +390,14 @@ def my_local_control_program():
 				stdout.write("%c %5.3f %s -- " % (active_string, suite.weights[i], suite.protocols[i].name))
 			stdout.flush()
 
+		if FLAG_VISUALIZER_PUSH :
+			#serialization and sending are done by the publisher thread
+			visualizer.publish(suite.active_protocol, [suite.weights[i] for i in range(suite.num_protocols)])
+			return
+
 		global socket_visualizer
-		#ip_address = controller.net.get_iface_ip_addr(interface)
-		iface = 'wlan0'
-		ip_address = [inetaddr['addr'] for inetaddr in ni.ifaddresses(iface)[ni.AF_INET]]
 		stock_data = {
-            'node_ip_address': ip_address,
+            'node_ip_address': node_ip_address,
             'active': suite.active_protocol
         }
 
@@ -360,26 +408,11 @@ def my_local_control_program():
 		#print("Received reply [" + str(message) + "]")
 
 	#void queue_multipush(struct metamac_queue *queue, struct metamac_slot *slots, size_t count)
-	def queue_multipush(story_channel, story_file, story_channel_len, story_channel_len_diff):
-
-		ai = story_channel_len - story_channel_len_diff
-		while ai < story_channel_len :
-
-			# print("%d - %d : %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d" %
-			# ( ai, story_channel_len_diff, int(story_channel[ai].slot_num), int(story_channel[ai].read_num), int(story_channel[ai].host_time),
-			# story_channel[ai].tsf_time, story_channel[ai].slot_index, story_channel[ai].slots_passed,
-			# (story_channel[ai].filler), (story_channel[ai].packet_queued), (story_channel[ai].transmitted),
-			# (story_channel[ai].transmit_success), (story_channel[ai].transmit_other),
-			# (story_channel[ai].bad_reception), (story_channel[ai].busy_slot), (story_channel[ai].channel_busy) ))
+	def queue_multipush(story_file, slot_views):
 
-			story_file.write("%d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d\n" %
-			( int(story_channel[ai].slot_num), int(story_channel[ai].read_num), int(story_channel[ai].host_time),
-			story_channel[ai].tsf_time, story_channel[ai].slot_index, story_channel[ai].slots_passed,
-			(story_channel[ai].filler), (story_channel[ai].packet_queued), (story_channel[ai].transmitted),
-			(story_channel[ai].transmit_success), (story_channel[ai].transmit_other),
-			(story_channel[ai].bad_reception), (story_channel[ai].busy_slot), (story_channel[ai].channel_busy) ))
-
-			ai += 1
+		for slots in slot_views:
+			for slot in slots:
+				story_file.write("%d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d\n" % tuple(slot))
 
 		# if (logfile != NULL) {
 		# 			fprintf(logfile, "%llu,%d,%llu,%llu,%llu,%d,%d,%01x,%01x,%01x,%01x,%01x,%01x,%01x,%01x,%s",
@@ -410,153 +443,6 @@ def my_local_control_program():
 
 
 
-	def acquire_slots_channel(story_channel):
-		reading_thread = threading.currentThread()
-		b43_phy = None
-		b43 = B43(b43_phy)
-		slot_time = 2200 #(us)
-
-		slot_num = 0
-		read_num = 0
-		slot_index = 0 #(int)
-		last_slot_index = 0 #(int)
-		tsf = 0 #(uint64_t)
-		last_tsf = 0 #(uint64_t)
-		initial_tsf = 0 #(uint64_t)
-
-		start_time = monotonic_time() #(timespec)
-		loop_end = 0 #(uint64_t)
-
-		initial_tsf = b43.getTSFRegs()
-		tsf = initial_tsf
-		slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7
-		slot_num = (slot_index + 1) % 8
-
-		# metamac control loop
-		# while not controller.is_stopped() :
-		# 	msg = controller.recv(timeout=1)
-		while getattr(reading_thread, "do_run", True):
-
-			current_time =  monotonic_time() #(timespec)
-			loop_start = int((current_time.tv_sec - start_time.tv_sec) * 1000000 + (current_time.tv_nsec - start_time.tv_nsec) / 1000) #(uint64_t )
-			last_tsf = tsf
-			tsf = b43.getTSFRegs()
-			last_slot_index = slot_index
-
-
-			''' replaced the following part with UPI get_measurements_periodic
-			START
-			'''
-
-			slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7
-
-			packet_queued = b43.shmRead16(b43.B43_SHM_SHARED, PACKET_TO_TRANSMIT) #(uint)
-			transmitted = b43.shmRead16(b43.B43_SHM_SHARED, MY_TRANSMISSION) #(uint)
-			transmit_success = b43.shmRead16(b43.B43_SHM_SHARED, SUCCES_TRANSMISSION) #(uint)
-			transmit_other = b43.shmRead16(b43.B43_SHM_SHARED, OTHER_TRANSMISSION) #(uint)
-			bad_reception = b43.shmRead16(b43.B43_SHM_SHARED, BAD_RECEPTION) #(uint)
-			busy_slot = b43.shmRead16(b43.B43_SHM_SHARED, BUSY_SLOT) #(uint)
-
-			end_slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7 #(int)
-
-			'''
-			STOP
-			'''
-			channel_busy = 0 #(uint)
-			if (FLAG_USE_BUSY) :
-				channel_busy = (transmitted & ~transmit_success) |((transmit_other | bad_reception | busy_slot) & ~(transmitted & transmit_success))
-			else:
-				channel_busy = (transmitted & ~transmit_success) |((transmit_other | bad_reception) & ~(transmitted & transmit_success))
-
-			slots_passed = slot_index - last_slot_index #(int)
-			if slots_passed < 0:
-				slots_passed = slots_passed + 8
-
-			actual = tsf - last_tsf #int64_t actual = ((int64_t)tsf) - ((int64_t)last_tsf);
-
-			#print(" read %d - last_tsf %d - tsf %d - diff %d: %x, %x, %x, %x, %x, %x, %x" % (read_num, last_tsf, tsf, actual, packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot, end_slot_index))
-
-			# if (actual < 0 or actual > 200000) :
-			# 	print("Received TSF difference of %lld between consecutive reads.\n", actual)
-			# 	# Unresolved bug with hardware/firmware/kernel driver causes occasional large jumps
-			# 	#in the TSF counter value. In this situation use time from the OS timer instead.
-			# 	#actual = ((int64_t)loop_start) - ((int64_t)loop_end)
-			# 	actual = loop_start - loop_end
-			# min_diff = abs(actual - slots_passed * slot_time) #(int64_t )
-			# #Suppose last_slot_index is 7 and slot_index is 5. Then, since the slot
-			# #is a value mod 8 we know the actual number of slots which have passed is
-			# #>= 6 and congruent to 6 mod 8. Using the TSF counter from the network card,
-			# #we find the most likely number of slots which have passed. */
-			# diff = abs(actual - (slots_passed + 8) * slot_time) #(int64_t )
-			# while (diff < min_diff) :
-			# 	slots_passed += 8
-			# 	min_diff = diff
-			# 	diff = abs(actual - (slots_passed + 8) * slot_time)
-			# #Because the reads are not atomic, the values for the slot
-			# #indicated by slot_index are effectively unstable and could change between
-			# #the reads for the different feedback variables. Thus, only the last 7 slots
-			# #can be considered valid. If more than 7 slots have passed, we have to inject
-			# #empty slots to maintain the synchronization. Note that the 7th most recent
-			# #slot is at an offset of -6 relative to the current slot, hence the -1. */
-			slot_offset = slots_passed #(int)
-			# #int max_read_offset = (slot_index <= end_slot_index) ? slot_index - end_slot_index + 7 : slot_index - end_slot_index - 1;
-			# if (slot_index <= end_slot_index) :
-			# 	max_read_offset =  slot_index - end_slot_index + 7
-			# else:
-			# 	max_read_offset = slot_index - end_slot_index - 1
-			#
-			# while slot_offset > max_read_offset:
-			# 	slot_offset-= 1
-			# 	#Empty filler slot
-			# 	slot_num+=1
-
-			slots = [ metamac_slot() for i in range(8)] #(struct metamac_slot) |!!! warning for memory leak
-			ai = 0
-			while slot_offset > 0 :
-				slot_offset-=1
-				si = slot_index - slot_offset #(int)
-				if  si < 0 :
-					si = si + 8
-
-				slot_num+=1
-				slots[ai].slot_num = slot_num
-				slots[ai].read_num = read_num
-				slots[ai].host_time = loop_start
-				slots[ai].tsf_time = tsf
-				slots[ai].slot_index = slot_index
-				slots[ai].slots_passed = slots_passed
-				slots[ai].filler = 0
-				slots[ai].packet_queued = (packet_queued >> si) & 1
-				slots[ai].transmitted = (transmitted >> si) & 1
-				slots[ai].transmit_success = (transmit_success >> si) & 1
-				slots[ai].transmit_other = (transmit_other >> si) & 1
-				slots[ai].bad_reception = (bad_reception >> si) & 1
-				slots[ai].busy_slot = (busy_slot >> si) & 1
-				slots[ai].channel_busy = (channel_busy >> si) & 1
-				ai+=1
-
-			for i in range(ai):
-			# 	#save in dynamic array
-			 	story_channel.append(slots[i])
-
-			# for i in range(ai):
-			# 	print("%d, %d, %d, " %   ( int(story_channel[i].slot_num), int(story_channel[i].read_num), int(story_channel[i].host_time) ))
-
-			current_time =  monotonic_time() #(timespec)
-			loop_end = int((current_time.tv_sec - start_time.tv_sec) * 1000000 + (current_time.tv_nsec - start_time.tv_nsec) / 1000)
-			delay = (loop_start + read_interval - loop_end) #(int64_t) #delay = ((int64_t)loop_start) + read_interval - ((int64_t)loop_end) #(int64_t)
-			#print("ai %d - loop_start %d - loop_end %d - diff %d - delay %d - story_channel_len %d" % (ai, loop_start, loop_end, loop_end-loop_start, delay, len(story_channel) ))
-			# we cant make dalay minor of ~7ms
-			if (delay > 0):
-				#usleep(delay)
-				libc.usleep(int(delay))
-
-			# current_time_delay =  monotonic_time() #(timespec)
-			# loop_end_delay = int((current_time_delay.tv_sec - current_time.tv_sec) * 1000000 + (current_time_delay.tv_nsec - current_time.tv_nsec) / 1000)
-			# print(" delay %d" % (loop_end_delay))
-
-			read_num+=1
-
 
 	#Performs the computation for emulating the suite of protocols
 	#for a single slot, and adjusting the weights.
@@ -577,10 +463,11 @@ def my_local_control_program():
 
 
 		#if (suite.protocols[suite.active_protocol].emulator == tdma_emulate && current_slot.transmitted):
+		slot_num = int(current_slot.slot_num)
 		if (current_slot.transmitted):
 			#Update slot_offset
 			params = suite.protocols[suite.active_protocol].parameter
-			neg_offset = (current_slot.slot_num - params.frame_offset - params.slot_assignment) % params.frame_length
+			neg_offset = (slot_num - params.frame_offset - params.slot_assignment) % params.frame_length
 			suite.slot_offset = (params.frame_length - neg_offset) % params.frame_length
 
 			#If there is no packet queued for this slot, consider all protocols to be correct
@@ -594,12 +481,14 @@ def my_local_control_program():
 				z = 1.0
 
 
+			#decisions of all protocols, from the precompiled tables
+			decisions = decision_table.row(slot_num, suite.slot_offset)
 			for p in range(suite.num_protocols) :
 				# d is the decision of this component protocol - between 0 and 1
 #				d = suite.protocols[p].emulator(suite->protocols[p].parameter,
 #					current_slot.slot_num, suite->slot_offset, suite->last_slot);
 
-				d = tdma_emulate(suite.protocols[p].parameter, current_slot.slot_num, suite.slot_offset)
+				d = decisions[p]
 
 #				stdout.write("[%d] d=%e, z=%e \n" % (p, d, z,))
 
@@ -622,7 +511,14 @@ def my_local_control_program():
 #			for p in range(suite.num_protocols):
 #				stdout.write("%5.3f\n" % (suite.weights[p]))
 
-		suite.last_slot = current_slot
+		set_last_slot(suite, current_slot)
+
+	#Slot information for last to be emulated, copied from a ring buffer row.
+	def set_last_slot(suite, current_slot):
+		suite.last_slot.slot_num = int(current_slot.slot_num)
+		suite.last_slot.packet_queued = int(current_slot.packet_queued)
+		suite.last_slot.transmitted = int(current_slot.transmitted)
+		suite.last_slot.channel_busy = int(current_slot.channel_busy)
 
 	socket_visualizer = None
 
@@ -652,15 +548,38 @@ def my_local_control_program():
     #         controller.send_upstream({"myResult": result})
 
 	if len(sys.argv) < 2:
-		sys.exit('Usage: %s eta_value' % sys.argv[0])
+		sys.exit('Usage: %s eta_value[,eta_value...] [b43|sim[:pattern]]' % sys.argv[0])
+
+	#backend of the shared memory: the b43 card, or the simulated card (see metamac_helper/b43_sim.py)
+	#with one of its traffic patterns, e.g. sim:aloha
+	backend = sys.argv[2] if len(sys.argv) > 2 else 'b43'
+	if backend.startswith('sim'):
+		sim_b43 = SimulatedB43(backend.partition(':')[2] or 'tdma')
+		new_b43 = lambda: sim_b43
+	else:
+		if B43 is None:
+			sys.exit('libb43 not available, use the simulated card: %s eta_value sim' % sys.argv[0])
+		b43_phy = None
+		new_b43 = lambda: B43(b43_phy)
 
 	suite = protocol_suite()
 	num_protocols = 4
 	#eta = 0.5
-	eta = float(sys.argv[1])
-	print('eta = %f' % eta)
-
-	socket_visualizer()
+	#with a comma separated list of eta values, the weights of every eta are computed on the same slots
+	#and the protocol is chosen by the eta with the fewest wrong decisions (see EnsembleWeightEngine)
+	etas = [float(value) for value in sys.argv[1].split(',')]
+	eta = etas[0]
+	print('eta = %s' % ', '.join('%f' % value for value in etas))
+
+	#ip address is read once, it is sent with every visualizer update, the simulated card has no wlan0
+	if backend.startswith('sim'):
+		node_ip_address = ['127.0.0.1']
+	else:
+		node_ip_address = get_node_ip_address('wlan0')
+	if FLAG_VISUALIZER_PUSH :
+		visualizer = VisualizerPublisher("tcp://10.8.8.6:8300", node_ip_address)
+	else:
+		socket_visualizer()
 
 	protocols = [protocol() for i in range(num_protocols)]
 
@@ -751,31 +670,63 @@ def my_local_control_program():
 	suite.last_slot.channel_busy = 0
 	suite.cycle = 0
 
-	story_channel = [] # [ metamac_slot() ]
+	#decision tables of the protocol emulators (see metamac_helper/emulators.py), for the per-slot update
+	decision_table = DecisionTable.from_protocol_structs(protocols)
+
+	if len(etas) > 1 :
+		if FLAG_SCALAR_WEIGHTS :
+			sys.exit('several eta values need the batched weight update, set FLAG_SCALAR_WEIGHTS = 0')
+		weight_engine = EnsembleWeightEngine.from_suite(suite, eta=etas)
+	else:
+		weight_engine = WeightEngine.from_suite(suite)
+
 	global story_file
+	global read_stats_file
 	global reading_thread
-	# slots = [ metamac_slot() for i in range(8)]
-	# story_channel.append(slots[0])
+	global slot_reader
 	# share_queue = Queue()
 
-	reading_thread = threading.Thread(target=acquire_slots_channel, args=(story_channel,))
-	reading_thread.start()
+	if FLAG_RT_ACQUISITION :
+		#slots are handed over through shared memory, the reading process is joined like the reading thread
+		slot_reader = RealtimeAcquisition(new_b43, read_interval, FLAG_USE_BUSY, FLAG_SNAPSHOT_READ,
+			tsf_schedule=FLAG_TSF_SCHEDULE)
+		slot_ring = slot_reader.slot_ring
+		slot_reader.start()
+		reading_thread = slot_reader
+	else:
+		slot_ring = SlotRingBuffer()
+		slot_reader = SlotReader(new_b43(), slot_ring, read_interval, FLAG_USE_BUSY, FLAG_SNAPSHOT_READ,
+			tsf_schedule=FLAG_TSF_SCHEDULE)
+		reading_thread = threading.Thread(target=slot_reader.run)
+		reading_thread.start()
 	# p = Process(target=acquire_slots_channel, args=(share_queue,))
 	# p.start()
 	#p.join()
 
 	time.sleep(2)
+	if FLAG_RT_ACQUISITION :
+		print('reading process settings: %s' % (', '.join(slot_reader.rt_settings()) or 'none'))
+
 
+	b43 = new_b43()
+	if FLAG_HOT_SWAP and not hasattr(b43, 'writeAddressBytecode'):
+		print('bytecode activation not available on this backend, protocols are switched in place')
+		FLAG_HOT_SWAP = 0
+	#time to switch protocol, from the decision to the last shared memory write
+	switch_latency = LatencyStats()
+	switch_stats = {'staged': 0, 'unstaged': 0}
 
-	b43_phy = None
-	b43 = B43(b43_phy)
+	if FLAG_BINARY_STORY :
+		story_file = StoryLogWriter("story.bin")
+	else:
+		story_file = open("story.csv", "w")
+		story_file.write(STORY_CSV_HEADER)
 
-	story_file = open("story.csv", "w")
-	story_file.write("slot_num, read_num, host_time, tsf_time, slot_index, slots_passed, \
-	 filler, packet_queued, transmitted, transmit_success, transmit_other, \
-	 bad_reception, busy_slot, channel_busy \n")
+	#one line per display interval, flushed on every line
+	read_stats_file = open("read_histograms.jsonl", "w", 1)
 
-	story_channel_len = 0
+	#at most the last 60 slots written by the reading thread are processed in a batch
+	slot_consumer = SlotConsumer(slot_ring, max_batch=60)
 	# metamac control loop
 	# while not controller.is_stopped() :
 	# 	msg = controller.recv(timeout=1)
@@ -786,34 +737,36 @@ def my_local_control_program():
 
 	while True: #(metamac_loop_break == 0)
 		#print("Main thread")
-		time.sleep(0.1)
-
-		if( (len(story_channel) - story_channel_len) > 60):
-			story_channel_len_old = len(story_channel)-60
-		else:
-			story_channel_len_old = story_channel_len
-
-		story_channel_len = len(story_channel)
-		story_channel_len_diff = story_channel_len - story_channel_len_old
-		#print('\n\nstory_channel len %d - diff %d - last slot num %d' % (story_channel_len, story_channel_len_diff, story_channel[story_channel_len-1].slot_num))
+		#wake up as soon as the reading thread publishes a read
+		slot_views = slot_consumer.next_batch(timeout=0.1)
 
 		#store channel evolution on file
-		if story_channel_len_diff > 0 :
+		if slot_views :
 		#
         # 	# struct metamac_slot slots[16];
         # 	# size_t count = queue_multipop(queue, slots, ARRAY_SIZE(slots));
         #
-			queue_multipush(story_channel, story_file, story_channel_len, story_channel_len_diff)
+			if FLAG_BINARY_STORY :
+				story_file.write(slot_views)
+			else:
+				queue_multipush(story_file, slot_views)
 
-			for i in range((story_channel_len - story_channel_len_diff), story_channel_len ):
-				#print('\n\n i %d -story_channel len %d - diff %d - last slot num %d' % (i, story_channel_len, story_channel_len_diff, story_channel[story_channel_len-1].slot_num))
-				update_weights(suite, story_channel[i], i)
+			if FLAG_SCALAR_WEIGHTS :
+				for slots in slot_views:
+					for i in range(len(slots)):
+						update_weights(suite, slots[i], i)
+			else:
+				for slots in slot_views:
+					weight_engine.update(slots, suite.active_protocol)
+				weight_engine.store(suite)
+				set_last_slot(suite, slot_views[-1][-1])
 
 
 		#Update running protocol
 		#if (!(flags & FLAG_READONLY)) :
 		if (not FLAG_READONLY):
 			metamac_evaluate(b43, suite)
+		slot_consumer.batch_done()
 
 		if FLAG_VERBOSE :
 			current_time =  monotonic_time() #(timespec)
@@ -821,6 +774,17 @@ def my_local_control_program():
 			# Update display every 1 second
 			if (timediff > 1000000) :
 				metamac_display(loop, suite)
+				latency = slot_consumer.latency.summary()
+				stdout.write("latency p50 %.2f ms p99 %.2f ms max %.2f ms -- skipped %d " % (latency['p50'], latency['p99'], latency['max'], slot_consumer.skipped))
+				#reads of the last interval: wake-up jitter, slots per read and filler slots histograms
+				read_histograms = slot_reader.take_histograms().to_dict()
+				read_stats_file.write(json.dumps(read_histograms) + "\n")
+				if len(etas) > 1 :
+					stdout.write("-- eta %.3f " % suite.eta)
+				switch = switch_latency.summary()
+				stdout.write("-- switches %d staged %d latency p50 %.3f ms max %.3f ms " % (switch['count'], switch_stats['staged'], switch['p50'], switch['max']))
+				stdout.write("-- reads %d fillers %d (%d slots per read) deadline misses %d " % (read_histograms['reads'], read_histograms['filler_slots'], slot_reader.read_slots, slot_reader.deadline_misses))
+				stdout.flush()
 				loop+=1
 				last_update_time = current_time
 
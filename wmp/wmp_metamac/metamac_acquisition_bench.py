@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+metamac_acquisition_bench.py: benchmark of the MetaMAC reading loop on the simulated b43 card
+
+Runs the reading loop of control_program.py (metamac_helper/acquisition.py) on the simulated card
+(metamac_helper/b43_sim.py) for each read interval, with the control loop consuming the slots in the
+main thread, and reports the loop jitter, the slots lost and the CPU usage. Slots are lost when reads
+are more than 7 slots apart: with reconciliation they are written as filler slots, the ones still missing
+are the slots the reconciliation could not account for. A read misses its deadline when its wake-up
+lateness plus its duration exceed half a slot.
+
+Usage:
+   metamac_acquisition_bench.py [options]
+
+Options:
+   --interval values   comma separated list of read intervals [us] [default: 7000,5000,3000,2000,1000,500]
+   --duration seconds  duration of each run [default: 5]
+   --pattern name      traffic pattern of the simulated card (idle, tdma, aloha, mixed) [default: tdma]
+   --eta value         eta of the weight update in the control loop [default: 0.5]
+   --no-consumer       run the reading loop alone
+   --fixed             wake up every read interval instead of on the TSF slot phase
+   --histograms        print the histograms of wake-up jitter, slots per read and fillers per read
+
+Example:
+   ./metamac_acquisition_bench.py --interval 7000,2000,1000 --duration 10 --pattern aloha
+
+Other options:
+   -h, --help          show this help message and exit
+   --version           show version and exit
+"""
+
+import threading
+import time
+
+from metamac_helper.acquisition import SlotReader
+from metamac_helper.b43_sim import SimulatedB43
+from metamac_helper.protocols import PROTOCOL_SUITES
+from metamac_helper.slot_buffer import SlotRingBuffer
+from metamac_helper.slot_handoff import SlotConsumer
+from metamac_helper.weight_engine import WeightEngine
+
+__author__ = "Domenico Garlisi"
+__copyright__ = "Copyright (c) 2016, Technische Universität Berlin"
+__version__ = "0.1.0"
+
+
+def run_interval(read_interval, duration, pattern, eta, consumer=True, tsf_schedule=True):
+    """ Runs the reading loop for duration seconds and returns its statistics.
+    """
+    b43 = SimulatedB43(pattern)
+    slot_ring = SlotRingBuffer()
+    slot_reader = SlotReader(b43, slot_ring, read_interval, tsf_schedule=tsf_schedule)
+    cpu_time = {}
+
+    def reading_loop():
+        start = time.thread_time()
+        slot_reader.run()
+        cpu_time['reader'] = time.thread_time() - start
+
+    start_slot = b43.current_slot()
+    start = time.monotonic()
+    process_start = time.process_time()
+    reading_thread = threading.Thread(target=reading_loop)
+    reading_thread.start()
+
+    if consumer:
+        engine = WeightEngine.from_protocols(PROTOCOL_SUITES['tdma4'], eta)
+        slot_consumer = SlotConsumer(slot_ring, max_batch=60)
+        active_protocol = 1
+        while time.monotonic() - start < duration:
+            for slots in slot_consumer.next_batch(timeout=0.1):
+                engine.update(slots, active_protocol)
+            active_protocol = engine.best_protocol()
+            slot_consumer.batch_done()
+    else:
+        time.sleep(duration)
+
+    slot_reader.stop()
+    reading_thread.join()
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - process_start
+
+    # slots run by the card during the reads, against the slots written by the loop
+    slots = b43.current_slot() - start_slot
+    recorded = slot_ring.write_seq
+    jitter = slot_reader.jitter.summary()
+    return {'interval': read_interval,
+            'reads': slot_reader.read_num,
+            'slots': slots,
+            'missed': max(slots - recorded, 0),
+            'missed_rate': max(slots - recorded, 0) / float(slots) if slots else 0.0,
+            'fillers': slot_reader.filler_slots,
+            'deadline_misses': slot_reader.deadline_misses,
+            'read_slots': slot_reader.read_slots,
+            'histograms': slot_reader.take_histograms().to_dict(),
+            'jitter_p50': jitter['p50'],
+            'jitter_p99': jitter['p99'],
+            'jitter_max': jitter['max'],
+            'read_p50': slot_reader.read_time.summary()['p50'],
+            'reader_cpu': cpu_time['reader'] / elapsed,
+            'process_cpu': cpu / elapsed}
+
+
+def main(args):
+    intervals = [int(interval) for interval in args['--interval'].split(',')]
+    duration = float(args['--duration'])
+    print("%9s %8s %8s %8s %8s %8s %8s %10s %10s %10s %9s %9s %9s" % ('interval', 'reads', 'slots', 'fillers', 'missed',
+          'missed%', 'deadline', 'jit p50', 'jit p99', 'jit max', 'read p50', 'cpu rd%', 'cpu all%'))
+    results = []
+    for read_interval in intervals:
+        result = run_interval(read_interval, duration, args['--pattern'], float(args['--eta']),
+                              not args['--no-consumer'], not args['--fixed'])
+        results.append(result)
+        print("%7dus %8d %8d %8d %8d %7.2f%% %8d %8.3fms %8.3fms %8.3fms %7.3fms %8.1f%% %8.1f%%" % (
+            result['interval'], result['reads'], result['slots'], result['fillers'], result['missed'],
+            result['missed_rate'] * 100, result['deadline_misses'], result['jitter_p50'], result['jitter_p99'], result['jitter_max'],
+            result['read_p50'], result['reader_cpu'] * 100, result['process_cpu'] * 100))
+
+    if args['--histograms']:
+        for result in results:
+            histograms = result['histograms']
+            print("")
+            print("%dus, %d slots per read at the end" % (result['interval'], result['read_slots']))
+            print("  jitter [us]    : %s" % ', '.join("%d+: %d" % (edge, count) for edge, count in
+                                                     zip(histograms['jitter_bins_us'], histograms['jitter']) if count))
+            print("  slots per read : %s" % ', '.join("%d: %d" % (slots, count) for slots, count in
+                                                     enumerate(histograms['slots_per_read']) if count))
+            print("  fillers        : %s" % ', '.join("%d: %d" % (fillers, count) for fillers, count in
+                                                     enumerate(histograms['fillers']) if count))
+
+
+if __name__ == "__main__":
+    try:
+        from docopt import docopt
+    except:
+        print("""
+        Please install docopt using:
+            pip install docopt==0.6.1
+        For more refer to:
+        https://github.com/docopt/docopt
+        """)
+        raise
+
+    args = docopt(__doc__, version=__version__)
+    main(args)
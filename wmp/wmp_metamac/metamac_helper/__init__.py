@@ -0,0 +1,2 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import time
+import numpy as np
+
+from .feedback_reader import read_feedback_snapshot, PACKET_TO_TRANSMIT, MY_TRANSMISSION, SUCCES_TRANSMISSION, \
+    OTHER_TRANSMISSION, BAD_RECEPTION, BUSY_SLOT, COUNT_SLOT
+from .slot_buffer import SLOT_INDEX_MODULO
+from .slot_handoff import LatencyStats
+
+# TSF differences out of this range between consecutive reads are jumps of the counter [us].
+MAX_TSF_DIFF = 200000
+
+# Slots between two reads with the TSF scheduler: the feedback masks keep 8 slots, but the slot of the
+# read is unstable and the read itself can be late, so stay well below.
+MAX_READ_SLOTS = 6
+
+# Bin edges of the wake-up jitter histogram [us], the last bin is open.
+JITTER_BINS = (0, 50, 100, 200, 500, 1000, 2200, 4400, 8800)
+# Slots per read and fillers per read above these values go in the last bin.
+MAX_SLOTS_BIN = 16
+MAX_FILLERS_BIN = 16
+
+
+class ReadHistograms:
+    """
+    This class defines the histograms of the reads of one reporting interval: wake-up jitter (lateness
+    with respect to the planned wake-up), slots passed per read and filler slots per read.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.reads = 0
+        self.jitter = np.zeros(len(JITTER_BINS), dtype=np.int64)
+        self.slots_per_read = np.zeros(MAX_SLOTS_BIN + 1, dtype=np.int64)
+        self.fillers = np.zeros(MAX_FILLERS_BIN + 1, dtype=np.int64)
+        self.filler_slots = 0
+
+    def add(self, jitter, slots_passed, fillers):
+        """
+        :param jitter: wake-up lateness [us].
+        :param slots_passed: slots passed since the previous read.
+        :param fillers: filler slots written by the read.
+        """
+        self.reads += 1
+        self.jitter[max(np.searchsorted(JITTER_BINS, jitter, side='right') - 1, 0)] += 1
+        self.slots_per_read[min(slots_passed, MAX_SLOTS_BIN)] += 1
+        self.fillers[min(fillers, MAX_FILLERS_BIN)] += 1
+        self.filler_slots += fillers
+
+    def to_dict(self):
+        """ Returns the histograms as a JSON serializable dictionary.
+        """
+        return {'start': self.start,
+                'stop': time.time(),
+                'reads': self.reads,
+                'filler_slots': self.filler_slots,
+                'jitter_bins_us': list(JITTER_BINS),
+                'jitter': self.jitter.tolist(),
+                'slots_per_read': self.slots_per_read.tolist(),
+                'fillers': self.fillers.tolist()}
+
+
+class SlotReader:
+    """
+    This class defines the reading loop of the local control program (acquire_slots_channel): it reads the
+    TSF, the slot counter and the feedback registers of the card and writes the slots passed since the
+    previous read in a SlotRingBuffer.
+    The backend is any object with the B43 shared memory interface: the B43 class of libb43 for the card,
+    b43_sim.SimulatedB43 for the simulated one.
+
+    The 3 bit slot counter only tells the number of slots passed modulo 8: the TSF difference between two
+    reads gives the most likely number, and the slots older than the ones still held by the feedback masks
+    are written as filler slots, so the slot numbering stays in sync when the loop oversleeps.
+    With tsf_schedule the wake-up is planned on the TSF slot phase, in the middle of a slot (where the slot
+    counter is stable) every read_slots slots. read_slots starts from read_interval and is lowered by one
+    when a read needs fillers or wakes up more than half a slot late, then raised back after a run of
+    clean reads. Without tsf_schedule the loop wakes up every read_interval.
+
+    The loop keeps statistics of its own timing: the wake-up lateness, the time spent reading the card,
+    the reads that missed their deadline and the histograms of the current reporting interval (see
+    take_histograms).
+    """
+
+    def __init__(self, b43, slot_ring, read_interval=7000, use_busy=False, snapshot_read=True,
+                 slot_time=2200, stats_window=4096, tsf_schedule=True, clean_reads=100, deadline=None):
+        """
+        :param b43: B43 backend.
+        :param slot_ring: SlotRingBuffer, written only by this loop.
+        :param read_interval: time between the start of two reads [us].
+        :param use_busy: consider busy slots as channel busy.
+        :param snapshot_read: read the feedback registers as one snapshot (see feedback_reader).
+        :param slot_time: slot duration [us].
+        :param stats_window: number of samples kept for the timing statistics.
+        :param tsf_schedule: plan the wake-up on the TSF slot phase.
+        :param clean_reads: number of reads without fillers and late wake-ups before read_slots is raised.
+        :param deadline: maximum lateness plus duration of a read [us], default half a slot: a read planned in
+            the middle of a slot has to end before the slot counter changes.
+        """
+        self.b43 = b43
+        self.slot_ring = slot_ring
+        self.read_interval = read_interval
+        self.use_busy = use_busy
+        self.snapshot_read = snapshot_read
+        self.slot_time = slot_time
+        self.tsf_schedule = tsf_schedule
+        self.clean_reads = clean_reads
+        self.deadline = slot_time // 2 if deadline is None else deadline
+        self.max_read_slots = min(max(read_interval // slot_time, 1), MAX_READ_SLOTS)
+        self.read_slots = self.max_read_slots
+        # TSF value modulo slot_time at the beginning of a slot, learned when the counter changes during a read
+        self.slot_phase = 0
+        self.do_run = True
+        self.slot_num = 0
+        self.read_num = 0
+        self.filler_slots = 0
+        self.tsf_jumps = 0
+        self.deadline_misses = 0
+        # lateness of the start of a read with respect to its schedule [s]
+        self.jitter = LatencyStats(stats_window)
+        # duration of the register reads of a loop [s]
+        self.read_time = LatencyStats(stats_window)
+        self.histograms = ReadHistograms()
+        self._clean = 0
+
+    def read_feedback(self):
+        """ Reads the feedback registers.
+
+        :return: tuple (packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot).
+        """
+        b43 = self.b43
+        if self.snapshot_read:
+            return read_feedback_snapshot(b43)
+        return (b43.shmRead16(b43.B43_SHM_SHARED, PACKET_TO_TRANSMIT),
+                b43.shmRead16(b43.B43_SHM_SHARED, MY_TRANSMISSION),
+                b43.shmRead16(b43.B43_SHM_SHARED, SUCCES_TRANSMISSION),
+                b43.shmRead16(b43.B43_SHM_SHARED, OTHER_TRANSMISSION),
+                b43.shmRead16(b43.B43_SHM_SHARED, BAD_RECEPTION),
+                b43.shmRead16(b43.B43_SHM_SHARED, BUSY_SLOT))
+
+    def read_done(self, late, slots_passed, fillers, duration):
+        """ Records the timing of a read.
+
+        :param late: wake-up lateness [us].
+        :param slots_passed: slots passed since the previous read.
+        :param fillers: filler slots written by the read.
+        :param duration: time spent reading the card [us].
+        """
+        self.filler_slots += fillers
+        self.histograms.add(late, slots_passed, fillers)
+        self.read_time.add(duration / 1000000.0)
+        if late + duration > self.deadline:
+            self.deadline_misses += 1
+
+    def take_histograms(self):
+        """ Returns the histograms of the current reporting interval and starts a new one.
+            Called by another thread: a read in progress may still be added to the returned histograms.
+        """
+        histograms = self.histograms
+        self.histograms = ReadHistograms()
+        return histograms
+
+    def reconcile(self, slots_passed, actual):
+        """ Returns the most likely number of slots passed, given the number modulo 8 and the time passed.
+
+        :param slots_passed: slots passed modulo 8.
+        :param actual: time passed since the previous read [us].
+        """
+        slot_time = self.slot_time
+        # Suppose last_slot_index is 7 and slot_index is 5. Then, since the slot is a value mod 8 we know
+        # the actual number of slots which have passed is >= 6 and congruent to 6 mod 8. Using the TSF
+        # counter from the network card, we find the most likely number of slots which have passed.
+        min_diff = abs(actual - slots_passed * slot_time)
+        diff = abs(actual - (slots_passed + SLOT_INDEX_MODULO) * slot_time)
+        while diff < min_diff:
+            slots_passed += SLOT_INDEX_MODULO
+            min_diff = diff
+            diff = abs(actual - (slots_passed + SLOT_INDEX_MODULO) * slot_time)
+        return slots_passed
+
+    def adapt(self, fillers, late):
+        """ Adapts the number of slots between reads after a read.
+        """
+        if fillers > 0 or late > self.slot_time // 2:
+            self.read_slots = max(self.read_slots - 1, 1)
+            self._clean = 0
+            return
+        self._clean += 1
+        if self._clean >= self.clean_reads and self.read_slots < self.max_read_slots:
+            self.read_slots += 1
+            self._clean = 0
+
+    def next_wakeup(self, tsf, elapsed):
+        """ Returns the delay [us] to the middle of the slot read_slots slots after the one of the read.
+
+        :param tsf: TSF value of the read [us].
+        :param elapsed: host time passed since the TSF was read [us].
+        """
+        slot_time = self.slot_time
+        slot_start = tsf - (tsf - self.slot_phase) % slot_time
+        target = slot_start + self.read_slots * slot_time + slot_time // 2
+        return target - tsf - elapsed
+
+    def stop(self):
+        self.do_run = False
+
+    def run(self):
+        b43 = self.b43
+        slot_ring = self.slot_ring
+        read_interval = self.read_interval
+        slot_time = self.slot_time
+
+        start_time = time.monotonic()
+        scheduled = 0
+        loop_start = 0
+
+        tsf = b43.getTSFRegs()
+        slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7
+
+        while self.do_run:
+            last_loop_start = loop_start
+            loop_start = int((time.monotonic() - start_time) * 1000000)
+            late = loop_start - scheduled if self.read_num > 0 else 0
+            self.jitter.add(late / 1000000.0)
+            last_tsf = tsf
+            tsf = b43.getTSFRegs()
+            last_slot_index = slot_index
+
+            slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7
+            packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot = self.read_feedback()
+            end_slot_index = b43.shmRead16(b43.B43_SHM_REGS, COUNT_SLOT) & 0x7
+            read_end = int((time.monotonic() - start_time) * 1000000)
+
+            if end_slot_index != slot_index:
+                # a slot began during the read
+                self.slot_phase = (tsf + (read_end - loop_start) // 2) % slot_time
+
+            if self.use_busy:
+                channel_busy = (transmitted & ~transmit_success) | ((transmit_other | bad_reception | busy_slot) & ~(transmitted & transmit_success))
+            else:
+                channel_busy = (transmitted & ~transmit_success) | ((transmit_other | bad_reception) & ~(transmitted & transmit_success))
+
+            slots_passed = slot_index - last_slot_index
+            if slots_passed < 0:
+                slots_passed = slots_passed + 8
+
+            actual = tsf - last_tsf
+            if actual < 0 or actual > MAX_TSF_DIFF:
+                # Unresolved bug with hardware/firmware/kernel driver causes occasional large jumps
+                # in the TSF counter value. In this situation use time from the OS timer instead.
+                self.tsf_jumps += 1
+                actual = loop_start - last_loop_start
+            slots_passed = self.reconcile(slots_passed, actual)
+
+            # Because the reads are not atomic, the values for the slot indicated by slot_index are
+            # effectively unstable and could change between the reads for the different feedback variables.
+            # Thus, only the last 7 slots can be considered valid. If more than 7 slots have passed, we have
+            # to inject empty slots to maintain the synchronization. Note that the 7th most recent slot is at
+            # an offset of -6 relative to the current slot, hence the -1.
+            if slot_index <= end_slot_index:
+                max_read_offset = slot_index - end_slot_index + 7
+            else:
+                max_read_offset = slot_index - end_slot_index - 1
+            count = min(slots_passed, max_read_offset)
+            fillers = slots_passed - count
+
+            self.slot_num = slot_ring.append_fillers(self.slot_num, self.read_num, loop_start, tsf, slot_index,
+                                                     slots_passed, fillers)
+            # write the slots of this read directly in the ring buffer, no per-read allocation
+            self.slot_num = slot_ring.append_read(self.slot_num, self.read_num, loop_start, tsf, slot_index, slots_passed,
+                (packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot, channel_busy),
+                count)
+            self.read_num += 1
+            self.read_done(late, slots_passed, fillers, read_end - loop_start)
+
+            loop_end = int((time.monotonic() - start_time) * 1000000)
+            if self.tsf_schedule:
+                self.adapt(fillers, late)
+                delay = self.next_wakeup(tsf, loop_end - loop_start)
+            else:
+                delay = loop_start + read_interval - loop_end
+            scheduled = loop_end + max(delay, 0)
+            if delay > 0:
+                time.sleep(delay / 1000000.0)
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import collections
+import struct
+import time
+import numpy as np
+
+from .feedback_reader import PACKET_TO_TRANSMIT, MY_TRANSMISSION, SUCCES_TRANSMISSION, OTHER_TRANSMISSION, \
+    BAD_RECEPTION, BUSY_SLOT, COUNT_SLOT, FEEDBACK_BASE, FEEDBACK_SIZE
+
+# The firmware exposes 3 bits of the slot counter register.
+SLOT_INDEX_BITS = 3
+
+# Offset of the FSM parameters in the parameter area of a bytecode slot (see set_parameter of the
+# local control program): 12 is the TDMA frame length, 11 the assigned slot.
+PARAM_FRAME_LENGTH = 0x1F * 2
+PARAM_SLOT_ASSIGNMENT = 0x21 * 2
+
+# Traffic and collision patterns of the simulated channel.
+#   queue_prob: probability that this node has a packet queued in a slot.
+#   other_slots / other_frame_length: slots of a TDMA frame used by the other nodes.
+#   other_prob: probability of a random (ALOHA-like) transmission of another node in a slot.
+#   bad_prob: probability of a corrupted reception in a slot.
+#   busy_prob: probability of energy on the channel without a decodable frame.
+TRAFFIC_PATTERNS = {
+    'idle': dict(queue_prob=1.0, other_slots=(), other_frame_length=4, other_prob=0.0, bad_prob=0.0, busy_prob=0.0),
+    'tdma': dict(queue_prob=1.0, other_slots=(0, 2, 3), other_frame_length=4, other_prob=0.0, bad_prob=0.0,
+                 busy_prob=0.0),
+    'aloha': dict(queue_prob=1.0, other_slots=(), other_frame_length=4, other_prob=0.3, bad_prob=0.05,
+                  busy_prob=0.05),
+    'mixed': dict(queue_prob=0.8, other_slots=(0, 2), other_frame_length=4, other_prob=0.1, bad_prob=0.02,
+                  busy_prob=0.02),
+}
+
+Timespec = collections.namedtuple('Timespec', ['tv_sec', 'tv_nsec'])
+
+
+def monotonic_time():
+    """ Returns CLOCK_MONOTONIC_RAW as a timespec, as monotonic_time of libb43 (for hosts without the WMP framework).
+    """
+    ns = time.clock_gettime_ns(time.CLOCK_MONOTONIC_RAW)
+    return Timespec(ns // 1000000000, ns % 1000000000)
+
+
+class SimulatedB43:
+    """
+    This class defines a simulated b43 card, with the shared memory interface of the B43 class of libb43 used by
+    the MetaMAC loops, so that the loops can run and be profiled without the hardware.
+    The TSF advances with the host clock, the slot of the card is tsf // slot_time and the 3 bit COUNT_SLOT
+    register is its low part. The feedback registers are rebuilt on every read: bit i of each mask holds
+    the flags of the last slot with index i, as the firmware does. The flags come from a traffic pattern
+    precomputed for `period` slots: packets queued by this node, transmissions of the other nodes (TDMA
+    slots and random ones), corrupted receptions and busy slots. This node runs the TDMA FSM configured in
+    the parameters of the active bytecode slot, so the protocol loaded by MetaMAC changes its own
+    transmissions and collisions.
+    """
+
+    B43_SHM_UCODE = 0
+    B43_SHM_SHARED = 1
+    B43_SHM_REGS = 2
+    PARAMETER_ADDR_BYTECODE_1 = 0x0600
+    PARAMETER_ADDR_BYTECODE_2 = 0x0700
+
+    def __init__(self, pattern='tdma', slot_time=2200, seed=0, period=4096, tsf_jump_prob=0.0,
+                 clock=time.monotonic, **traffic):
+        """ Creates the simulated card.
+
+        :param pattern: name of a TRAFFIC_PATTERNS entry, its values can be overridden with the traffic kwargs.
+        :param slot_time: slot duration [us].
+        :param seed: seed of the traffic pattern.
+        :param period: number of slots after which the traffic pattern repeats.
+        :param tsf_jump_prob: probability, for each TSF read, of a jump of the TSF counter (hardware bug
+            seen on the real cards).
+        :param clock: time source [s].
+        """
+        if pattern not in TRAFFIC_PATTERNS:
+            raise ValueError("unknown traffic pattern %s, available: %s" % (pattern, ', '.join(sorted(TRAFFIC_PATTERNS))))
+        params = dict(TRAFFIC_PATTERNS[pattern])
+        params.update(traffic)
+        self.pattern = pattern
+        self.traffic = params
+        self.slot_time = slot_time
+        self.period = period
+        self.tsf_jump_prob = tsf_jump_prob
+        self.clock = clock
+        self.tsf_jumps = 0
+        self.reads = 0
+        self._rng = np.random.RandomState(seed)
+
+        slot = np.arange(period)
+        rng = self._rng
+        self.packet_queued = rng.random_sample(period) < params['queue_prob']
+        self.other_tx = np.isin(slot % params['other_frame_length'], params['other_slots'])
+        self.other_tx |= rng.random_sample(period) < params['other_prob']
+        self.bad = rng.random_sample(period) < params['bad_prob']
+        self.busy = rng.random_sample(period) < params['busy_prob']
+
+        # shared memory written by the control program (FSM parameters)
+        self.shared = {}
+        self.active_bytecode = 1
+        for base in (self.PARAMETER_ADDR_BYTECODE_1, self.PARAMETER_ADDR_BYTECODE_2):
+            self.shared[base + PARAM_FRAME_LENGTH] = 4
+            self.shared[base + PARAM_SLOT_ASSIGNMENT] = 1
+
+        self._start = clock()
+        self._tsf_base = int(rng.randint(0, 1 << 30))
+        self._cached_slot = None
+        self._cached_words = None
+        # (first slot, frame length, slot assignment) of the TDMA FSM run by this node, a change applies
+        # from the next slot, the slots already in the feedback masks keep their flags
+        self.fsm_history = [(0, 4, 1)]
+
+    def _bytecode_base(self):
+        return self.PARAMETER_ADDR_BYTECODE_1 if self.active_bytecode == 0 else self.PARAMETER_ADDR_BYTECODE_2
+
+    def tsf(self):
+        """ Returns the TSF value [us] at the current time, without jumps.
+        """
+        return self._tsf_base + int((self.clock() - self._start) * 1000000)
+
+    def current_slot(self):
+        """ Returns the number of the slot running on the card (the ground truth for the read loops).
+        """
+        return self.tsf() // self.slot_time
+
+    def slot_flags(self, slot_num):
+        """ Returns the feedback flags of the slots in slot_num (array of card slot numbers).
+
+        :return: tuple of boolean arrays (packet_queued, transmitted, transmit_success, transmit_other,
+            bad_reception, busy_slot).
+        """
+        index = slot_num % self.period
+        frame_length = np.ones(len(slot_num), dtype=np.int64)
+        slot_assignment = np.zeros(len(slot_num), dtype=np.int64)
+        for first_slot, length, assignment in self.fsm_history:
+            running = slot_num >= first_slot
+            frame_length[running] = length
+            slot_assignment[running] = assignment
+
+        packet_queued = self.packet_queued[index]
+        transmitted = packet_queued & ((slot_num % frame_length) == slot_assignment)
+        other_tx = self.other_tx[index]
+        bad = self.bad[index]
+        transmit_success = transmitted & ~other_tx & ~bad
+        transmit_other = other_tx & ~transmitted & ~bad
+        bad_reception = bad & ~transmitted
+        busy_slot = (other_tx | bad | self.busy[index]) & ~transmitted
+        return packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot
+
+    def _feedback_words(self):
+        """ Returns the half words of the feedback range for the current slot.
+        """
+        slot = self.current_slot()
+        if slot == self._cached_slot:
+            return self._cached_words
+        modulo = 1 << SLOT_INDEX_BITS
+        # slot with index i: the last one, at or before the current slot
+        bit = np.arange(modulo)
+        slots = slot - (slot - bit) % modulo
+        words = [0] * (FEEDBACK_SIZE // 2)
+        weights = 1 << bit
+        for addr, flags in zip((PACKET_TO_TRANSMIT, MY_TRANSMISSION, SUCCES_TRANSMISSION, OTHER_TRANSMISSION,
+                                BAD_RECEPTION, BUSY_SLOT), self.slot_flags(slots)):
+            words[(addr - FEEDBACK_BASE) // 2] = int(np.dot(flags, weights))
+        self._cached_slot = slot
+        self._cached_words = words
+        return words
+
+    def getTSFRegs(self):
+        if self.tsf_jump_prob and self._rng.random_sample() < self.tsf_jump_prob:
+            self.tsf_jumps += 1
+            return self.tsf() + int(self._rng.randint(1, 1 << 20)) * self.slot_time
+        return self.tsf()
+
+    def shmRead16(self, routing, offset):
+        self.reads += 1
+        if routing == self.B43_SHM_REGS:
+            if offset == COUNT_SLOT:
+                return self.current_slot() & ((1 << SLOT_INDEX_BITS) - 1)
+            return 0
+        if FEEDBACK_BASE <= offset < FEEDBACK_BASE + FEEDBACK_SIZE:
+            return self._feedback_words()[(offset - FEEDBACK_BASE) // 2]
+        return self.shared.get(offset, 0)
+
+    def shmRead32(self, routing, offset):
+        if routing == self.B43_SHM_SHARED and FEEDBACK_BASE <= offset < FEEDBACK_BASE + FEEDBACK_SIZE - 2:
+            # both half words from the same slot, as one bus access
+            self.reads += 1
+            words = self._feedback_words()
+            index = (offset - FEEDBACK_BASE) // 2
+            return words[index] | (words[index + 1] << 16)
+        return self.shmRead16(routing, offset) | (self.shmRead16(routing, offset + 2) << 16)
+
+    def shmReadBlock(self, routing, offset, size):
+        """ Reads size bytes starting at offset, as one snapshot.
+        """
+        self.reads += 1
+        words = self._feedback_words()
+        values = []
+        for addr in range(offset, offset + size, 2):
+            if routing == self.B43_SHM_SHARED and FEEDBACK_BASE <= addr < FEEDBACK_BASE + FEEDBACK_SIZE:
+                values.append(words[(addr - FEEDBACK_BASE) // 2])
+            elif routing == self.B43_SHM_SHARED:
+                values.append(self.shared.get(addr, 0))
+            else:
+                values.append(0)
+        return struct.pack('<%dH' % len(values), *values)
+
+    def writeAddressBytecode(self, slot):
+        """ Activates the FSM of bytecode slot 0 or 1.
+        """
+        self.active_bytecode = slot
+        self._fsm_changed()
+
+    def shmWrite16(self, routing, offset, value):
+        if routing == self.B43_SHM_SHARED:
+            self.shared[offset] = value & 0xffff
+            self._fsm_changed()
+
+    def _fsm_changed(self):
+        base = self._bytecode_base()
+        entry = (self.current_slot() + 1, max(self.shared.get(base + PARAM_FRAME_LENGTH, 1), 1),
+                 self.shared.get(base + PARAM_SLOT_ASSIGNMENT, 0))
+        if entry[1:] == self.fsm_history[-1][1:]:
+            return
+        if entry[0] == self.fsm_history[-1][0]:
+            self.fsm_history[-1] = entry
+        else:
+            self.fsm_history.append(entry)
+            del self.fsm_history[:-16]
+        self._cached_slot = None
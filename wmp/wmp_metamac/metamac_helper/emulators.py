@@ -0,0 +1,123 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+from functools import reduce
+import numpy as np
+
+EMULATOR_TDMA = 'tdma'
+EMULATOR_ALOHA = 'aloha'
+
+# Protocol emulators, by name: each one compiles the parameters of a protocol into the table of its
+# decisions over one period of slots (see DecisionTable).
+EMULATORS = {}
+
+
+def register_emulator(name):
+    """ Decorator registering the compile function of an emulator.
+        The function gets the protocol parameters (dictionary with frame_offset, frame_length,
+        slot_assignment, persistence) and the period, and returns the decision (between 0 and 1) of the
+        protocol for every phase 0 ... period - 1.
+    """
+    def register(compile_function):
+        EMULATORS[name] = compile_function
+        return compile_function
+    return register
+
+
+@register_emulator(EMULATOR_TDMA)
+def compile_tdma(params, period):
+    """ TDMA transmits in the assigned slot of every frame (tdma_emulate of the MetaMAC C implementation).
+    """
+    phase = np.arange(period)
+    return (((phase - params['frame_offset']) % params['frame_length']) == params['slot_assignment']).astype(np.float64)
+
+
+@register_emulator(EMULATOR_ALOHA)
+def compile_aloha(params, period):
+    """ Slotted ALOHA transmits in every slot with probability persistence (aloha_emulate).
+    """
+    return np.full(period, float(params['persistence']))
+
+
+def _emulator_name(emulator):
+    # the ctypes protocol structures of the control programs store the name as bytes
+    return emulator.decode() if isinstance(emulator, bytes) else emulator
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+class DecisionTable:
+    """
+    This class defines the decisions of a suite of protocols, compiled once into lookup tables.
+    Decisions of TDMA protocols are periodic in their frame length, so all protocols are compiled over one
+    period L, the least common multiple of the frame lengths (1 when there is no TDMA protocol), with phase
+    (slot_num + slot_offset) % L. The slot offset only moves the phase: when it changes nothing has to be
+    recompiled, the tables are compiled again only when the protocols change (compile).
+    """
+
+    def __init__(self, emulators, params):
+        """
+        :param emulators: list with the emulator name of each protocol, a key of EMULATORS.
+        :param params: list with the parameters of each protocol, dictionaries with frame_offset,
+            frame_length, slot_assignment and persistence.
+        """
+        self.compile(emulators, params)
+
+    @classmethod
+    def from_protocols(cls, protocols):
+        """ Creates the table from a list of protocol descriptions (see protocols.PROTOCOL_SUITES).
+        """
+        return cls([p['emulator'] for p in protocols], protocols)
+
+    @classmethod
+    def from_protocol_structs(cls, protocols):
+        """ Creates the table from the ctypes protocol structures of the local control programs, with the
+            emulator name set in their emulator attribute.
+        """
+        params = [{'frame_offset': p.parameter.frame_offset,
+                   'frame_length': p.parameter.frame_length,
+                   'slot_assignment': p.parameter.slot_assignment,
+                   'persistence': getattr(p.parameter, 'persistence', 0.0)} for p in protocols]
+        return cls([p.emulator for p in protocols], params)
+
+    def compile(self, emulators, params):
+        """ Compiles the decisions of every protocol over one period.
+        """
+        emulators = [_emulator_name(e) for e in emulators]
+        for emulator in emulators:
+            if emulator not in EMULATORS:
+                raise ValueError("unknown protocol emulator %s, available: %s" % (emulator, ', '.join(sorted(EMULATORS))))
+        frame_lengths = [int(p['frame_length']) for e, p in zip(emulators, params) if e == EMULATOR_TDMA]
+        self.period = reduce(lambda a, b: a * b // _gcd(a, b), frame_lengths, 1)
+        self.emulators = emulators
+        self.num_protocols = len(emulators)
+        # (period x protocols) decision of every protocol, between 0 and 1
+        self.values = np.stack([EMULATORS[e](p, self.period) for e, p in zip(emulators, params)], axis=1)
+        # TDMA decisions as integers (index of the weight factors), 0 for the others
+        is_tdma = np.array([e == EMULATOR_TDMA for e in emulators])
+        self.decisions = np.where(is_tdma, self.values, 0).astype(np.intp)
+        # one tuple per phase, for the per-slot update
+        self.rows = [tuple(row) for row in self.values.tolist()]
+
+    def row(self, slot_num, slot_offset):
+        """ Returns the decision of every protocol in a slot, as a tuple.
+        """
+        return self.rows[(slot_num + slot_offset) % self.period]
+
+    def lookup(self, slot_num, offsets):
+        """ Returns the decisions of every protocol in a block of slots.
+
+        :param slot_num: array of slot numbers.
+        :param offsets: array (or scalar) of slot offsets in use for every slot.
+        :return: tuple of (slots x protocols) arrays, the integer decisions (0 for non-TDMA protocols)
+            and the decision values.
+        """
+        phase = (slot_num + offsets) % self.period
+        return self.decisions[phase], self.values[phase]
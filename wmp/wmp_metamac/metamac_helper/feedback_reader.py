@@ -0,0 +1,66 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import struct
+from operator import itemgetter
+
+# MetaMAC feedback registers in the shared memory, each one is a 16 bit mask with one bit per slot index.
+PACKET_TO_TRANSMIT = 0x00F0
+MY_TRANSMISSION = 0x00F2
+SUCCES_TRANSMISSION = 0x00F4
+OTHER_TRANSMISSION = 0x00F6
+BAD_RECEPTION = 0x00FA
+BUSY_SLOT = 0x00FC
+# Slot counter register, in the B43_SHM_REGS routing; the firmware exposes 3 bits of it.
+COUNT_SLOT = 43
+
+# The registers lie in one contiguous range, read it as a whole: 0x00F0 - 0x00FF, 8 half words.
+FEEDBACK_BASE = PACKET_TO_TRANSMIT
+FEEDBACK_SIZE = 0x10
+FEEDBACK_STRUCT = struct.Struct('<8H')
+# position of each register in the decoded tuple
+FEEDBACK_INDEX = tuple((addr - FEEDBACK_BASE) // 2 for addr in
+                       (PACKET_TO_TRANSMIT, MY_TRANSMISSION, SUCCES_TRANSMISSION, OTHER_TRANSMISSION,
+                        BAD_RECEPTION, BUSY_SLOT))
+_select_feedback = itemgetter(*FEEDBACK_INDEX)
+
+_WORDS_STRUCT = struct.Struct('<4I')
+
+
+def read_feedback_range(b43):
+    """ Reads the raw bytes of the feedback range of the shared memory in one bulk operation.
+        Uses the shmReadBlock method of the backend when available, otherwise four 32 bit reads
+        (instead of six 16 bit reads).
+
+    :param b43: B43 backend.
+    :return: FEEDBACK_SIZE bytes, little endian as in the shared memory.
+    """
+    read_block = getattr(b43, 'shmReadBlock', None)
+    if read_block is not None:
+        return read_block(b43.B43_SHM_SHARED, FEEDBACK_BASE, FEEDBACK_SIZE)
+    shared = b43.B43_SHM_SHARED
+    return _WORDS_STRUCT.pack(b43.shmRead32(shared, FEEDBACK_BASE),
+                              b43.shmRead32(shared, FEEDBACK_BASE + 4),
+                              b43.shmRead32(shared, FEEDBACK_BASE + 8),
+                              b43.shmRead32(shared, FEEDBACK_BASE + 12))
+
+
+def decode_feedback(data):
+    """ Decodes the raw feedback range.
+
+    :param data: bytes returned by read_feedback_range.
+    :return: tuple (packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot).
+    """
+    return _select_feedback(FEEDBACK_STRUCT.unpack(data))
+
+
+def read_feedback_snapshot(b43):
+    """ Reads all the MetaMAC feedback registers as one snapshot.
+
+    :param b43: B43 backend.
+    :return: tuple (packet_queued, transmitted, transmit_success, transmit_other, bad_reception, busy_slot).
+    """
+    return decode_feedback(read_feedback_range(b43))
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+from .emulators import EMULATOR_TDMA, EMULATOR_ALOHA
+
+
+def tdma_protocol(pid, slot_assignment, frame_length=4, frame_offset=0):
+    """ Returns the description of a TDMA protocol of the suite, as configured by the local control program.
+    """
+    return {'id': pid,
+            'name': 'TDMA  (slot %d)' % slot_assignment,
+            'fsm_path': 'tdma-%d.txt' % frame_length,
+            # FSM parameter 12 is the frame length, 11 the assigned slot
+            'fsm_params': [(12, frame_length), (11, slot_assignment)],
+            'emulator': EMULATOR_TDMA,
+            'frame_offset': frame_offset,
+            'frame_length': frame_length,
+            'slot_assignment': slot_assignment,
+            'persistence': 0.0}
+
+
+def aloha_protocol(pid, persistence):
+    """ Returns the description of a slotted ALOHA protocol of the suite.
+    """
+    return {'id': pid,
+            'name': 'Aloha (p=%.2g)' % persistence,
+            'fsm_path': 'aloha-slot-probability-always.txt',
+            # FSM parameter 14 is the transmission probability, in 1/65536 units
+            'fsm_params': [(14, int((1.0 - persistence) * 65536))],
+            'emulator': EMULATOR_ALOHA,
+            'frame_offset': 0,
+            'frame_length': 0,
+            'slot_assignment': 0,
+            'persistence': persistence}
+
+
+# Protocol suites available to the MetaMAC control programs and tools.
+PROTOCOL_SUITES = {
+    # control_program.py
+    'tdma4': [tdma_protocol(i + 1, i) for i in range(4)],
+    # wishful_local_control_program.py
+    'tdma4_aloha': [tdma_protocol(i + 1, i) for i in range(4)] + [aloha_protocol(5, 0.9)],
+}
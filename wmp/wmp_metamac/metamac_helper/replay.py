@@ -0,0 +1,120 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import time
+import multiprocessing
+import numpy as np
+
+from .weight_engine import WeightEngine, EnsembleWeightEngine
+from .protocols import PROTOCOL_SUITES
+from .story_log import load_story
+
+
+def batch_bounds(story, batch_size=0):
+    """ Returns the (start, stop) index of the batches of slots processed by the control loop.
+
+    :param story: structured array of slots.
+    :param batch_size: number of slots per batch, 0 splits the story on the reads (read_num), as the
+        control loop that wakes up on every read.
+    """
+    if batch_size > 0:
+        starts = np.arange(0, len(story), batch_size)
+    else:
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(story['read_num'].astype(np.int64))) + 1))
+    stops = np.append(starts[1:], len(story))
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def replay_story(story, protocols, eta, batch_size=0, active_protocol=1):
+    """ Runs a recorded story through the MetaMAC weight update and protocol evaluation, as the local control
+        program does: after every batch the protocol with the highest weight becomes the active one.
+
+    :param story: structured array of slots (see story_log.load_story).
+    :param protocols: list of protocol descriptions (see protocols.PROTOCOL_SUITES).
+    :param eta: factor used in computing weights, or a list of eta values run as an EnsembleWeightEngine.
+    :param batch_size: number of slots per batch, 0 for one batch per read.
+    :param active_protocol: index of the protocol active at the beginning.
+    :return: dictionary with the replay results, eta is the one selected at the end for an ensemble.
+    """
+    ensemble = np.ndim(eta) > 0
+    if ensemble:
+        engine = EnsembleWeightEngine.from_protocols(protocols, eta)
+    else:
+        engine = WeightEngine.from_protocols(protocols, eta)
+    bounds = batch_bounds(story, batch_size)
+    mistakes = 0.0
+    switches = 0
+    queued = 0
+    active_slots = np.zeros(engine.num_protocols, dtype=np.int64)
+
+    start = time.perf_counter()
+    for first, last in bounds:
+        active_loss = engine.loss[active_protocol]
+        queued += engine.update(story[first:last], active_protocol)
+        mistakes += engine.loss[active_protocol] - active_loss
+        active_slots[active_protocol] += last - first
+        # metamac_evaluate
+        best = engine.best_protocol()
+        if best != active_protocol:
+            active_protocol = best
+            switches += 1
+    elapsed = time.perf_counter() - start
+
+    return {'eta': engine.selected_eta() if ensemble else eta,
+            'ensemble': ensemble,
+            'slots': len(story),
+            'batches': len(bounds),
+            'queued': queued,
+            'mistakes': float(mistakes),
+            'switches': switches,
+            'active_protocol': active_protocol,
+            'active_slots': active_slots.tolist(),
+            'weights': (engine.weights[engine.selected] if ensemble else engine.weights).tolist(),
+            'loss': engine.loss.tolist(),
+            'elapsed': elapsed,
+            'slots_per_s': len(story) / elapsed if elapsed > 0 else float('inf')}
+
+
+_stories = {}
+
+
+def _replay_job(job):
+    """ Replays one (story, suite, eta) combination in a worker process, stories are loaded once per process.
+    """
+    filename, suite_name, eta, batch_size, active_protocol = job
+    if filename not in _stories:
+        _stories[filename] = load_story(filename)
+    result = replay_story(_stories[filename], PROTOCOL_SUITES[suite_name], eta, batch_size, active_protocol)
+    result['story'] = filename
+    result['suite'] = suite_name
+    return result
+
+
+def sweep(filenames, suite_names, etas, batch_size=0, active_protocol=1, workers=None, ensemble=False):
+    """ Replays every combination of story, protocol suite and eta in parallel on a process pool.
+
+    :param filenames: list of story logs, binary or text.
+    :param suite_names: list of names of PROTOCOL_SUITES.
+    :param etas: list of eta values.
+    :param batch_size: number of slots per batch, 0 for one batch per read.
+    :param active_protocol: index of the protocol active at the beginning.
+    :param workers: number of processes, default is the number of CPUs; 1 runs in this process.
+    :param ensemble: also replay all the eta values together as an ensemble, for every story and suite.
+    :return: list of replay results, in job order.
+    """
+    eta_jobs = list(etas)
+    if ensemble:
+        eta_jobs.append(tuple(etas))
+    jobs = [(filename, suite_name, eta, batch_size, active_protocol)
+            for filename in filenames for suite_name in suite_names for eta in eta_jobs]
+    if workers == 1:
+        return [_replay_job(job) for job in jobs]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_replay_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from .acquisition import SlotReader, ReadHistograms, JITTER_BINS, MAX_SLOTS_BIN, MAX_FILLERS_BIN
+from .slot_buffer import SlotRingBuffer, SLOT_DTYPE, SLOT_INDEX_MODULO
+
+# The reading process is forked: the B43 backend is opened in the child and the shared memory blocks are
+# inherited, nothing has to be pickled.
+_fork = multiprocessing.get_context('fork')
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# Real-time settings applied in the reading process, bits of RealtimeAcquisition.rt_status.
+RT_AFFINITY = 1
+RT_FIFO = 2
+RT_MLOCK = 4
+RT_GC_OFF = 8
+RT_SETTINGS = ((RT_AFFINITY, 'affinity'), (RT_FIFO, 'SCHED_FIFO'), (RT_MLOCK, 'mlockall'), (RT_GC_OFF, 'gc off'))
+
+# Counters of the reading process, in the shared statistics block.
+STAT_FIELDS = ('reads', 'filler_slots', 'deadline_misses', 'read_slots', 'tsf_jumps', 'rt_status', 'running')
+STAT_INDEX = dict((name, i) for i, name in enumerate(STAT_FIELDS))
+
+
+def _aligned(offset):
+    return (offset + 63) & ~63
+
+
+class SharedSlotRingBuffer(SlotRingBuffer):
+    """
+    This class defines a SlotRingBuffer stored in a shared memory block, so that the reading loop can run in
+    another process (see RealtimeAcquisition). The rows, the publication times and write_seq live in the block,
+    the publication event is a multiprocessing event; the handoff protocol is the one of SlotRingBuffer: the
+    rows are written first, then write_seq is advanced.
+    """
+
+    def __init__(self, capacity=65536):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("ring buffer capacity must be a power of two, got %d" % capacity)
+        slots_offset = 64
+        publish_offset = _aligned(slots_offset + capacity * SLOT_DTYPE.itemsize)
+        self.shm = shared_memory.SharedMemory(create=True, size=publish_offset + capacity * 8)
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self._header = np.ndarray(1, dtype=np.int64, buffer=self.shm.buf)
+        self.slots = np.ndarray(capacity, dtype=SLOT_DTYPE, buffer=self.shm.buf, offset=slots_offset).view(np.recarray)
+        self.publish_time = np.ndarray(capacity, dtype=np.float64, buffer=self.shm.buf, offset=publish_offset)
+        self.slots[:] = 0
+        self.publish_time[:] = 0
+        self.write_seq = 0
+        self._pending = 0
+        self._published = _fork.Event()
+        self._offsets = np.arange(SLOT_INDEX_MODULO - 1, -1, -1, dtype=np.int64)
+
+    @property
+    def write_seq(self):
+        return int(self._header[0])
+
+    @write_seq.setter
+    def write_seq(self, seq):
+        self._header[0] = seq
+
+    def unlink(self):
+        """ Removes the name of the shared memory block, the mappings stay valid until the processes exit.
+        """
+        self.shm.unlink()
+
+
+class SharedReadStats:
+    """
+    This class defines the statistics of the reading process in a shared memory block: the STAT_FIELDS
+    counters and the read histograms, cumulative since the start. The parent process takes the histograms of
+    a reporting interval as the difference from the previous take.
+    """
+
+    def __init__(self):
+        sizes = (len(STAT_FIELDS), len(JITTER_BINS), MAX_SLOTS_BIN + 1, MAX_FILLERS_BIN + 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * sum(sizes))
+        arrays = []
+        offset = 0
+        for size in sizes:
+            arrays.append(np.ndarray(size, dtype=np.int64, buffer=self.shm.buf, offset=offset))
+            offset += 8 * size
+        self.counters, self.jitter, self.slots_per_read, self.fillers = arrays
+        for array in arrays:
+            array[:] = 0
+        self._taken = self.snapshot()
+        self._taken_time = time.time()
+
+    def get(self, name):
+        return int(self.counters[STAT_INDEX[name]])
+
+    def set(self, name, value):
+        self.counters[STAT_INDEX[name]] = value
+
+    def snapshot(self):
+        return {'reads': self.get('reads'),
+                'filler_slots': self.get('filler_slots'),
+                'jitter': self.jitter.copy(),
+                'slots_per_read': self.slots_per_read.copy(),
+                'fillers': self.fillers.copy()}
+
+    def take_histograms(self):
+        """ Returns the histograms of the reads since the previous call, as a ReadHistograms.
+        """
+        now = self.snapshot()
+        taken = self._taken
+        histograms = ReadHistograms()
+        histograms.start = self._taken_time
+        histograms.reads = now['reads'] - taken['reads']
+        histograms.filler_slots = now['filler_slots'] - taken['filler_slots']
+        histograms.jitter = now['jitter'] - taken['jitter']
+        histograms.slots_per_read = now['slots_per_read'] - taken['slots_per_read']
+        histograms.fillers = now['fillers'] - taken['fillers']
+        self._taken = now
+        self._taken_time = time.time()
+        return histograms
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class _SharedHistograms(ReadHistograms):
+    # histograms of the reading process, written in place in the shared statistics block
+
+    def __init__(self, stats):
+        ReadHistograms.__init__(self)
+        self.jitter = stats.jitter
+        self.slots_per_read = stats.slots_per_read
+        self.fillers = stats.fillers
+
+
+class RealtimeSlotReader(SlotReader):
+    """
+    This class defines the SlotReader run in the reading process: after each read its counters are copied in
+    the shared statistics block.
+    """
+
+    def __init__(self, b43, slot_ring, stats, *args, **kwargs):
+        SlotReader.__init__(self, b43, slot_ring, *args, **kwargs)
+        self.stats = stats
+        self.histograms = _SharedHistograms(stats)
+        self._counters = stats.counters
+
+    def read_done(self, late, slots_passed, fillers, duration):
+        SlotReader.read_done(self, late, slots_passed, fillers, duration)
+        counters = self._counters
+        counters[0] = self.read_num
+        counters[1] = self.filler_slots
+        counters[2] = self.deadline_misses
+        counters[3] = self.read_slots
+        counters[4] = self.tsf_jumps
+
+
+def _mlockall():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+
+class RealtimeAcquisition:
+    """
+    This class defines the real-time mode of the reading loop: the SlotReader runs in a dedicated process,
+    away from the garbage collector, the GIL and the stdout and log writes of the control loop. The process is
+    pinned to one core, scheduled with SCHED_FIFO, its memory is locked (mlockall) and its garbage collector
+    disabled; each setting that the system refuses (e.g. without CAP_SYS_NICE or with a low RLIMIT_MEMLOCK) is
+    skipped and reported in rt_status. The slots are handed over through a SharedSlotRingBuffer, the counters
+    and histograms of the reader through a SharedReadStats block.
+    The object has the interface of the SlotReader used by the control loop (take_histograms, read_slots,
+    deadline_misses, stop), plus start and join.
+    With the simulated card the reading process works on a copy of the card: the protocol changes written by
+    the control program are not seen by the reader.
+    """
+
+    def __init__(self, new_b43, read_interval=7000, use_busy=False, snapshot_read=True, tsf_schedule=True,
+                 capacity=65536, cpu=None, priority=50, lock_memory=True, **reader_args):
+        """
+        :param new_b43: function returning the B43 backend, called in the reading process.
+        :param read_interval: see SlotReader.
+        :param capacity: capacity of the slot ring buffer.
+        :param cpu: core of the reading process, default is the last core available.
+        :param priority: SCHED_FIFO priority, 1 ... 99.
+        :param lock_memory: lock the memory of the reading process.
+        :param reader_args: other SlotReader arguments.
+        """
+        self.new_b43 = new_b43
+        self.read_interval = read_interval
+        self.use_busy = use_busy
+        self.snapshot_read = snapshot_read
+        self.tsf_schedule = tsf_schedule
+        self.cpu = max(os.sched_getaffinity(0)) if cpu is None else cpu
+        self.priority = priority
+        self.lock_memory = lock_memory
+        self.reader_args = reader_args
+        self.slot_ring = SharedSlotRingBuffer(capacity)
+        self.stats = SharedReadStats()
+        self.process = None
+
+    def setup_realtime(self):
+        """ Applies the real-time settings to the calling process.
+
+        :return: the RT_ bits of the settings applied.
+        """
+        status = 0
+        try:
+            os.sched_setaffinity(0, {self.cpu})
+            status |= RT_AFFINITY
+        except OSError:
+            pass
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            status |= RT_FIFO
+        except OSError:
+            pass
+        if self.lock_memory:
+            try:
+                _mlockall()
+                status |= RT_MLOCK
+            except OSError:
+                pass
+        # objects created before the loop are moved out of the collected generations, then the collector is
+        # stopped: the loop reuses its arrays and creates no reference cycles
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        status |= RT_GC_OFF
+        return status
+
+    def _run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        reader = RealtimeSlotReader(self.new_b43(), self.slot_ring, self.stats, self.read_interval, self.use_busy,
+                                    self.snapshot_read, tsf_schedule=self.tsf_schedule, **self.reader_args)
+        signal.signal(signal.SIGTERM, lambda signum, frame: reader.stop())
+        self.stats.set('read_slots', reader.read_slots)
+        self.stats.set('rt_status', self.setup_realtime())
+        self.stats.set('running', 1)
+        reader.run()
+        self.stats.set('running', 0)
+
+    def start(self):
+        self.process = _fork.Process(target=self._run, name='metamac-reader')
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+
+    def join(self, timeout=None):
+        """ Waits for the end of the reading process and removes the names of the shared memory blocks.
+        """
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                return
+        for block in (self.slot_ring, self.stats):
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+    def take_histograms(self):
+        return self.stats.take_histograms()
+
+    @property
+    def read_num(self):
+        return self.stats.get('reads')
+
+    @property
+    def filler_slots(self):
+        return self.stats.get('filler_slots')
+
+    @property
+    def deadline_misses(self):
+        return self.stats.get('deadline_misses')
+
+    @property
+    def read_slots(self):
+        return self.stats.get('read_slots')
+
+    @property
+    def tsf_jumps(self):
+        return self.stats.get('tsf_jumps')
+
+    @property
+    def rt_status(self):
+        return self.stats.get('rt_status')
+
+    def rt_settings(self):
+        """ Returns the names of the real-time settings applied in the reading process.
+        """
+        status = self.rt_status
+        return [name for bit, name in RT_SETTINGS if status & bit]
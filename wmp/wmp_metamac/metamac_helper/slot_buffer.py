@@ -0,0 +1,202 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import threading
+import time
+import numpy as np
+
+# One row per MAC slot, same fields (and order) as the metamac_slot structure
+# of the local control program.
+SLOT_FIELDS = [
+    ('slot_num', np.uint64),
+    ('read_num', np.uint64),
+    ('host_time', np.uint64),
+    ('tsf_time', np.uint64),
+    ('slot_index', np.int32),
+    ('slots_passed', np.int32),
+    # Indicates if this slot was filled in because of a delay in reading from the board.
+    ('filler', np.uint8),
+    # Indicates that a packet was waiting to be transmitted in this slot.
+    ('packet_queued', np.uint8),
+    # Indicates that a transmission was attempted in this slot.
+    ('transmitted', np.uint8),
+    # Indicates that a transmission was successful in this slot.
+    ('transmit_success', np.uint8),
+    # Various measures for whether another node attempted to transmit.
+    ('transmit_other', np.uint8),
+    ('bad_reception', np.uint8),
+    ('busy_slot', np.uint8),
+    # Indicates that either a transmission attempt was unsuccessful
+    # in this slot or another node attempted a transmission.
+    ('channel_busy', np.uint8),
+]
+SLOT_DTYPE = np.dtype(SLOT_FIELDS)
+SLOT_FIELD_NAMES = SLOT_DTYPE.names
+
+# Per-slot feedback flags, extracted from the 8 bit masks read from the shared memory.
+FEEDBACK_FIELDS = ('packet_queued', 'transmitted', 'transmit_success', 'transmit_other',
+                   'bad_reception', 'busy_slot', 'channel_busy')
+
+# Slot index counter of the firmware is 3 bit wide.
+SLOT_INDEX_MODULO = 8
+
+
+class SlotRingBuffer:
+    """
+    This class defines a fixed-capacity history of the MetaMAC slots, stored in a NumPy structured array.
+    The reading thread is the only writer: it fills the rows of each read in place and then advances
+    write_seq, the total number of slots ever written. Consumers keep their own sequence number and get
+    zero-copy views of the rows between their sequence and write_seq. Rows older than capacity slots are
+    overwritten, so memory usage does not grow with the experiment duration.
+    Every publication sets an event, so a consumer can sleep until new slots are available (see wait_for),
+    and stores the publication time of the rows, used to measure the read-to-decision latency.
+    """
+
+    def __init__(self, capacity=65536):
+        """ Allocates the slot storage.
+
+        :param capacity: number of slots kept in the history, must be a power of two.
+        """
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("ring buffer capacity must be a power of two, got %d" % capacity)
+        self.capacity = capacity
+        self.mask = capacity - 1
+        # record array, so that a row exposes its fields as attributes like the ctypes metamac_slot
+        self.slots = np.zeros(capacity, dtype=SLOT_DTYPE).view(np.recarray)
+        self.write_seq = 0
+        # filler slots written but not yet published
+        self._pending = 0
+        # time.monotonic() of the publication of each row
+        self.publish_time = np.zeros(capacity)
+        self._published = threading.Event()
+        # slot offsets (relative to the last slot read) for a read of up to SLOT_INDEX_MODULO slots
+        self._offsets = np.arange(SLOT_INDEX_MODULO - 1, -1, -1, dtype=np.int64)
+
+    def _rows(self, seq, count):
+        """ Returns the index of count rows starting at sequence number seq, a slice when rows are contiguous.
+        """
+        start = seq & self.mask
+        if start + count <= self.capacity:
+            return slice(start, start + count)
+        return (seq + np.arange(count)) & self.mask
+
+    def append_read(self, slot_num, read_num, host_time, tsf_time, slot_index, slots_passed, feedback, count=None):
+        """ Writes in the buffer the slots covered by one read of the feedback registers.
+            The slots are numbered slot_num + 1 ... slot_num + count, the bit of each slot
+            in the feedback masks is selected by the firmware slot index.
+
+        :param slot_num: number of the last slot already written.
+        :param read_num: sequence number of the read.
+        :param host_time: host time of the read [us].
+        :param tsf_time: TSF value of the read [us].
+        :param slot_index: firmware slot index (COUNT_SLOT & 0x7) at the time of the read.
+        :param slots_passed: number of slots passed since the last read.
+        :param feedback: sequence with the bit masks in FEEDBACK_FIELDS order.
+        :param count: number of slots read from the masks, the most recent ones, default is slots_passed
+            (at most SLOT_INDEX_MODULO, older slots are written with append_fillers).
+        :return: the number of the last slot written.
+        """
+        if count is None:
+            count = slots_passed
+        if count <= 0 and not self._pending:
+            return slot_num
+
+        seq = self.write_seq + self._pending
+        rows = self._rows(seq, count)
+        slots = self.slots
+        bit_index = (slot_index - self._offsets[SLOT_INDEX_MODULO - count:]) % SLOT_INDEX_MODULO
+
+        slots['slot_num'][rows] = np.arange(slot_num + 1, slot_num + count + 1)
+        slots['read_num'][rows] = read_num
+        slots['host_time'][rows] = host_time
+        slots['tsf_time'][rows] = tsf_time
+        slots['slot_index'][rows] = slot_index
+        slots['slots_passed'][rows] = slots_passed
+        slots['filler'][rows] = 0
+        for name, bitmask in zip(FEEDBACK_FIELDS, feedback):
+            slots[name][rows] = (bitmask >> bit_index) & 1
+
+        published = self._rows(self.write_seq, self._pending + count)
+        self.publish_time[published] = time.monotonic()
+        # publish the rows (fillers included) only once they are complete
+        self.write_seq = seq + count
+        self._pending = 0
+        self._published.set()
+        return slot_num + count
+
+    def append_fillers(self, slot_num, read_num, host_time, tsf_time, slot_index, slots_passed, count):
+        """ Writes in the buffer count filler slots, the slots passed since the last read that can not be
+            read any more from the feedback masks. Their feedback flags are 0, so they keep the slot numbering
+            in sync without changing the weights. The slots are published with the next append_read.
+
+        :return: the number of the last slot written.
+        """
+        if count <= 0:
+            return slot_num
+        # after a long stall only the most recent fillers are stored, the numbering still advances by count
+        skip = max(count - self.capacity // 2, 0)
+        slot_num += skip
+        count -= skip
+        seq = self.write_seq + self._pending
+        rows = self._rows(seq, count)
+        slots = self.slots
+        slots['slot_num'][rows] = np.arange(slot_num + 1, slot_num + count + 1)
+        slots['read_num'][rows] = read_num
+        slots['host_time'][rows] = host_time
+        slots['tsf_time'][rows] = tsf_time
+        slots['slot_index'][rows] = slot_index
+        slots['slots_passed'][rows] = slots_passed
+        slots['filler'][rows] = 1
+        for name in FEEDBACK_FIELDS:
+            slots[name][rows] = 0
+        self._pending += count
+        return slot_num + count
+
+    def wait_for(self, seq, timeout=None):
+        """ Waits until slots after sequence number seq are published.
+
+        :param seq: sequence number of the first slot not yet consumed.
+        :param timeout: maximum wait [s], None waits forever.
+        :return: the current write_seq, equal to seq on timeout.
+        """
+        while self.write_seq <= seq:
+            # clear, then check again: a publication between the two is not lost
+            self._published.clear()
+            if self.write_seq > seq:
+                break
+            if not self._published.wait(timeout):
+                break
+        return self.write_seq
+
+    def oldest_seq(self):
+        """ Returns the sequence number of the oldest slot still stored in the buffer.
+        """
+        return max(0, self.write_seq - self.capacity)
+
+    def views(self, start_seq, stop_seq=None):
+        """ Returns zero-copy views of the slots with sequence number in [start_seq, stop_seq).
+            The range is returned as one view, or two views when it wraps around the end of the storage.
+            Slots already overwritten are skipped.
+
+        :param start_seq: sequence number of the first slot.
+        :param stop_seq: sequence number after the last slot, default is write_seq.
+        :return: list of structured array views, in slot order.
+        """
+        if stop_seq is None:
+            stop_seq = self.write_seq
+        start_seq = max(start_seq, stop_seq - self.capacity, 0)
+        if stop_seq <= start_seq:
+            return []
+        start = start_seq & self.mask
+        stop = start + (stop_seq - start_seq)
+        if stop <= self.capacity:
+            return [self.slots[start:stop]]
+        return [self.slots[start:], self.slots[:stop - self.capacity]]
+
+    def latest(self, count):
+        """ Returns zero-copy views of the last count slots written.
+        """
+        return self.views(self.write_seq - count)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import time
+import numpy as np
+
+
+class LatencyStats:
+    """
+    This class defines a fixed-size window of latency samples [s] with summary statistics.
+    """
+
+    def __init__(self, window=4096):
+        self.samples = np.zeros(window)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+    def summary(self):
+        """ Returns count, mean, median, 99th percentile (on the last window samples) and max since start, in [ms].
+        """
+        if self.count == 0:
+            return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        window = self.samples[:min(self.count, len(self.samples))] * 1000.0
+        return {'count': self.count,
+                'mean': float(np.mean(window)),
+                'p50': float(np.percentile(window, 50)),
+                'p99': float(np.percentile(window, 99)),
+                'max': float(self.max) * 1000.0}
+
+
+class SlotConsumer:
+    """
+    This class defines the consumer side of the single-producer/single-consumer handoff over a SlotRingBuffer.
+    The reading thread publishes slots by advancing write_seq; the consumer keeps its own sequence number,
+    sleeps until a read is published and gets the new slots as zero-copy views. No lock is taken on the data:
+    only the producer writes rows and write_seq, only the consumer moves its sequence number.
+    The latency from the publication of a slot to the decision taken on it is measured on the oldest
+    slot of each batch.
+    """
+
+    def __init__(self, slot_ring, max_batch=60, latency_window=4096):
+        """
+        :param slot_ring: SlotRingBuffer filled by the reading thread.
+        :param max_batch: maximum number of slots per batch, older slots are skipped when the consumer lags.
+        :param latency_window: number of latency samples kept for the statistics.
+        """
+        self.slot_ring = slot_ring
+        self.max_batch = max_batch
+        self.read_seq = 0
+        self.skipped = 0
+        self.batches = 0
+        self.latency = LatencyStats(latency_window)
+        self._batch_seq = None
+
+    def next_batch(self, timeout=0.1):
+        """ Waits for new slots and returns them.
+
+        :param timeout: maximum wait [s], an empty batch is returned on timeout.
+        :return: list of structured array views (see SlotRingBuffer.views).
+        """
+        write_seq = self.slot_ring.wait_for(self.read_seq, timeout)
+        if write_seq - self.read_seq > self.max_batch:
+            self.skipped += write_seq - self.max_batch - self.read_seq
+            self.read_seq = write_seq - self.max_batch
+        slot_views = self.slot_ring.views(self.read_seq, write_seq)
+        self._batch_seq = self.read_seq if slot_views else None
+        self.read_seq = write_seq
+        return slot_views
+
+    def batch_done(self):
+        """ Marks the decision on the last batch as taken, records its read-to-decision latency.
+        """
+        if self._batch_seq is None:
+            return
+        published = self.slot_ring.publish_time[self._batch_seq & self.slot_ring.mask]
+        self.latency.add(time.monotonic() - published)
+        self.batches += 1
+        self._batch_seq = None
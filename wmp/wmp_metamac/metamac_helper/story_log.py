@@ -0,0 +1,143 @@
+#!/usr/bin/python
+"""
+story_log.py: binary log of the MetaMAC slots (the story of the channel).
+Run from the wmp_metamac directory with python -m metamac_helper.story_log
+
+Usage:
+   story_log.py info <story_bin>
+   story_log.py export <story_bin> <story_csv>
+
+Options:
+   -h, --help          show this help message and exit
+"""
+
+__author__ = 'Domenico Garlisi'
+
+import os
+import struct
+import numpy as np
+
+from .slot_buffer import SLOT_DTYPE
+
+# Layout of the text log written by queue_multipush (story.csv).
+STORY_CSV_HEADER = "slot_num, read_num, host_time, tsf_time, slot_index, slots_passed, \t filler, packet_queued, " \
+                   "transmitted, transmit_success, transmit_other, \t bad_reception, busy_slot, channel_busy \n"
+STORY_CSV_FORMAT = ", ".join(["%d"] * len(SLOT_DTYPE.names))
+
+# The binary log is a fixed header followed by the slot records, each record is a SLOT_DTYPE row.
+STORY_MAGIC = b'MMSTORY1'
+STORY_HEADER = struct.Struct('<8sII')
+STORY_VERSION = 1
+
+
+class StoryLogWriter:
+    """
+    This class defines an append-only binary log of the slots. Rows are written as raw fixed-width records,
+    in batches, straight from the ring buffer views, so no per-slot formatting is done in the control loop.
+    """
+
+    def __init__(self, filename="story.bin"):
+        """ Opens the log, a new log is created when the file does not exist.
+
+        :param filename: path of the binary log.
+        """
+        self.filename = filename
+        self.slots_written = 0
+        if os.path.exists(filename) and os.path.getsize(filename) >= STORY_HEADER.size:
+            check_header(filename)
+            self.file = open(filename, "ab")
+        else:
+            self.file = open(filename, "wb")
+            self.file.write(STORY_HEADER.pack(STORY_MAGIC, STORY_VERSION, SLOT_DTYPE.itemsize))
+
+    def write(self, slot_views):
+        """ Appends a batch of slots.
+
+        :param slot_views: list of structured array views (see SlotRingBuffer.views).
+        """
+        for slots in slot_views:
+            self.file.write(np.ascontiguousarray(slots, dtype=SLOT_DTYPE).data)
+            self.slots_written += len(slots)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def check_header(filename):
+    """ Checks that the file is a binary story log written with the current slot layout.
+    """
+    with open(filename, "rb") as f:
+        magic, version, record_size = STORY_HEADER.unpack(f.read(STORY_HEADER.size))
+    if magic != STORY_MAGIC or version != STORY_VERSION:
+        raise ValueError("%s is not a MetaMAC binary story log" % filename)
+    if record_size != SLOT_DTYPE.itemsize:
+        raise ValueError("%s has records of %d bytes, expected %d" % (filename, record_size, SLOT_DTYPE.itemsize))
+
+
+def load_story_log(filename):
+    """ Memory-maps a binary story log, nothing is read until the columns are accessed.
+        A record partially written at the end of the file (e.g. log still open) is ignored.
+
+    :param filename: path of the binary log.
+    :return: structured array (see slot_buffer.SLOT_DTYPE), log['slot_num'] is the column of slot numbers.
+    """
+    check_header(filename)
+    count = (os.path.getsize(filename) - STORY_HEADER.size) // SLOT_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=SLOT_DTYPE)
+    return np.memmap(filename, dtype=SLOT_DTYPE, mode='r', offset=STORY_HEADER.size, shape=(count,))
+
+
+def load_story_csv(csv_filename):
+    """ Loads a text story log (story.csv layout, as the traces in the channel directory).
+
+    :param csv_filename: path of the text log.
+    :return: structured array (see slot_buffer.SLOT_DTYPE).
+    """
+    data = np.loadtxt(csv_filename, delimiter=',', skiprows=1, dtype=np.int64, ndmin=2)
+    story = np.zeros(len(data), dtype=SLOT_DTYPE)
+    for column, name in enumerate(SLOT_DTYPE.names):
+        story[name] = data[:, column]
+    return story
+
+
+def load_story(filename):
+    """ Loads a story log, binary (memory-mapped) or text.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(len(STORY_MAGIC))
+    if magic == STORY_MAGIC:
+        return load_story_log(filename)
+    return load_story_csv(filename)
+
+
+def export_csv(filename, csv_filename, chunk_size=65536):
+    """ Converts a binary story log in the story.csv layout written by queue_multipush.
+
+    :param filename: path of the binary log.
+    :param csv_filename: path of the text log.
+    :param chunk_size: number of slots converted at a time.
+    :return: the number of slots exported.
+    """
+    story = load_story_log(filename)
+    with open(csv_filename, "w") as csv_file:
+        csv_file.write(STORY_CSV_HEADER)
+        for start in range(0, len(story), chunk_size):
+            np.savetxt(csv_file, story[start:start + chunk_size].tolist(), fmt=STORY_CSV_FORMAT)
+    return len(story)
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+    args = docopt(__doc__)
+    if args['info']:
+        story = load_story_log(args['<story_bin>'])
+        print("slots : %d" % len(story))
+        if len(story):
+            print("slot_num : %d - %d" % (story['slot_num'][0], story['slot_num'][-1]))
+            print("reads : %d" % (story['read_num'][-1] - story['read_num'][0] + 1))
+    else:
+        print("exported %d slots" % export_csv(args['<story_bin>'], args['<story_csv>']))
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import json
+import threading
+import zmq
+import netifaces as ni
+
+
+def get_node_ip_address(iface='wlan0', default='127.0.0.1'):
+    """ Returns the list of IPv4 addresses of the interface, as sent in the node_ip_address field.
+        If the interface does not exist or has no IPv4 address (e.g. on a host without the wireless card)
+        the list is [default].
+    """
+    if iface not in ni.interfaces():
+        return [default]
+    addresses = ni.ifaddresses(iface).get(ni.AF_INET, [])
+    return [inetaddr['addr'] for inetaddr in addresses] or [default]
+
+
+class VisualizerPublisher:
+    """
+    This class defines a fire-and-forget sender of the MetaMAC state to the demo visualizer.
+    The control thread only stores the latest state, a background thread serializes it and sends it without
+    waiting for any reply. The socket keeps at most one message (high-water mark 1 and conflation), so when
+    the visualizer is slow or down older states are dropped and only the latest weights are delivered.
+    With zmq.PUSH (default) the socket connects to the visualizer, that must bind a zmq.PULL socket;
+    with zmq.PUB the socket binds the address and the visualizer connects a zmq.SUB socket.
+    """
+
+    def __init__(self, address, node_ip_address, socket_type=zmq.PUSH):
+        """ Starts the sending thread.
+
+        :param address: zmq address of the visualizer (e.g. tcp://10.8.8.6:8300), or the local bind address for zmq.PUB.
+        :param node_ip_address: IP address list of this node, computed once (see get_node_ip_address).
+        :param socket_type: zmq.PUSH or zmq.PUB.
+        """
+        self.address = address
+        self.node_ip_address = node_ip_address
+        self.socket_type = socket_type
+        # number of states sent, replaced by a newer state before sending, refused by the socket
+        self.sent = 0
+        self.superseded = 0
+        self.dropped = 0
+
+        self._latest = None
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._send_loop, name="visualizer_publisher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, active_protocol, weights):
+        """ Stores the state to send, it never blocks the caller.
+
+        :param active_protocol: index of the active protocol.
+        :param weights: list of the protocol weights.
+        """
+        with self._lock:
+            if self._latest is not None:
+                self.superseded += 1
+            self._latest = (active_protocol, weights)
+        self._pending.set()
+
+    def _send_loop(self):
+        context = zmq.Context.instance()
+        socket = context.socket(self.socket_type)
+        socket.setsockopt(zmq.SNDHWM, 1)
+        socket.setsockopt(zmq.CONFLATE, 1)
+        socket.setsockopt(zmq.LINGER, 0)
+        if self.socket_type == zmq.PUB:
+            socket.bind(self.address)
+        else:
+            socket.connect(self.address)
+
+        while self._running:
+            self._pending.wait(1)
+            self._pending.clear()
+            with self._lock:
+                state, self._latest = self._latest, None
+            if state is None:
+                continue
+
+            active_protocol, weights = state
+            message = json.dumps({
+                'node_ip_address': self.node_ip_address,
+                'active': active_protocol,
+                'weights': weights
+            }).encode()
+            try:
+                socket.send(message, zmq.NOBLOCK)
+                self.sent += 1
+            except zmq.Again:
+                self.dropped += 1
+
+        socket.close()
+
+    def close(self):
+        """ Stops the sending thread, states not yet sent are discarded.
+        """
+        self._running = False
+        self._pending.set()
+        self._thread.join()
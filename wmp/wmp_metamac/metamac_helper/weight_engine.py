@@ -0,0 +1,288 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import math
+import numpy as np
+
+from .emulators import DecisionTable, EMULATOR_TDMA
+
+# Lower bound of every protocol weight, before normalization.
+MIN_WEIGHT = 0.01
+
+
+class WeightEngine:
+    """
+    This class defines the batched version of the MetaMAC weight update (update_weights of the local control
+    program). A block of slots is processed with NumPy: the slot offset of the TDMA variants is tracked for
+    every slot, the decision of every protocol is looked up as a (slots x protocols) matrix in the
+    precompiled decision tables (see emulators.DecisionTable) and turned into the exponential-weight
+    factors, then the factors are applied to the weights of all protocols at once, with the floor clamp and
+    normalization after every queued slot.
+    The factors are computed with math.exp and the normalization sums the weights in protocol order, so the
+    weights are identical to the ones of the scalar path (for suites of less than 8 protocols, the ones NumPy
+    sums sequentially).
+    """
+
+    def __init__(self, emulators, frame_offset, frame_length, slot_assignment, persistence, eta,
+                 weights=None, slot_offset=0, min_weight=MIN_WEIGHT):
+        """ Creates the engine for a suite of protocols.
+
+        :param emulators: list with the emulator of each protocol, EMULATOR_TDMA or EMULATOR_ALOHA.
+        :param frame_offset: list with the TDMA frame offset of each protocol.
+        :param frame_length: list with the TDMA frame length of each protocol.
+        :param slot_assignment: list with the TDMA slot assigned to each protocol.
+        :param persistence: list with the transmission probability of each ALOHA protocol.
+        :param eta: factor used in computing weights.
+        :param weights: initial weights, default is the uniform distribution.
+        :param slot_offset: offset of slots numbering from read loop to slot numbering for TDMA.
+        :param min_weight: lower bound of the weights.
+        """
+        self.num_protocols = len(emulators)
+        self.emulators = list(emulators)
+        self.is_tdma = np.array([e == EMULATOR_TDMA for e in emulators])
+        self.frame_offset = np.array(frame_offset, dtype=np.int64)
+        # non-TDMA protocols get a dummy frame length, their column of the decision matrix is not used
+        self.frame_length = np.where(self.is_tdma, np.array(frame_length, dtype=np.int64), 1)
+        self.slot_assignment = np.array(slot_assignment, dtype=np.int64)
+        self.persistence = np.array(persistence, dtype=np.float64)
+        self.table = DecisionTable(emulators, [{'frame_offset': frame_offset[p], 'frame_length': frame_length[p],
+                                                'slot_assignment': slot_assignment[p], 'persistence': persistence[p]}
+                                               for p in range(self.num_protocols)])
+        self.min_weight = min_weight
+        self.slot_offset = slot_offset
+        if weights is None:
+            weights = [1.0 / self.num_protocols] * self.num_protocols
+        self.weights = np.array(weights, dtype=np.float64)
+        self._protocol_index = np.arange(self.num_protocols)
+        # cumulative loss |d - z| of every protocol on the queued slots, the number of wrong decisions for TDMA
+        self.loss = np.zeros(self.num_protocols)
+        # loss of the last block
+        self.batch_loss = np.zeros(self.num_protocols)
+        self.set_eta(eta)
+
+    @classmethod
+    def from_suite(cls, suite, emulators=None, persistence=None, eta=None):
+        """ Creates the engine from the ctypes protocol_suite of the local control program.
+
+        :param suite: protocol_suite structure.
+        :param emulators: list with the emulator of each protocol, default is TDMA for all.
+        :param persistence: list with the transmission probability of each ALOHA protocol.
+        :param eta: factor used in computing weights, default is the one of the suite.
+        """
+        num_protocols = suite.num_protocols
+        params = [suite.protocols[p].parameter for p in range(num_protocols)]
+        if emulators is None:
+            emulators = [EMULATOR_TDMA] * num_protocols
+        if persistence is None:
+            persistence = [0.0] * num_protocols
+        return cls(emulators,
+                   [param.frame_offset for param in params],
+                   [param.frame_length for param in params],
+                   [param.slot_assignment for param in params],
+                   persistence, suite.eta if eta is None else eta,
+                   weights=[suite.weights[p] for p in range(num_protocols)],
+                   slot_offset=suite.slot_offset)
+
+    @classmethod
+    def from_protocols(cls, protocols, eta, **kwargs):
+        """ Creates the engine from a list of protocol descriptions (see protocols.PROTOCOL_SUITES).
+        """
+        return cls([p['emulator'] for p in protocols],
+                   [p['frame_offset'] for p in protocols],
+                   [p['frame_length'] for p in protocols],
+                   [p['slot_assignment'] for p in protocols],
+                   [p['persistence'] for p in protocols],
+                   eta, **kwargs)
+
+    def set_eta(self, eta):
+        """ Sets eta and precomputes the weight factors.
+        """
+        self.eta = eta
+        self.factors = self.eta_factors(eta)
+
+    def eta_factors(self, eta):
+        """ Returns the weight factors for eta.
+            factors[p, d, z] = exp(-eta * |d - z|), with d the decision of protocol p (its persistence
+            for ALOHA) and z the correct decision of the slot.
+        """
+        factors = np.ones((self.num_protocols, 2, 2))
+        for p in range(self.num_protocols):
+            for d in range(2):
+                decision = float(d) if self.is_tdma[p] else self.persistence[p]
+                for z in range(2):
+                    factors[p, d, z] = math.exp(-(eta * math.fabs(decision - z)))
+        return factors
+
+    def slot_offsets(self, slot_num, transmitted, active_protocol):
+        """ Returns the TDMA slot offset in use for every slot of the block and updates slot_offset.
+            When this node transmitted, the offset is realigned to the slot assignment of the active protocol.
+
+        :param slot_num: array of slot numbers.
+        :param transmitted: array of transmission flags.
+        :param active_protocol: index of the active protocol.
+        """
+        offsets = np.full(len(slot_num), self.slot_offset, dtype=np.int64)
+        if not self.is_tdma[active_protocol]:
+            return offsets
+        tx = np.flatnonzero(transmitted)
+        if len(tx) == 0:
+            return offsets
+
+        frame_length = self.frame_length[active_protocol]
+        neg_offset = (slot_num[tx] - self.frame_offset[active_protocol] - self.slot_assignment[active_protocol]) % frame_length
+        tx_offsets = (frame_length - neg_offset) % frame_length
+
+        # every slot uses the offset of the last transmission at or before it
+        last_tx = np.full(len(slot_num), -1, dtype=np.int64)
+        last_tx[tx] = np.arange(len(tx))
+        np.maximum.accumulate(last_tx, out=last_tx)
+        realigned = last_tx >= 0
+        offsets[realigned] = tx_offsets[last_tx[realigned]]
+        self.slot_offset = int(tx_offsets[-1])
+        return offsets
+
+    def decision_matrix(self, slot_num, offsets):
+        """ Returns the (slots x protocols) matrix of the TDMA decisions, 1 when the protocol transmits.
+            Columns of non-TDMA protocols are 0.
+        """
+        return self.table.lookup(slot_num, offsets)[0]
+
+    def queued_decisions(self, slots, active_protocol):
+        """ Returns the decision of every protocol and the correct decision on the slots with a queued packet
+            (if there is no packet queued for a slot, all protocols are considered correct), and adds their
+            loss to loss.
+
+        :return: tuple (decisions, z), the (queued x protocols) decision matrix and the correct decisions,
+            None when no packet is queued.
+        """
+        if len(slots) == 0:
+            return None
+        slot_num = slots['slot_num'].astype(np.int64)
+        offsets = self.slot_offsets(slot_num, slots['transmitted'], active_protocol)
+
+        queued = np.flatnonzero(slots['packet_queued'])
+        if len(queued) == 0:
+            return None
+
+        # z is the correct decision, transmit if the channel is idle (1) or defer if it is busy (0)
+        z = (slots['channel_busy'][queued] == 0).astype(np.intp)
+        decisions, decision_values = self.table.lookup(slot_num[queued], offsets[queued])
+        self.batch_loss = np.abs(decision_values - z[:, None]).sum(axis=0)
+        self.loss += self.batch_loss
+        return decisions, z
+
+    def update(self, slots, active_protocol):
+        """ Updates the weights with a block of slots.
+
+        :param slots: structured array of slots (see slot_buffer.SLOT_DTYPE).
+        :param active_protocol: index of the protocol running during the block.
+        :return: the number of slots with a queued packet, the only ones changing the weights.
+        """
+        queued = self.queued_decisions(slots, active_protocol)
+        if queued is None:
+            return 0
+        decisions, z = queued
+        factors = self.factors[self._protocol_index, decisions, z[:, None]]
+
+        weights = self.weights
+        min_weight = self.min_weight
+        for factor in factors:
+            weights *= factor
+            np.maximum(weights, min_weight, out=weights)
+            weights /= weights.sum()
+        return len(z)
+
+    def best_protocol(self):
+        """ Returns the index of the protocol with the highest weight (the first one, on ties).
+        """
+        return int(np.argmax(self.weights))
+
+    def store(self, suite):
+        """ Copies weights and slot offset in the ctypes protocol_suite, used by evaluation and display.
+        """
+        for p in range(self.num_protocols):
+            suite.weights[p] = self.weights[p]
+        suite.slot_offset = self.slot_offset
+
+
+class EnsembleWeightEngine(WeightEngine):
+    """
+    This class defines an ensemble of weight engines with different eta values, run over the same slot
+    stream. The weights are a (etas x protocols) matrix updated in one pass: the decisions, the slot offsets
+    and the loss of the protocols do not depend on eta, only the factors do, so the per-slot recurrence
+    costs about the same as a single engine. The weights of every eta are identical to the ones of a
+    WeightEngine with that eta.
+    A meta-selector counts, for every eta, the wrong decisions of the protocol that eta would have been
+    running (the best one of its weights after each block) and selects the eta with the fewest, optionally
+    forgetting old mistakes with mistake_decay. The protocol to run is the best one of the selected eta.
+    """
+
+    def __init__(self, emulators, frame_offset, frame_length, slot_assignment, persistence, eta,
+                 weights=None, slot_offset=0, min_weight=MIN_WEIGHT, mistake_decay=1.0):
+        """ Creates the ensemble, the parameters are the ones of WeightEngine.
+
+        :param eta: list of eta values.
+        :param weights: initial weights of every eta, default is the uniform distribution.
+        :param mistake_decay: factor applied to the mistakes of every eta after each block, 1 never forgets.
+        """
+        etas = [float(e) for e in eta]
+        WeightEngine.__init__(self, emulators, frame_offset, frame_length, slot_assignment, persistence, etas,
+                              weights, slot_offset, min_weight)
+        self.weights = np.tile(self.weights, (len(etas), 1))
+        self.mistake_decay = mistake_decay
+        self.mistakes = np.zeros(len(etas))
+        # protocol run by every eta, the best one of its weights
+        self.member_protocol = np.zeros(len(etas), dtype=np.intp)
+        self.selected = 0
+
+    def set_eta(self, eta):
+        """ Sets the eta values and precomputes the weight factors of every eta, factors[e, p, d, z].
+        """
+        self.etas = np.array(eta, dtype=np.float64)
+        self.eta = self.etas
+        self.factors = np.array([self.eta_factors(eta_value) for eta_value in self.etas])
+
+    def update(self, slots, active_protocol):
+        """ Updates the weights of every eta with a block of slots, then the mistakes and the selected eta.
+
+        :return: the number of slots with a queued packet.
+        """
+        queued = self.queued_decisions(slots, active_protocol)
+        if queued is None:
+            return 0
+        decisions, z = queued
+        # (etas x queued x protocols), iterated slot by slot as (etas x protocols) blocks
+        factors = self.factors[:, self._protocol_index, decisions, z[:, None]].swapaxes(0, 1)
+
+        weights = self.weights
+        min_weight = self.min_weight
+        for factor in factors:
+            weights *= factor
+            np.maximum(weights, min_weight, out=weights)
+            weights /= weights.sum(axis=1, keepdims=True)
+
+        self.mistakes *= self.mistake_decay
+        self.mistakes += self.batch_loss[self.member_protocol]
+        self.member_protocol = np.argmax(weights, axis=1)
+        self.selected = int(np.argmin(self.mistakes))
+        return len(z)
+
+    def selected_eta(self):
+        return float(self.etas[self.selected])
+
+    def best_protocol(self):
+        """ Returns the best protocol of the selected eta.
+        """
+        return int(np.argmax(self.weights[self.selected]))
+
+    def store(self, suite):
+        """ Copies the weights and eta of the selected eta, and the slot offset, in the ctypes protocol_suite.
+        """
+        weights = self.weights[self.selected]
+        for p in range(self.num_protocols):
+            suite.weights[p] = weights[p]
+        suite.eta = self.selected_eta()
+        suite.slot_offset = self.slot_offset
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+metamac_replay.py: offline replay of MetaMAC slot traces, for tuning eta and benchmarking the weight engine
+
+Replays recorded stories (story.csv / story.bin of control_program.py, or the traces in the channel
+directory) through the MetaMAC weight update and protocol evaluation, for every combination of story,
+protocol suite and eta, on a process pool.
+
+Usage:
+   metamac_replay.py [options] <story>...
+
+Options:
+   --eta values        comma separated list of eta values [default: 0.5]
+   --suite names       comma separated list of protocol suites (tdma4, tdma4_aloha) [default: tdma4]
+   --batch size        slots per batch, 0 for one batch per read [default: 0]
+   --active index      protocol active at the beginning [default: 1]
+   --workers number    number of processes, 0 for one per CPU [default: 0]
+   --ensemble          also run all the eta values together, the protocol chosen by the eta with fewest mistakes
+
+Example:
+   ./metamac_replay.py --eta 0.1,0.5,1,2,5 --suite tdma4,tdma4_aloha channel/story_channel_alix0*.txt
+
+Other options:
+   -h, --help          show this help message and exit
+   --version           show version and exit
+"""
+
+import time
+
+from metamac_helper.replay import sweep
+from metamac_helper.protocols import PROTOCOL_SUITES
+
+__author__ = "Domenico Garlisi"
+__copyright__ = "Copyright (c) 2016, Technische Universität Berlin"
+__version__ = "0.1.0"
+
+
+def main(args):
+    etas = [float(eta) for eta in args['--eta'].split(',')]
+    suite_names = args['--suite'].split(',')
+    for suite_name in suite_names:
+        if suite_name not in PROTOCOL_SUITES:
+            raise SystemExit("unknown protocol suite %s, available: %s" % (suite_name, ', '.join(sorted(PROTOCOL_SUITES))))
+    workers = int(args['--workers']) or None
+
+    start = time.time()
+    results = sweep(args['<story>'], suite_names, etas, int(args['--batch']), int(args['--active']), workers,
+                    args['--ensemble'])
+    elapsed = time.time() - start
+
+    print("%-40s %-12s %8s %9s %9s %9s %12s" % ('story', 'suite', 'eta', 'slots', 'mistakes', 'switches', 'slots/s'))
+    for result in results:
+        eta = ("ens %.3f" if result['ensemble'] else "%8.3f") % result['eta']
+        print("%-40s %-12s %8s %9d %9.1f %9d %12.0f" % (result['story'], result['suite'], eta, result['slots'],
+              result['mistakes'], result['switches'], result['slots_per_s']))
+
+    # best eta for every story and suite: fewest wrong decisions of the active protocol
+    print("")
+    best = {}
+    for result in results:
+        if result['ensemble']:
+            continue
+        key = (result['story'], result['suite'])
+        if key not in best or result['mistakes'] < best[key]['mistakes']:
+            best[key] = result
+    for (story, suite_name), result in sorted(best.items()):
+        print("best eta for %s (%s) : %.3f (%.1f mistakes)" % (story, suite_name, result['eta'], result['mistakes']))
+
+    total_slots = sum(result['slots'] for result in results)
+    print("%d replays, %d slots in %.2f s (%.0f slots/s overall)" % (len(results), total_slots, elapsed, total_slots / elapsed))
+
+
+if __name__ == "__main__":
+    try:
+        from docopt import docopt
+    except:
+        print("""
+        Please install docopt using:
+            pip install docopt==0.6.1
+        For more refer to:
+        https://github.com/docopt/docopt
+        """)
+        raise
+
+    args = docopt(__doc__, version=__version__)
+    main(args)
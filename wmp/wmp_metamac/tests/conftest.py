@@ -0,0 +1,11 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import os
+import sys
+
+# the helper packages are imported as by the control programs, from the wmp_metamac directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import datetime
+import time
+import pytest
+
+from wmp_helper.ClockOffset import ClockOffsetEstimator, node_key
+
+
+class Node:
+    ip = '10.8.8.1'
+
+
+def round_trips(clock, node, offset, delays, start):
+    """ Adds round trips to a node whose clock is offset seconds ahead, with (forward, backward) delays.
+    """
+    t_send = start
+    for forward, backward in delays:
+        t_node = t_send + forward + offset
+        clock.add_round_trip(node, t_send, t_node, t_send + forward + backward)
+        t_send += 1.0
+
+
+def test_round_trips_bound_the_offset():
+    clock = ClockOffsetEstimator()
+    round_trips(clock, Node(), 0.250, [(0.010, 0.030), (0.004, 0.006), (0.020, 0.002)], time.time() - 10)
+    lower, upper = clock.bounds('10.8.8.1')
+    assert lower <= 0.250 <= upper
+    # the tightest samples win: lower from the 2 ms way back, upper from the 4 ms way forward
+    assert (lower, upper) == (pytest.approx(0.248, abs=1e-6), pytest.approx(0.254, abs=1e-6))
+    assert clock.offset(Node()) == pytest.approx(0.251, abs=1e-6)
+    assert clock.uncertainty(Node()) == pytest.approx(0.003, abs=1e-6)
+    assert clock.round_trip(Node()) == pytest.approx(0.010, abs=1e-6)
+
+
+def test_one_bound_is_not_an_offset():
+    clock = ClockOffsetEstimator(default_margin=2.0)
+    clock.add_received('10.8.8.2', time.time() + 1.0)
+    assert clock.offset('10.8.8.2') is None
+    assert clock.margin(['10.8.8.2']) == 2.0
+    exec_time, node_exec_times = clock.schedule(['10.8.8.2'])
+    assert node_exec_times['10.8.8.2'] == exec_time
+
+
+def test_schedule_in_the_node_clock():
+    clock = ClockOffsetEstimator(min_margin=0.02, guard=2.0)
+    round_trips(clock, '10.8.8.3', -1.5, [(0.005, 0.005)] * 3, time.time() - 10)
+    start = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    exec_time, node_exec_times = clock.schedule(['10.8.8.3'], start=start)
+    # margin = guard * (round trip + uncertainty)
+    assert (exec_time - start).total_seconds() == pytest.approx(2.0 * (0.010 + 0.005), abs=1e-5)
+    assert (node_exec_times['10.8.8.3'] - exec_time).total_seconds() == pytest.approx(-1.5, abs=1e-5)
+
+
+@pytest.mark.parametrize('step', [2.5, -2.5])
+def test_stepped_clock_drops_the_contradicted_samples(step):
+    clock = ClockOffsetEstimator()
+    now = time.time()
+    round_trips(clock, '10.8.8.4', 0.5, [(0.005, 0.005)] * 3, now - 20)
+    # after the step, one round trip is enough for an estimate
+    round_trips(clock, '10.8.8.4', 0.5 + step, [(0.002, 0.002)], now - 5)
+    assert clock.offset('10.8.8.4') == pytest.approx(0.5 + step, abs=1e-5)
+    assert clock.uncertainty('10.8.8.4') == pytest.approx(0.002, abs=1e-5)
+
+
+def test_old_samples_expire():
+    clock = ClockOffsetEstimator(max_age=60)
+    round_trips(clock, '10.8.8.5', 0.1, [(0.005, 0.005)], time.time() - 120)
+    assert clock.offset('10.8.8.5') is None
+    assert clock.round_trip('10.8.8.5') is None
+
+
+def test_node_key_and_forget():
+    assert node_key(Node()) == '10.8.8.1'
+    assert node_key('10.8.8.9') == '10.8.8.9'
+    clock = ClockOffsetEstimator()
+    round_trips(clock, Node(), 0.0, [(0.005, 0.005)], time.time())
+    assert set(clock.summary()) == {'10.8.8.1'}
+    clock.forget(Node())
+    assert clock.summary() == {}
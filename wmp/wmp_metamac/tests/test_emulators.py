@@ -0,0 +1,63 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import numpy as np
+import pytest
+
+from metamac_helper.emulators import DecisionTable, EMULATOR_TDMA
+from metamac_helper.protocols import PROTOCOL_SUITES, tdma_protocol, aloha_protocol
+
+
+def emulate(protocol, slot_num, slot_offset):
+    if protocol['emulator'] == EMULATOR_TDMA:
+        phase = (slot_num + slot_offset - protocol['frame_offset']) % protocol['frame_length']
+        return 1.0 if phase == protocol['slot_assignment'] else 0.0
+    return protocol['persistence']
+
+
+def test_period_is_the_least_common_multiple_of_the_frame_lengths():
+    protocols = [tdma_protocol(1, 0, frame_length=4), tdma_protocol(2, 1, frame_length=6), aloha_protocol(3, 0.5)]
+    assert DecisionTable.from_protocols(protocols).period == 12
+    assert DecisionTable.from_protocols([aloha_protocol(1, 0.3)]).period == 1
+
+
+@pytest.mark.parametrize('suite', sorted(PROTOCOL_SUITES))
+def test_rows_are_the_emulator_decisions(suite):
+    protocols = PROTOCOL_SUITES[suite] + [tdma_protocol(9, 2, frame_length=3, frame_offset=1)]
+    table = DecisionTable.from_protocols(protocols)
+    for slot_num in range(40):
+        for slot_offset in range(5):
+            assert table.row(slot_num, slot_offset) == tuple(emulate(p, slot_num, slot_offset) for p in protocols)
+
+
+def test_lookup_matches_row():
+    protocols = PROTOCOL_SUITES['tdma4_aloha']
+    table = DecisionTable.from_protocols(protocols)
+    slot_num = np.arange(100, 150)
+    offsets = np.arange(50) % 4
+    decisions, values = table.lookup(slot_num, offsets)
+    assert values.tolist() == [list(table.row(s, o)) for s, o in zip(slot_num, offsets)]
+    # integer decisions only for TDMA, 0 for ALOHA
+    assert decisions[:, :4].tolist() == values[:, :4].astype(int).tolist()
+    assert not decisions[:, 4].any()
+
+
+def test_protocol_structs_with_bytes_names():
+    class Parameter:
+        frame_offset, frame_length, slot_assignment = 0, 4, 2
+
+    class Protocol:
+        emulator = EMULATOR_TDMA.encode()
+        parameter = Parameter()
+
+    table = DecisionTable.from_protocol_structs([Protocol()])
+    assert table.emulators == [EMULATOR_TDMA]
+    assert [table.row(s, 0)[0] for s in range(4)] == [0.0, 0.0, 1.0, 0.0]
+
+
+def test_unknown_emulator():
+    with pytest.raises(ValueError):
+        DecisionTable(['csma'], [{'frame_offset': 0, 'frame_length': 1, 'slot_assignment': 0, 'persistence': 0.0}])
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import os
+import numpy as np
+import pytest
+
+from wmp_helper.MeasurementStore import MeasurementStore, run_directory
+
+MEASUREMENT_TYPES = ['TSF', 'BUSY_TIME', 'TX_DATA']
+
+
+def reports(count, samples, seed=0):
+    """ Yields (timestamp, samples) of count reports with samples rows each.
+    """
+    rng = np.random.RandomState(seed)
+    tsf = 0.0
+    for i in range(count):
+        values = rng.rand(samples, len(MEASUREMENT_TYPES)) * 1000
+        values[:, 0] = tsf + 10000 * np.arange(1, samples + 1)
+        tsf = values[-1, 0]
+        yield 100.0 + i, values
+
+
+def test_append_read_round_trip_across_chunks(tmpdir):
+    store = MeasurementStore(str(tmpdir.join('store')), chunk_rows=16, index_every=2)
+    expected = []
+    for timestamp, values in reports(9, 5):
+        store.append('10.8.8.1', MEASUREMENT_TYPES, values.tolist(), timestamp)
+        expected.extend([timestamp] + row for row in values.tolist())
+    expected = np.array(expected)
+
+    assert store.nodes() == ['10.8.8.1']
+    assert store.metrics('10.8.8.1') == ['time'] + MEASUREMENT_TYPES
+    assert store.rows('10.8.8.1') == 45
+    data = store.read('10.8.8.1')
+    for i, metric in enumerate(['time'] + MEASUREMENT_TYPES):
+        assert np.array_equal(data[metric], expected[:, i])
+    assert sum(len(chunk['TSF']) for chunk in store.iter_chunks('10.8.8.1', ['TSF'])) == 45
+    store.close()
+
+
+def test_time_range(tmpdir):
+    store = MeasurementStore(str(tmpdir.join('store')), chunk_rows=8)
+    for timestamp, values in reports(10, 4):
+        store.append('node', MEASUREMENT_TYPES, values, timestamp)
+    data = store.read('node', ['time', 'BUSY_TIME'], start=103, stop=106)
+    assert data['time'].tolist() == [103.0] * 4 + [104.0] * 4 + [105.0] * 4
+    tsf = store.read('node', ['TSF'], start=50000, stop=120000, time_metric='TSF')['TSF']
+    assert tsf.tolist() == [50000.0 + 10000 * i for i in range(7)]
+    assert len(store.read('node', start=500)['time']) == 0
+
+
+def test_one_sample_and_wrong_sizes(tmpdir):
+    store = MeasurementStore(str(tmpdir.join('store')))
+    store.append('node', MEASUREMENT_TYPES, [1, 2, 3], 5.0)
+    assert store.read('node')['BUSY_TIME'].tolist() == [2.0]
+    with pytest.raises(ValueError):
+        store.append('node', MEASUREMENT_TYPES, [1, 2], 5.0)
+    with pytest.raises(ValueError):
+        store.append('node', ['TSF', 'CW', 'IPT'], [1, 2, 3], 5.0)
+
+
+def test_reopen(tmpdir):
+    directory = str(tmpdir.join('store'))
+    store = MeasurementStore(directory, chunk_rows=8)
+    for timestamp, values in reports(3, 5):
+        store.append('node', MEASUREMENT_TYPES, values, timestamp)
+    written = store.read('node')
+    store.close()
+
+    with pytest.raises(ValueError):
+        MeasurementStore(directory)
+    reopened = MeasurementStore(directory, reopen=True)
+    assert reopened.rows('node') == 15
+    for metric in written:
+        assert np.array_equal(reopened.read('node')[metric], written[metric])
+    reopened.append('node', MEASUREMENT_TYPES, [1, 2, 3], 200.0)
+    assert reopened.read('node', start=200)['TX_DATA'].tolist() == [3.0]
+    reopened.clear('node')
+    assert reopened.nodes() == []
+    assert not os.path.exists(os.path.join(directory, 'node'))
+
+
+def test_run_directory(tmpdir):
+    base = str(tmpdir.join('measurements'))
+    first = run_directory(base)
+    os.makedirs(first)
+    second = run_directory(base)
+    assert second != first
+    assert os.path.dirname(second) == base
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import numpy as np
+import pytest
+
+from wmp_helper.RunningStatistics import RunningStats, SlidingWindowStats, TumblingWindowStats, \
+    MeasurementStatistics, WINDOW_TUMBLING
+
+
+def test_running_stats_match_numpy():
+    values = np.random.RandomState(0).normal(50, 7, 1000)
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.count == 1000
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.variance() == pytest.approx(values.var(ddof=1))
+    assert stats.total == pytest.approx(values.sum())
+    assert (stats.min, stats.max) == (values.min(), values.max())
+
+    for value in values[:400]:
+        stats.remove(value)
+    assert stats.mean == pytest.approx(values[400:].mean())
+    assert stats.variance() == pytest.approx(values[400:].var(ddof=1))
+
+
+def test_sliding_window_matches_the_samples_of_the_window():
+    rng = np.random.RandomState(1)
+    times = np.cumsum(rng.uniform(0.01, 0.2, 2000))
+    values = rng.normal(0, 1, 2000)
+    window = SlidingWindowStats(2.0)
+    for i, (timestamp, value) in enumerate(zip(times, values)):
+        window.add(timestamp, value)
+        if i % 97 == 0:
+            in_window = values[:i + 1][times[:i + 1] >= timestamp - 2.0]
+            summary = window.summary()
+            assert summary['count'] == len(in_window)
+            assert summary['mean'] == pytest.approx(in_window.mean())
+            assert (summary['min'], summary['max']) == (in_window.min(), in_window.max())
+            if len(in_window) > 1:
+                assert summary['variance'] == pytest.approx(in_window.var(ddof=1))
+
+
+def test_tumbling_windows():
+    window = TumblingWindowStats(1.0)
+    for timestamp, value in [(0.0, 1), (0.5, 3), (1.2, 10), (3.5, 7), (3.9, 9)]:
+        window.add(timestamp, value)
+    summary = window.summary()
+    assert summary['windows'] == 2
+    assert (summary['last']['start'], summary['last']['count'], summary['last']['mean']) == (1.0, 1, 10)
+    assert (summary['current']['start'], summary['current']['count'], summary['current']['mean']) == (3.0, 2, 8)
+
+
+def test_measurement_statistics_use_the_tsf_as_time():
+    statistics = MeasurementStatistics(sliding_window=1.0, tumbling_window=1.0)
+    types = ['TSF', 'BUSY_TIME', 'CW']
+    statistics.add_report('10.8.8.1', types, [[0, 10, 15], [500000, 20, 15]], 100.0)
+    statistics.add_report('10.8.8.1', types, [2000000, 30, 31], 101.0)
+    busy = statistics.query('10.8.8.1', 'BUSY_TIME')
+    assert (busy['count'], busy['mean']) == (1, 30)
+    assert statistics.query('10.8.8.1', 'BUSY_TIME', 'total')['mean'] == 20
+    assert statistics.query('10.8.8.1', 'CW', WINDOW_TUMBLING)['last']['mean'] == 15
+    assert 'TSF' not in statistics.query('10.8.8.1')['10.8.8.1']
+    assert len(statistics.report_lines()) == 2
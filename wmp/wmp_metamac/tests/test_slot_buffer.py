@@ -0,0 +1,95 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import numpy as np
+import pytest
+
+from metamac_helper.slot_buffer import SlotRingBuffer, FEEDBACK_FIELDS, SLOT_INDEX_MODULO
+
+
+def feedback_masks(flags, slot_index):
+    """ Returns the feedback bit masks of the last len(flags) slots, flags[-1] being the slot of slot_index.
+    """
+    masks = [0] * len(FEEDBACK_FIELDS)
+    count = len(flags)
+    for i, slot_flags in enumerate(flags):
+        bit = (slot_index - (count - 1 - i)) % SLOT_INDEX_MODULO
+        for f, flag in enumerate(slot_flags):
+            masks[f] |= flag << bit
+    return masks
+
+
+def random_reads(rng, reads):
+    """ Yields (slot_index, flags) of consecutive reads of 1 to SLOT_INDEX_MODULO slots.
+    """
+    slot_index = 0
+    for _ in range(reads):
+        count = rng.randint(1, SLOT_INDEX_MODULO + 1)
+        slot_index = (slot_index + count) % SLOT_INDEX_MODULO
+        yield slot_index, rng.randint(0, 2, (count, len(FEEDBACK_FIELDS))).tolist()
+
+
+def test_capacity_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        SlotRingBuffer(capacity=100)
+    with pytest.raises(ValueError):
+        SlotRingBuffer(capacity=0)
+
+
+def test_reads_round_trip():
+    rng = np.random.RandomState(1)
+    ring = SlotRingBuffer(capacity=64)
+    expected = []
+    slot_num = 0
+    for read_num, (slot_index, flags) in enumerate(random_reads(rng, 10)):
+        slot_num = ring.append_read(slot_num, read_num, 1000 * read_num, 2000 * read_num, slot_index, len(flags),
+                                    feedback_masks(flags, slot_index))
+        expected.extend(flags)
+
+    assert ring.write_seq == len(expected) == slot_num
+    slots = np.concatenate(ring.views(0))
+    assert slots['slot_num'].tolist() == list(range(1, slot_num + 1))
+    for f, name in enumerate(FEEDBACK_FIELDS):
+        assert slots[name].tolist() == [flags[f] for flags in expected]
+    assert not slots['filler'].any()
+
+
+def test_views_wrap_around_and_skip_overwritten_slots():
+    rng = np.random.RandomState(2)
+    ring = SlotRingBuffer(capacity=16)
+    expected = []
+    slot_num = 0
+    for read_num, (slot_index, flags) in enumerate(random_reads(rng, 12)):
+        slot_num = ring.append_read(slot_num, read_num, 0, 0, slot_index, len(flags),
+                                    feedback_masks(flags, slot_index))
+        expected.extend(flags)
+
+    assert ring.oldest_seq() == ring.write_seq - 16
+    views = ring.views(0)
+    slots = np.concatenate(views)
+    assert len(slots) == 16
+    assert slots['slot_num'].tolist() == list(range(slot_num - 15, slot_num + 1))
+    assert slots['packet_queued'].tolist() == [flags[0] for flags in expected[-16:]]
+    # the views share the memory of the buffer
+    assert all(np.shares_memory(view, ring.slots) for view in views)
+    assert np.concatenate(ring.latest(5))['slot_num'].tolist() == list(range(slot_num - 4, slot_num + 1))
+
+
+def test_fillers_are_published_with_the_next_read():
+    ring = SlotRingBuffer(capacity=32)
+    slot_num = ring.append_fillers(0, 1, 0, 0, 3, 12, 4)
+    assert slot_num == 4
+    assert ring.write_seq == 0
+    assert ring.wait_for(0, timeout=0) == 0
+
+    flags = [[1, 0, 0, 1, 0, 0, 1], [1, 1, 1, 0, 0, 0, 0]]
+    slot_num = ring.append_read(slot_num, 1, 0, 0, 3, 12, feedback_masks(flags, 3), count=2)
+    assert slot_num == 6
+    assert ring.wait_for(0, timeout=0) == 6
+    slots = np.concatenate(ring.views(0))
+    assert slots['filler'].tolist() == [1, 1, 1, 1, 0, 0]
+    assert slots['slot_num'].tolist() == [1, 2, 3, 4, 5, 6]
+    assert slots['channel_busy'].tolist() == [0, 0, 0, 0, 1, 0]
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import numpy as np
+import pytest
+
+from wmp_helper.trace_downsampling import minmax_downsample, lttb_downsample, downsample, synthetic_trace, \
+    DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB
+
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    x, y = synthetic_trace(20000, seed=4)
+    buckets = 100
+    dx, dy = minmax_downsample(x, y, buckets)
+    assert len(dx) <= 2 * buckets
+    assert np.all(np.diff(dx) > 0)
+    edges = x[0] + (x[-1] - x[0]) * np.arange(buckets + 1) / float(buckets)
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bucket = (x >= low) & (x < high)
+        kept = (dx >= low) & (dx < high)
+        if in_bucket.any() and kept.any():
+            assert dy[kept].min() == y[in_bucket].min()
+            assert dy[kept].max() == y[in_bucket].max()
+    assert dy.max() == y.max() and dy.min() == y.min()
+
+
+def test_minmax_sorts_unordered_samples():
+    x = np.array([5.0, 1.0, 3.0, 2.0, 4.0, 0.0])
+    y = np.array([50.0, 10.0, 30.0, 20.0, 40.0, 0.0])
+    dx, dy = minmax_downsample(x, y, 2)
+    assert np.all(np.diff(dx) > 0)
+    assert np.array_equal(dy, dx * 10)
+
+
+def test_lttb_keeps_threshold_samples_and_the_ends():
+    x, y = synthetic_trace(10000, seed=5)
+    dx, dy = lttb_downsample(x, y, 500)
+    assert len(dx) == 500
+    assert (dx[0], dx[-1]) == (x[0], x[-1])
+    assert np.all(np.diff(dx) > 0)
+    assert set(dx) <= set(x)
+
+
+def test_downsample():
+    x, y = synthetic_trace(3000, seed=6)
+    assert downsample(x, y, None, 100)[0] is x
+    assert downsample(x, y, DOWNSAMPLE_LTTB, 5000)[0] is x
+    assert len(downsample(x, y, DOWNSAMPLE_MINMAX, 100)[0]) <= 100
+    assert len(downsample(x, y, DOWNSAMPLE_LTTB, 100)[0]) == 100
+    with pytest.raises(ValueError):
+        downsample(x, y, 'mean', 100)
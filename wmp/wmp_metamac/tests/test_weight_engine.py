@@ -0,0 +1,114 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import math
+import numpy as np
+import pytest
+
+from metamac_helper.emulators import EMULATOR_TDMA
+from metamac_helper.protocols import PROTOCOL_SUITES
+from metamac_helper.slot_buffer import SLOT_DTYPE
+from metamac_helper.weight_engine import WeightEngine, EnsembleWeightEngine, MIN_WEIGHT
+
+
+def emulate(protocol, slot_num, slot_offset):
+    """ Decision of a protocol in a slot, as tdma_emulate and aloha_emulate of the local control program.
+    """
+    if protocol['emulator'] == EMULATOR_TDMA:
+        phase = (slot_num + slot_offset - protocol['frame_offset']) % protocol['frame_length']
+        return 1.0 if phase == protocol['slot_assignment'] else 0.0
+    return protocol['persistence']
+
+
+def scalar_update_weights(protocols, weights, slot_offset, eta, slots, active_protocol):
+    """ update_weights of the local control program, one slot at a time.
+    """
+    for current_slot in slots:
+        slot_num = int(current_slot['slot_num'])
+        params = protocols[active_protocol]
+        if current_slot['transmitted'] and params['emulator'] == EMULATOR_TDMA:
+            neg_offset = (slot_num - params['frame_offset'] - params['slot_assignment']) % params['frame_length']
+            slot_offset = (params['frame_length'] - neg_offset) % params['frame_length']
+        if current_slot['packet_queued']:
+            z = 0.0
+            if not current_slot['channel_busy']:
+                z = 1.0
+            for p in range(len(protocols)):
+                d = emulate(protocols[p], slot_num, slot_offset)
+                exponent = eta * math.fabs(d - z)
+                weights[p] *= math.exp(-exponent)
+                if weights[p] < MIN_WEIGHT:
+                    weights[p] = MIN_WEIGHT
+            s = 0
+            for p in range(len(protocols)):
+                s += weights[p]
+            for p in range(len(protocols)):
+                weights[p] /= s
+    return weights, slot_offset
+
+
+def random_slots(count, seed, first_slot=1):
+    rng = np.random.RandomState(seed)
+    slots = np.zeros(count, dtype=SLOT_DTYPE)
+    slots['slot_num'] = np.arange(first_slot, first_slot + count)
+    slots['packet_queued'] = rng.rand(count) < 0.7
+    slots['transmitted'] = slots['packet_queued'] & (rng.rand(count) < 0.3)
+    slots['channel_busy'] = rng.rand(count) < 0.4
+    return slots
+
+
+@pytest.mark.parametrize('suite', sorted(PROTOCOL_SUITES))
+@pytest.mark.parametrize('eta', [0.1, 0.5, 2.0])
+def test_batched_update_is_identical_to_the_scalar_update(suite, eta):
+    protocols = PROTOCOL_SUITES[suite]
+    engine = WeightEngine.from_protocols(protocols, eta)
+    weights = [1.0 / len(protocols)] * len(protocols)
+    slot_offset = 0
+    first_slot = 1
+    for block, active_protocol in enumerate([0, 2, 1, 3, 0, len(protocols) - 1]):
+        slots = random_slots(60, seed=block, first_slot=first_slot)
+        first_slot += len(slots)
+        engine.update(slots, active_protocol)
+        weights, slot_offset = scalar_update_weights(protocols, weights, slot_offset, eta, slots, active_protocol)
+        # bit-identical, not only close
+        assert engine.weights.tolist() == weights
+        assert engine.slot_offset == slot_offset
+
+
+def test_block_size_does_not_change_the_weights():
+    protocols = PROTOCOL_SUITES['tdma4_aloha']
+    slots = random_slots(600, seed=7)
+    whole = WeightEngine.from_protocols(protocols, 0.5)
+    whole.update(slots, 1)
+    blocks = WeightEngine.from_protocols(protocols, 0.5)
+    for start in range(0, len(slots), 37):
+        blocks.update(slots[start:start + 37], 1)
+    assert np.array_equal(whole.weights, blocks.weights)
+    # the ALOHA loss is a float sum, its rounding depends on the blocks
+    assert np.allclose(whole.loss, blocks.loss)
+
+
+def test_slots_without_queued_packets_do_not_change_the_weights():
+    engine = WeightEngine.from_protocols(PROTOCOL_SUITES['tdma4'], 1.0)
+    slots = random_slots(50, seed=3)
+    slots['packet_queued'] = 0
+    assert engine.update(slots, 0) == 0
+    assert engine.weights.tolist() == [0.25] * 4
+
+
+def test_ensemble_weights_are_the_ones_of_single_engines():
+    protocols = PROTOCOL_SUITES['tdma4_aloha']
+    etas = [0.1, 0.5, 2.0]
+    ensemble = EnsembleWeightEngine.from_protocols(protocols, etas)
+    engines = [WeightEngine.from_protocols(protocols, eta) for eta in etas]
+    for block in range(5):
+        slots = random_slots(80, seed=10 + block, first_slot=1 + 80 * block)
+        ensemble.update(slots, block % 4)
+        for engine in engines:
+            engine.update(slots, block % 4)
+    for row, engine in zip(ensemble.weights, engines):
+        assert np.array_equal(row, engine.weights)
+    assert ensemble.selected_eta() in etas
@@ -58,6 +58,8 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # Definition of Local Control Program
 def my_local_control_program(controller):
+	#imported here, the function is shipped to the node by start_local_control_program
+	from metamac_helper.emulators import DecisionTable, EMULATOR_TDMA
 
 	#Flags
 	FLAG_USE_BUSY = 0
@@ -84,8 +86,8 @@ def my_local_control_program(controller):
 		_fields_= [
 			('frame_offset', ctypes.c_int),
 			('frame_length', ctypes.c_int),
-			('slot_assignment', ctypes.c_int)
-			('persistence', ctypes.c_int)
+			('slot_assignment', ctypes.c_int),
+			('persistence', ctypes.c_double)
 		]
 
 	class fsm_param(ctypes.Structure):
@@ -182,9 +184,9 @@ def my_local_control_program(controller):
 			#Offset of slots numbering from read loop to slot numbering for TDMA.
 			('slot_offset', ctypes.c_int),
 			#Array of all protocols.
-			('protocols', protocol * 4),
+			('protocols', protocol * 5),
 			#Array of weights corresponding to protocols.
-			('weights', ctypes.c_double * 4),	#double *weights; !!!WARNING for *
+			('weights', ctypes.c_double * 5),	#double *weights; !!!WARNING for *
 			#Factor used in computing weights.
 			('eta', ctypes.c_double),
 			#Slot information for last to be emulated.
@@ -226,20 +228,6 @@ def my_local_control_program(controller):
 
 
 
-	def tdma_emulate(param, slot_num, offset):
-		slot_num += offset
-		tdma_params = param
-		if ((slot_num - tdma_params.frame_offset) % tdma_params.frame_length) == tdma_params.slot_assignment :
-			result = 1.0
-		else :
-			result = 0.0
-
-		return result
-
-	def aloha_emulate(param, slot_num, offset, metamac_slot, previous_slot):
-		aloha_params = param
-		return aloha_param.persistence
-
 	def configure_params(b43, slot, param):
 
 		#while (param != N) {
@@ -544,7 +532,7 @@ def my_local_control_program(controller):
 
 
 		#if (suite.protocols[suite.active_protocol].emulator == tdma_emulate && current_slot.transmitted):
-		if (current_slot.transmitted):
+		if (current_slot.transmitted and decision_table.emulators[suite.active_protocol] == EMULATOR_TDMA):
 			#Update slot_offset
 			params = suite.protocols[suite.active_protocol].parameter
 			neg_offset = (current_slot.slot_num - params.frame_offset - params.slot_assignment) % params.frame_length
@@ -561,12 +549,14 @@ def my_local_control_program(controller):
 				z = 1.0
 
 
+			#decisions of all protocols (TDMA and ALOHA), from the precompiled tables
+			decisions = decision_table.row(current_slot.slot_num, suite.slot_offset)
 			for p in range(suite.num_protocols) :
 				# d is the decision of this component protocol - between 0 and 1
 #				d = suite.protocols[p].emulator(suite->protocols[p].parameter,
 #					current_slot.slot_num, suite->slot_offset, suite->last_slot);
 
-				d = tdma_emulate(suite.protocols[p].parameter, current_slot.slot_num, suite.slot_offset)
+				d = decisions[p]
 
 #				stdout.write("[%d] d=%e, z=%e \n" % (p, d, z,))
 
@@ -621,7 +611,7 @@ def my_local_control_program(controller):
 		sys.exit('Usage: %s eta_value' % sys.argv[0])
 
 	suite = protocol_suite()
-	num_protocols = 4
+	num_protocols = 5
 	#eta = 0.5
 	eta = float(sys.argv[1])
 	print('eta = %f' % eta)
@@ -712,9 +702,13 @@ def my_local_control_program(controller):
 	suite.protocols[1] = protocols[1]
 	suite.protocols[2] = protocols[2]
 	suite.protocols[3] = protocols[3]
-	for p in range(4) :
+	suite.protocols[4] = protocols[4]
+	for p in range(num_protocols) :
 		suite.weights[p] = 1.0 / num_protocols
 
+	#decision tables of the protocol emulators (see metamac_helper/emulators.py)
+	decision_table = DecisionTable.from_protocol_structs(protocols)
+
 	suite.eta = eta
 	suite.last_slot.slot_num = -1
 	suite.last_slot.packet_queued = 0
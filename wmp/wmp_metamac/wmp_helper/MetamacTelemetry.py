@@ -0,0 +1,323 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import sys
+import time
+import threading
+from collections import deque
+import numpy as np
+import zmq
+
+
+class NodeHistory:
+    """
+    This class defines the time-indexed history of the MetaMAC updates of one node: a fixed-capacity ring of
+    NumPy arrays (update time, active protocol, weights), so memory does not grow with the experiment.
+    """
+
+    def __init__(self, num_protocols, capacity=4096):
+        self.num_protocols = num_protocols
+        self.capacity = capacity
+        self.time = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype=np.int16)
+        self.weights = np.zeros((capacity, num_protocols), dtype=np.float32)
+        self.count = 0
+        self.switches = 0
+        self.first_update = None
+        self.last_switch = None
+
+    def append(self, timestamp, active, weights):
+        """ Stores an update.
+
+        :return: True when the active protocol changed.
+        """
+        switched = self.count > 0 and self.active[(self.count - 1) % self.capacity] != active
+        row = self.count % self.capacity
+        self.time[row] = timestamp
+        self.active[row] = active
+        self.weights[row] = weights
+        self.count += 1
+        if self.first_update is None:
+            self.first_update = timestamp
+        if switched:
+            self.switches += 1
+            self.last_switch = timestamp
+        return switched
+
+    def latest(self):
+        """ Returns the last update as (time, active protocol, weights).
+        """
+        row = (self.count - 1) % self.capacity
+        return self.time[row], int(self.active[row]), self.weights[row]
+
+    def window(self, since=None, until=None):
+        """ Returns the stored updates with since <= time < until, in time order.
+
+        :return: tuple of arrays (time, active, weights), copies.
+        """
+        stored = min(self.count, self.capacity)
+        start = self.count - stored
+        order = (start + np.arange(stored)) % self.capacity
+        times = self.time[order]
+        first = 0 if since is None else np.searchsorted(times, since, side='left')
+        last = stored if until is None else np.searchsorted(times, until, side='left')
+        rows = order[first:last]
+        return self.time[rows], self.active[rows], self.weights[rows]
+
+
+class FleetTelemetry:
+    """
+    This class defines the controller-side aggregator of the MetaMAC state of all nodes of the experiment.
+    Every update of a node (active protocol and weights) is stored in the NodeHistory of the node, and the
+    fleet metrics are kept up to date incrementally:
+      - protocol agreement: share of nodes running the most common protocol, from the count of nodes per
+        active protocol;
+      - switch rate: protocol switches of all nodes per second, over the last switch_window seconds;
+      - convergence: a node is converged when its protocol did not change for stable_time seconds and its
+        highest weight is at least converged_weight; the fleet convergence time is the time from the first
+        update to the last switch of any node, once all nodes are converged.
+    Updates and queries can come from different threads.
+    """
+
+    def __init__(self, capacity=4096, switch_window=60.0, stable_time=5.0, converged_weight=0.5):
+        """
+        :param capacity: number of updates kept per node.
+        :param switch_window: window of the switch rate [s].
+        :param stable_time: time without switches after which a node is converged [s].
+        :param converged_weight: minimum weight of the active protocol of a converged node.
+        """
+        self.capacity = capacity
+        self.switch_window = switch_window
+        self.stable_time = stable_time
+        self.converged_weight = converged_weight
+        self.histories = {}
+        self.active_count = {}
+        self.switch_times = deque()
+        self.switches = 0
+        self.updates = 0
+        self.malformed = 0
+        self.start_time = None
+        self.last_switch = None
+        self._lock = threading.Lock()
+
+    def ingest(self, node, active, weights, timestamp=None):
+        """ Stores the update of a node.
+
+        :param node: node identifier, its IP address.
+        :param active: index of the active protocol.
+        :param weights: list of weights of the protocols.
+        :param timestamp: time of the update [s], default is now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        active = int(active)
+        with self._lock:
+            history = self.histories.get(node)
+            if history is None:
+                history = NodeHistory(len(weights), self.capacity)
+                self.histories[node] = history
+            elif len(weights) != history.num_protocols:
+                raise ValueError("node %s sent %d weights, %d expected" % (node, len(weights), history.num_protocols))
+            else:
+                previous = history.latest()[1]
+                self.active_count[previous] -= 1
+            self.active_count[active] = self.active_count.get(active, 0) + 1
+
+            if history.append(timestamp, active, weights):
+                self.switches += 1
+                self.switch_times.append(timestamp)
+                self.last_switch = timestamp if self.last_switch is None else max(self.last_switch, timestamp)
+            if self.start_time is None:
+                self.start_time = timestamp
+            self.updates += 1
+
+    def ingest_message(self, message, timestamp=None):
+        """ Stores an update received from a node, in one of the formats sent by the nodes:
+            {'node_ip_address': [ip], 'active': 1, 'weights': [..]} of the local control program (directly or
+            through the visualizer publisher), or {'node_ip_address': [ip, port], 'active': '1', '0': ['0.25',
+            'TDMA (slot 0)'], ..} of the UDP datagrams relayed by demo_gateway.py.
+        """
+        try:
+            node = message['node_ip_address']
+            if isinstance(node, (list, tuple)):
+                node = node[0]
+            if 'weights' in message:
+                weights = [float(w) for w in message['weights']]
+            else:
+                protocols = sorted(int(key) for key in message if key.isdigit())
+                weights = [float(message[str(p)][0]) for p in protocols]
+            self.ingest(str(node), int(message['active']), weights, timestamp)
+        except (KeyError, ValueError, TypeError, IndexError):
+            self.malformed += 1
+
+    def nodes(self):
+        with self._lock:
+            return sorted(self.histories)
+
+    def _node_state(self, node, history, now):
+        timestamp, active, weights = history.latest()
+        stable_since = history.last_switch if history.last_switch is not None else history.first_update
+        return {'node': node,
+                'active': active,
+                'weights': [float(w) for w in weights],
+                'updates': history.count,
+                'switches': history.switches,
+                'last_update': float(timestamp),
+                'stable_for': now - stable_since,
+                'converged': bool(now - stable_since >= self.stable_time and weights[active] >= self.converged_weight)}
+
+    def node_state(self, node, now=None):
+        """ Returns the last state of a node.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return self._node_state(node, self.histories[node], now)
+
+    def node_history(self, node, since=None, until=None):
+        """ Returns the updates of a node with since <= time < until.
+
+        :return: dictionary with the lists time, active and weights.
+        """
+        with self._lock:
+            times, active, weights = self.histories[node].window(since, until)
+        return {'node': node, 'time': times.tolist(), 'active': active.tolist(), 'weights': weights.tolist()}
+
+    def fleet_metrics(self, now=None):
+        """ Returns the metrics of the whole fleet.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            while self.switch_times and self.switch_times[0] < now - self.switch_window:
+                self.switch_times.popleft()
+            num_nodes = len(self.histories)
+            active_count = dict((p, c) for p, c in self.active_count.items() if c > 0)
+            majority = max(active_count, key=active_count.get) if active_count else None
+            converged = sum(1 for node, history in self.histories.items()
+                            if self._node_state(node, history, now)['converged'])
+            convergence_time = None
+            if num_nodes and converged == num_nodes:
+                last_change = self.last_switch if self.last_switch is not None else self.start_time
+                convergence_time = last_change - self.start_time
+            return {'time': now,
+                    'nodes': num_nodes,
+                    'updates': self.updates,
+                    'malformed': self.malformed,
+                    'active_count': dict((str(p), c) for p, c in active_count.items()),
+                    'majority_protocol': majority,
+                    'agreement': active_count[majority] / float(num_nodes) if num_nodes else 0.0,
+                    'switches': self.switches,
+                    'switch_rate': len(self.switch_times) / self.switch_window,
+                    'converged_nodes': converged,
+                    'convergence_time': convergence_time}
+
+    def query(self, request):
+        """ Answers a dashboard query.
+
+        :param request: dictionary with query 'metrics', 'nodes', 'node' (with node) or 'history' (with node,
+            optional since and until).
+        :return: JSON serializable answer, with an error field on bad queries.
+        """
+        try:
+            kind = request.get('query', 'metrics')
+            if kind == 'metrics':
+                return self.fleet_metrics()
+            if kind == 'nodes':
+                now = time.time()
+                return {'nodes': [self.node_state(node, now) for node in self.nodes()]}
+            if kind == 'node':
+                return self.node_state(request['node'])
+            if kind == 'history':
+                return self.node_history(request['node'], request.get('since'), request.get('until'))
+            return {'error': 'unknown query %s' % kind}
+        except KeyError as e:
+            return {'error': 'unknown node or missing field %s' % e}
+
+
+class TelemetryServer:
+    """
+    This class defines the network side of the aggregator: a thread receives the node updates, a thread
+    answers the dashboard queries (zmq REQ/REP, JSON).
+    Updates are received with a PULL socket bound on ingest_address, where the nodes push their state
+    (see metamac_helper/visualizer_publisher.py), or with a SUB socket connected to the PUB socket of
+    demo_gateway.py.
+    """
+
+    def __init__(self, telemetry, ingest_address="tcp://*:8310", query_address="tcp://*:8311", ingest_type=zmq.PULL):
+        self.telemetry = telemetry
+        self.ingest_address = ingest_address
+        self.query_address = query_address
+        self.ingest_type = ingest_type
+        self.context = zmq.Context.instance()
+        self.do_run = True
+
+    def start(self):
+        for target in (self._ingest_loop, self._query_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.do_run = False
+
+    def _ingest_loop(self):
+        socket = self.context.socket(self.ingest_type)
+        if self.ingest_type == zmq.SUB:
+            socket.setsockopt(zmq.SUBSCRIBE, b'')
+            socket.connect(self.ingest_address)
+        else:
+            socket.bind(self.ingest_address)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        while self.do_run:
+            if not poller.poll(500):
+                continue
+            try:
+                message = socket.recv_json()
+            except ValueError:
+                self.telemetry.malformed += 1
+                continue
+            self.telemetry.ingest_message(message)
+        socket.close(0)
+
+    def _query_loop(self):
+        socket = self.context.socket(zmq.REP)
+        socket.bind(self.query_address)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        while self.do_run:
+            if not poller.poll(500):
+                continue
+            try:
+                request = socket.recv_json()
+            except ValueError:
+                socket.send_json({'error': 'malformed query'})
+                continue
+            socket.send_json(self.telemetry.query(request))
+        socket.close(0)
+
+
+def main():
+    # usage: MetamacTelemetry.py [ingest_address [query_address]], a tcp://host:port address to connect to
+    # (e.g. the demo gateway PUB socket tcp://10.8.8.10:8300) subscribes, otherwise nodes push on tcp://*:8310
+    ingest_address = sys.argv[1] if len(sys.argv) > 1 else "tcp://*:8310"
+    query_address = sys.argv[2] if len(sys.argv) > 2 else "tcp://*:8311"
+    ingest_type = zmq.PULL if '*' in ingest_address else zmq.SUB
+    telemetry = FleetTelemetry()
+    server = TelemetryServer(telemetry, ingest_address, query_address, ingest_type)
+    server.start()
+    print('MetaMAC telemetry: updates on %s, queries on %s' % (ingest_address, query_address))
+    while True:
+        time.sleep(5)
+        metrics = telemetry.fleet_metrics()
+        print('nodes %d - agreement %.2f (protocol %s) - switch rate %.2f/s - converged %d - convergence time %s' % (
+            metrics['nodes'], metrics['agreement'], metrics['majority_protocol'], metrics['switch_rate'],
+            metrics['converged_nodes'], metrics['convergence_time']))
+
+
+if __name__ == "__main__":
+    main()
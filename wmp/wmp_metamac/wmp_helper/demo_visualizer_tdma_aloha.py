@@ -14,11 +14,12 @@ from socket import *    # import *, but we'll avoid name conflict
 from sys import argv
 from thread import start_new_thread
 
-HELP_MSG	= sys.argv[0]+" --address <IP> [--interval <X.Y>] [--max-ping <X>] [--history <X>] [--window-height <X>] [--window-width <X>] [--fullscreen] [--ping-threshold <X>]"
+HELP_MSG	= sys.argv[0]+" --address <IP> [--interval <X.Y>] [--max-ping <X>] [--history <X>] [--window-height <X>] [--window-width <X>] [--fullscreen] [--ping-threshold <X>] [--nodes-push <0|1>]"
 
 IP_ADDR		= "192.168.5.222" # Default IP
 CLOCK_DELTA	= 0.1 #0.02 # Minimal refresh rate
 MAX_PING	= 150.0 # The visualization will automatically scale to display 0 ping on top and MAX_PING ping at the bottom
+NODES_PUSH	= 1 # 1 if the nodes push their state (FLAG_VISUALIZER_PUSH of control_program.py), 0 if they use the REQ socket
 
 MAX_DRAW_LINE = 6
 MAX_RX_ACK_LINE = MAX_DRAW_LINE
@@ -87,6 +88,7 @@ def parseArgs():
 	global HISTORY_SIZE
 	global RESOLUTION
 	global PING_THRESHOLD
+	global NODES_PUSH
 
 	try:
 		while (True):
@@ -112,6 +114,8 @@ def parseArgs():
 				RESOLUTION = (RESOLUTION[0], int(getNextArg()))
 			elif (a == "--ping-threshold"):
 				PING_THRESHOLD = float(getNextArg())
+			elif (a == "--nodes-push"):
+				NODES_PUSH = int(getNextArg())
 	except IndexError:
 		pass
 
@@ -401,15 +405,22 @@ def ho_event(x):
 		# 			stations_dump[i][4] = parsed_json['0'][1]	#protocol 1 name
 
 		#communication with Python program
+		#nodes push their state without waiting for a reply (FLAG_VISUALIZER_PUSH of control_program.py),
+		#run with --nodes-push 0 for nodes using the REQ socket
+		nodes_push = NODES_PUSH
 		port = "8300"
 		context = zmq.Context()
-		socket = context.socket(zmq.REP)
+		if nodes_push :
+			socket = context.socket(zmq.PULL)
+		else :
+			socket = context.socket(zmq.REP)
 		socket.bind("tcp://*:%s" % port)
 
 		while True:
 			parsed_json = socket.recv_json()
 			#print('parsed_json : %s' % str(parsed_json))
-			socket.send("ACK")
+			if not nodes_push :
+				socket.send("ACK")
 			#
 			remote_ipAddress = parsed_json['node_ip_address'][0]
 			len_station_dump = len(stations_dump)
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+__author__ = 'Domenico Garlisi'
+"""
+EU project WISHFUL
+"""
+
+import time
+import datetime
+from collections import deque
+
+
+def node_key(node):
+    """ Returns the key of a node in the clock offset estimator: the control ip address of a Node or of a WiFiNode,
+        or the ip address itself
+    """
+    if isinstance(node, str):
+        return node
+    if hasattr(node, 'ip'):
+        return node.ip
+    if hasattr(node, 'getIpAddress'):
+        return node.getIpAddress()
+    return str(node)
+
+
+def to_seconds(timestamp):
+    """ Returns the unix time [s] of a datetime or of a number, None if the timestamp is not a time
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1e6
+    try:
+        return float(timestamp)
+    except (TypeError, ValueError):
+        return None
+
+
+class ClockOffsetEstimator:
+    """
+    This class estimates, for every node, the offset of the node clock from the controller clock
+    (offset = node clock - controller clock), from the timestamps already carried by the control traffic,
+    and corrects the execution time of the scheduled UPI calls (exec_time, runAt) node by node.
+
+    Every timestamp bounds the offset:
+    - a message stamped by the node at t_node and received by the controller at t_receive: offset >= t_node - t_receive
+    - a command sent by the controller at t_send and stamped by the node at t_node: offset <= t_node - t_send
+    - a round trip (t_send, t_node, t_receive) gives both bounds, the offset is within half the round trip time.
+    The estimate is the middle of the tightest interval given by the last window samples of the node (the samples
+    with the shortest network delays win, as in the NTP clock filter), the uncertainty is half the interval width.
+    When a new sample contradicts the older ones (the node clock has been stepped) the older samples are dropped.
+
+    The offset of a node is used only when both bounds are known, otherwise its calls are scheduled uncorrected with
+    the default margin: the margin shrinks to tens of milliseconds only for the nodes with round trip samples.
+    """
+
+    def __init__(self, window=32, max_age=600, default_margin=2.0, min_margin=0.02, guard=2.0):
+        """ Creates an empty estimator
+        :param window: number of samples kept per node and per bound
+        :param max_age: samples older than max_age seconds are dropped [s]
+        :param default_margin: scheduling margin when a node has no offset estimate [s]
+        :param min_margin: smallest scheduling margin [s]
+        :param guard: the margin is guard times the round trip time plus the offset uncertainty
+        """
+        self.window = window
+        self.max_age = max_age
+        self.default_margin = default_margin
+        self.min_margin = min_margin
+        self.guard = guard
+        # node key -> deque of (controller time of the sample, bound)
+        self.lower = {}
+        self.upper = {}
+        # node key -> deque of (controller time of the sample, round trip time)
+        self.round_trips = {}
+
+    def _append(self, samples, key, sample):
+        if key not in samples:
+            samples[key] = deque(maxlen=self.window)
+        samples[key].append(sample)
+
+    def _expire(self, key, now=None):
+        oldest = (time.time() if now is None else now) - self.max_age
+        for samples in (self.lower, self.upper, self.round_trips):
+            queue = samples.get(key)
+            while queue and queue[0][0] < oldest:
+                queue.popleft()
+
+    def _reconcile(self, key, newest):
+        """ Drops the samples of the other bound that contradict the newest sample of bound newest
+        """
+        bound = newest[key][-1][1]
+        if newest is self.lower:
+            other, contradicts = self.upper, lambda sample: sample[1] < bound
+        else:
+            other, contradicts = self.lower, lambda sample: sample[1] > bound
+        samples = other.get(key)
+        if samples and any(contradicts(sample) for sample in samples):
+            other[key] = deque((sample for sample in samples if not contradicts(sample)), maxlen=self.window)
+
+    def add_received(self, node, t_node, t_receive=None):
+        """ Adds a message stamped by the node at t_node and received by the controller at t_receive (now if None)
+        :return: True if the timestamps are usable
+        """
+        t_node = to_seconds(t_node)
+        t_receive = time.time() if t_receive is None else to_seconds(t_receive)
+        if t_node is None or t_receive is None:
+            return False
+        key = node_key(node)
+        self._append(self.lower, key, (t_receive, t_node - t_receive))
+        self._reconcile(key, self.lower)
+        return True
+
+    def add_sent(self, node, t_send, t_node):
+        """ Adds a command sent by the controller at t_send and stamped by the node at t_node
+        :return: True if the timestamps are usable
+        """
+        t_send = to_seconds(t_send)
+        t_node = to_seconds(t_node)
+        if t_send is None or t_node is None:
+            return False
+        key = node_key(node)
+        self._append(self.upper, key, (t_send, t_node - t_send))
+        self._reconcile(key, self.upper)
+        return True
+
+    def add_round_trip(self, node, t_send, t_node, t_receive=None):
+        """ Adds a round trip: a command sent at t_send, stamped by the node at t_node and answered at t_receive
+        :return: True if the timestamps are usable
+        """
+        t_send = to_seconds(t_send)
+        t_node = to_seconds(t_node)
+        t_receive = time.time() if t_receive is None else to_seconds(t_receive)
+        if t_send is None or t_node is None or t_receive is None or t_receive < t_send:
+            return False
+        key = node_key(node)
+        self.add_sent(key, t_send, t_node)
+        self.add_received(key, t_node, t_receive)
+        self._append(self.round_trips, key, (t_receive, t_receive - t_send))
+        return True
+
+    def bounds(self, node):
+        """ Returns the (lower, upper) bounds of the node offset [s], None when a bound is not known
+        """
+        key = node_key(node)
+        self._expire(key)
+        lower = self.lower.get(key)
+        upper = self.upper.get(key)
+        return (max(bound for _, bound in lower) if lower else None,
+                min(bound for _, bound in upper) if upper else None)
+
+    def offset(self, node):
+        """ Returns the node clock offset from the controller clock [s], None if it is not known
+        """
+        lower, upper = self.bounds(node)
+        if lower is None or upper is None:
+            return None
+        return (lower + upper) / 2.0
+
+    def uncertainty(self, node):
+        """ Returns the maximum error of the node clock offset [s], None if the offset is not known
+        """
+        lower, upper = self.bounds(node)
+        if lower is None or upper is None:
+            return None
+        return (upper - lower) / 2.0
+
+    def round_trip(self, node):
+        """ Returns the shortest round trip time of the node [s], None if there is no round trip sample
+        """
+        key = node_key(node)
+        self._expire(key)
+        samples = self.round_trips.get(key)
+        return min(rtt for _, rtt in samples) if samples else None
+
+    def forget(self, node=None):
+        """ Drops the samples of node, of all the nodes if node is None
+        """
+        if node is None:
+            self.lower.clear()
+            self.upper.clear()
+            self.round_trips.clear()
+            return
+        key = node_key(node)
+        for samples in (self.lower, self.upper, self.round_trips):
+            samples.pop(key, None)
+
+    def node_time(self, node, controller_time):
+        """ Returns the time of the node clock at the controller time controller_time (a datetime or a unix time),
+            controller_time itself if the node offset is not known
+        """
+        offset = self.offset(node)
+        if offset is None:
+            return controller_time
+        if isinstance(controller_time, datetime.datetime):
+            return controller_time + datetime.timedelta(seconds=offset)
+        return controller_time + offset
+
+    def margin(self, nodes):
+        """ Returns the delay [s] between now and the execution time of a call scheduled on all the nodes: guard times
+            the round trip time plus the offset uncertainty of the slowest node, default_margin if a node has no
+            round trip sample
+        """
+        needed = 0.0
+        for node in nodes:
+            rtt = self.round_trip(node)
+            uncertainty = self.uncertainty(node)
+            if rtt is None or uncertainty is None:
+                return self.default_margin
+            needed = max(needed, self.guard * (rtt + uncertainty))
+        return min(self.default_margin, max(self.min_margin, needed))
+
+    def schedule(self, nodes, margin=None, start=None):
+        """ Returns the controller time at which a call runs on all the nodes at once and, for every node, the time
+            of its own clock at that instant, to use as its exec_time
+        :param nodes: nodes list
+        :param margin: delay between start and the execution [s], the margin of the nodes if None
+        :param start: controller datetime, now if None
+        :return exec_time, node_exec_times: controller datetime, dictionary node key -> node datetime
+        """
+        if margin is None:
+            margin = self.margin(nodes)
+        if start is None:
+            start = datetime.datetime.now()
+        exec_time = start + datetime.timedelta(seconds=margin)
+        return exec_time, dict((node_key(node), self.node_time(node, exec_time)) for node in nodes)
+
+    def summary(self):
+        """ Returns a dictionary node key -> {'offset', 'uncertainty', 'round_trip' [s], 'samples'}
+        """
+        keys = set(self.lower) | set(self.upper)
+        return dict((key, {'offset': self.offset(key), 'uncertainty': self.uncertainty(key),
+                           'round_trip': self.round_trip(key),
+                           'samples': len(self.lower.get(key, ())) + len(self.upper.get(key, ()))})
+                    for key in keys)
+
+    def log_summary(self, log):
+        for key, estimate in sorted(self.summary().items()):
+            if estimate['offset'] is None:
+                log.info('clock %s : offset unknown (%d samples)' % (key, estimate['samples']))
+            else:
+                log.info('clock %s : offset %+.1fms +/- %.1fms, round trip %s (%d samples)'
+                         % (key, estimate['offset'] * 1e3, estimate['uncertainty'] * 1e3,
+                            '-' if estimate['round_trip'] is None else '%.1fms' % (estimate['round_trip'] * 1e3),
+                            estimate['samples']))
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import sys
+import time
+import numpy as np
+
+# Downsampling methods of the measurement plots (see the 'downsample' key of the plot configuration of
+# MeasurementCollector).
+DOWNSAMPLE_MINMAX = 'minmax'
+DOWNSAMPLE_LTTB = 'lttb'
+
+
+def minmax_downsample(x, y, buckets):
+    """ Keeps the minimum and the maximum of y in each of buckets intervals of x of the same width (one per
+        pixel of the figure), so spikes and the envelope of the trace are drawn as with all the samples.
+
+    :param x: array of x values.
+    :param y: array of y values.
+    :param buckets: number of intervals.
+    :return: tuple of arrays (x, y) with at most 2 * buckets samples, in x order.
+    """
+    n = len(x)
+    if n <= 2 * buckets:
+        return x, y
+    if np.any(np.diff(x) < 0):
+        order = np.argsort(x, kind='mergesort')
+        x, y = x[order], y[order]
+    span = x[-1] - x[0]
+    if span > 0:
+        bucket = np.minimum(((x - x[0]) * (buckets / float(span))).astype(np.int64), buckets - 1)
+    else:
+        bucket = np.arange(n) * buckets // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    segment = np.cumsum(np.r_[False, bucket[1:] != bucket[:-1]])
+    # first sample of each bucket equal to the bucket minimum, and to the bucket maximum
+    index = np.arange(n)
+    is_min = y == np.minimum.reduceat(y, starts)[segment]
+    is_max = y == np.maximum.reduceat(y, starts)[segment]
+    first_min = np.minimum.reduceat(np.where(is_min, index, n), starts)
+    first_max = np.minimum.reduceat(np.where(is_max, index, n), starts)
+    keep = np.unique(np.concatenate((first_min, first_max)))
+    return x[keep], y[keep]
+
+
+def lttb_downsample(x, y, threshold):
+    """ Largest-Triangle-Three-Buckets: keeps threshold samples, the first, the last and, in each bucket between
+        them, the sample forming the largest triangle with the sample kept in the previous bucket and the average
+        of the next bucket.
+
+    :param x: array of x values, in increasing order.
+    :param y: array of y values.
+    :param threshold: number of samples to keep.
+    :return: tuple of arrays (x, y).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / float(threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def downsample(x, y, method, max_points):
+    """ Downsamples a trace for a figure.
+
+    :param method: DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB, or None to keep all the samples.
+    :param max_points: maximum number of samples kept.
+    :return: tuple of arrays (x, y).
+    """
+    if method is None or len(x) <= max_points:
+        return x, y
+    if method == DOWNSAMPLE_MINMAX:
+        return minmax_downsample(x, y, max(max_points // 2, 1))
+    if method == DOWNSAMPLE_LTTB:
+        return lttb_downsample(x, y, max_points)
+    raise ValueError("unknown downsampling method %s, available: %s, %s" % (method, DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB))
+
+
+def synthetic_trace(samples, seed=0):
+    """ Returns a trace like the WMP measurements: TSF [us] every 10 ms with jitter, and a counter with a slow
+        drift, noise and rare spikes (as FREEZING_NUMBER or BUSY_TIME).
+    """
+    rng = np.random.RandomState(seed)
+    tsf = np.cumsum(10000 + rng.randint(-50, 50, samples)).astype(np.float64)
+    values = 200 + 50 * np.sin(np.arange(samples) / 5000.0) + rng.normal(0, 10, samples)
+    spikes = rng.random_sample(samples) < 0.0005
+    values[spikes] += rng.uniform(200, 400, spikes.sum())
+    return tsf, values
+
+
+def benchmark(sizes=(100000, 1000000), width=1024):
+    """ Compares, for traces of each size, the samples drawn, the downsampling time and, when matplotlib is
+        available, the rendering time and the size of the PDF figure, with and without downsampling.
+    """
+    try:
+        import io
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        plt = None
+        print("matplotlib not available, PDF size and render time are not measured")
+
+    print("%9s %8s %9s %10s %11s %12s %11s" % ('samples', 'method', 'points', 'reduce ms', 'extremes', 'pdf bytes',
+                                              'render ms'))
+    for samples in sizes:
+        x, y = synthetic_trace(samples)
+        x = (x - x[0]) / 1e6
+        for method in (None, DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB):
+            start = time.time()
+            dx, dy = downsample(x, y, method, 2 * width)
+            reduce_time = (time.time() - start) * 1000
+            # the minimum and the maximum of the trace are still drawn
+            extremes = 'kept' if dy.min() == y.min() and dy.max() == y.max() else 'lost'
+            pdf_bytes = render_time = float('nan')
+            if plt is not None:
+                start = time.time()
+                fig = plt.figure(figsize=(width / 100.0, 7.68))
+                fig.add_subplot(111).plot(dx, dy)
+                output = io.BytesIO()
+                fig.savefig(output, format='pdf')
+                plt.close(fig)
+                render_time = (time.time() - start) * 1000
+                pdf_bytes = len(output.getvalue())
+            print("%9d %8s %9d %10.1f %11s %12.0f %11.1f" % (samples, method or 'none', len(dx), reduce_time,
+                                                             extremes, pdf_bytes, render_time))
+
+
+if __name__ == "__main__":
+    # usage: trace_downsampling.py [samples[,samples...]]
+    benchmark([int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else (100000, 1000000))
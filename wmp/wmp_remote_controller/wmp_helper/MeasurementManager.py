@@ -19,12 +19,101 @@ from common.upihelper import unix_time_as_tuple, get_now_full_second, dumpFuncNa
 import matplotlib
 import json
 import numpy as np
+from .MeasurementStore import MeasurementStore, run_directory
+from .trace_downsampling import downsample
 
 # Force matplotlib to not use any Xwindows backend.
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt, os, fnmatch
 from matplotlib.backends.backend_pdf import PdfPages
 
+# Figures drawn by MeasurementCollector.plot_last_measurements, can be changed with the plot_config argument of
+# MeasurementCollector (a dictionary, or a JSON or YAML file with some of these keys).
+DEFAULT_PLOT_CONFIG = {
+    # measurements to plot, None plots the measurement_types passed to plot_last_measurements
+    'metrics': None,
+    # ip addresses of the nodes to plot, None plots all the nodes
+    'nodes': None,
+    # 'metric': one figure per measurement with a line per node, 'node': one figure per node and measurement
+    'layout': 'metric',
+    # y axis limits by measurement
+    'ylim': {'IPT': [0, 25], 'TX_DATA': [0, 400], 'RX_ACK': [0, 400], 'RX_ACK_RAMATCH': [0, 400],
+             'BUSY_TIME': [0, 150000], 'NUM_RX_MATCH': [0, 400]},
+    # 'minmax' (minimum and maximum per pixel column) or 'lttb' to draw at most max_points samples per line,
+    # None draws all the samples
+    'downsample': 'minmax',
+    # samples per line after downsampling, None is two per pixel of the figure width
+    'max_points': None,
+    # time range [s] drawn in the figures, from the first sample of each node, None draws the whole experiment;
+    # the range is read at full resolution and then downsampled, for zoomed exports
+    'time_range': None,
+    'size': [1024, 768],
+    'dpi': 100,
+    # processes rendering the figures, None uses one per core
+    'workers': None,
+}
+
+
+def load_plot_config(path):
+    """ Reads a plot configuration from a JSON or YAML file.
+    """
+    with open(path) as config_file:
+        if path.endswith('.yaml') or path.endswith('.yml'):
+            import yaml
+            return yaml.safe_load(config_file)
+        return json.load(config_file)
+
+
+def render_figure(task):
+    """ Renders one figure, in a worker of the plot pool: reads from the measurement store only the columns of
+        the figure, plots one line per node against the TSF (reception time of the reports when the TSF is not
+        measured), downsampled to the resolution of the figure, and saves the figure.
+
+    :param task: tuple (store directory, list of node ip addresses, measurement name, plot configuration, file name).
+    :return: the file name.
+    """
+    store_directory, node_ips, measurement_type, config, fig_filename = task
+    store = MeasurementStore(store_directory, reopen=True)
+    my_dpi = config['dpi']
+    width, height = config['size']
+    max_points = config['max_points'] or 2 * width
+    time_range = config['time_range']
+
+    fig = plt.figure(figsize=(width / float(my_dpi), height / float(my_dpi)))
+    ax = fig.add_subplot(111)
+    time_span = 0
+    for nodeIp in node_ips:
+        metrics = store.metrics(nodeIp)
+        if measurement_type not in metrics:
+            continue
+        time_metric = 'TSF' if 'TSF' in metrics else 'time'
+        columns = store.read(nodeIp, [time_metric, measurement_type])
+        if not len(columns[time_metric]):
+            continue
+        xaxis = columns[time_metric] if time_metric == 'TSF' else columns[time_metric] * 1e6
+        xaxis = (xaxis - np.min(xaxis)) / 1e6
+        yaxis = columns[measurement_type]
+        # max and min are the numpy ones in this module
+        time_span = np.maximum(time_span, np.max(xaxis))
+        if time_range is not None:
+            inside = (xaxis >= time_range[0]) & (xaxis < time_range[1])
+            xaxis, yaxis = xaxis[inside], yaxis[inside]
+        xaxis, yaxis = downsample(xaxis, yaxis, config['downsample'], max_points)
+        ax.plot(xaxis, yaxis, label=nodeIp.replace("10.8.8.", "sta"))
+
+    ax.grid(True)
+    ax.set_xlim(time_range if time_range is not None else [0, time_span])
+    if measurement_type in config['ylim']:
+        ax.set_ylim(config['ylim'][measurement_type])
+    ax.set_ylabel(measurement_type)
+    ax.set_xlabel('time [s]')
+    plt.tight_layout()
+    ax.legend()
+    fig.savefig(fig_filename, format='pdf')
+    plt.close(fig)
+    return fig_filename
+
+
 class MeasurementCollector:
     """
     This class defines a collector that takes measurements and parameters from several nodes involved in the
@@ -32,10 +121,29 @@ class MeasurementCollector:
     network-wide view, unlike any single node that has a local view.
     """
 
-    def __init__(self, mytestbed, log):
+    def __init__(self, mytestbed, log, store_directory=None, plot_config=None, reopen_store=False):
+        """
+        :param store_directory: directory of the MeasurementStore where the reported measurements are appended,
+            None is a new directory measurements/<date-time> for this run.
+        :param reopen_store: extend the store already in store_directory instead of starting a new one.
+        :param plot_config: figures of plot_last_measurements, dictionary or file name (see DEFAULT_PLOT_CONFIG).
+        """
+        self.plot_config = dict(DEFAULT_PLOT_CONFIG)
+        if plot_config is not None:
+            self.plot_config.update(plot_config if isinstance(plot_config, dict) else load_plot_config(plot_config))
         self.mytestbed = mytestbed
         self.log = log
         self.measurement_types = []
+        if store_directory is None:
+            store_directory = run_directory('measurements')
+        self.store = MeasurementStore(store_directory, reopen=reopen_store)
+        # routing counters and statistics of the monitor reports, they stay empty in this copy: the monitor
+        # callback of collect_values_from_nodes is commented out
+        self.node_index = {}
+        self.messages_per_node = {}
+        self.routing_misses = 0
+        self.statistics = None
+        self.keep_raw = True
 
     def column(self, matrix, i):
         return [row[i] for row in matrix]
@@ -97,148 +205,72 @@ class MeasurementCollector:
         #
         # return
 
+    def routing_stats(self):
+        """ Returns the number of messages received from every node and the number of messages from unknown senders.
+        """
+        return {'messages_per_node': dict(self.messages_per_node), 'routing_misses': self.routing_misses}
+
     def clear_nodes_measurements(self, nodes):
-        """ Clear all the measurement stored in WiFiNode object.
-            The measurements are stored in the last_bunch_measurement attribute of WiFiNode class.
+        """ Clear all the measurement of the nodes, stored in WiFiNode object and in the measurement store.
 
         :param nodes: list of WiFiNode.
         """
         for node in nodes:
             node.last_bunch_measurement = []
+            self.store.clear(node.getIpAddress())
         return
 
-    def plot_last_measurements(self, nodes, measurement_types, plot_title, plot_directory):
-        """ Uses matplotlib library to plot all the measurements stored in WiFiNode object.
-            The measurements are stored in the last_bunch_measurement attribute of WiFiNode class.
+    def plot_tasks(self, measurement_types, plot_directory):
+        """ Returns the figures to render, filtered by the plot configuration, as render_figure tasks.
+        """
+        config = self.plot_config
+        node_ips = [ip for ip in self.store.nodes() if config['nodes'] is None or ip in config['nodes']]
+        metrics = config['metrics'] or measurement_types
+        if not metrics:
+            # all the measurements of the nodes, in the order of the reports
+            metrics = []
+            for nodeIp in node_ips:
+                metrics += [metric for metric in self.store.metrics(nodeIp) if metric not in metrics]
+        metrics = [metric for metric in metrics if metric not in ('time', 'TSF')]
+
+        if config['layout'] == 'node':
+            return [(self.store.directory, [nodeIp], metric, config, "%s/fig_%s_%s.pdf" % (plot_directory, nodeIp, metric))
+                    for nodeIp in node_ips for metric in metrics]
+        return [(self.store.directory, node_ips, metric, config, "%s/fig_%s.pdf" % (plot_directory, metric))
+                for metric in metrics]
+
+    def plot_last_measurements(self, nodes, measurement_types, plot_title, plot_directory, wait=True):
+        """ Uses matplotlib library to plot all the measurements stored in the measurement store.
+            The figures (see plot_config) are rendered in parallel by a pool of processes. The workers are daemon
+            processes, killed when the controller exits: with wait=False the caller must call get() on the result
+            before exiting.
 
         :param nodes: list of WiFiNode.
         :param measurement_types: list of measurements name.
         :param plot_title: the title to write on graphic plot.
+        :param plot_directory: directory of the figure files.
+        :param wait: wait for all the figures to be written.
+        :return: the list of figure files, or with wait=False a multiprocessing AsyncResult, its get() returns it.
         """
-
-        def show_plot(nodes, measurement_types, plot_title, plot_directory):
-
-            out_measure={};
-	    #measurement_types=['FREEZING_NUMBER', 'CW', 'TSF','IPT', 'TX_DATA', 'RX_ACK', 'RX_ACK_RAMATCH', 'NUM_RX_MATCH']
-	    measurement_types=['FREEZING_NUMBER', 'TSF', 'RX_ACK_RAMATCH', 'CW', 'IPT', 'TX_DATA', 'RX_ACK', 'BUSY_TIME', 'delta_TSF', 'NUM_RX_MATCH']
-
-            for node in nodes[0]:
-                self.log.info("node : %s - measurements : %s" % (str(node), node.last_bunch_measurement))
-            for node in nodes[1]:
-                self.log.info("node : %s - measurements : %s" % (str(node), node.last_bunch_measurement))
-            for node in nodes[2]:
-                self.log.info("node : %s - measurements : %s" % (str(node), node.last_bunch_measurement))
-
-
-	    #save experiments log
-            with open('measure.json', 'w') as outfile:
-                for node in nodes[0]:
-                    self.log.warning("DOMENCIO : %s" % str(node.getIpAddress()))
-                    out_measure.update({node.getIpAddress() : node.last_bunch_measurement});
-
-                for node in nodes[1]:
-                    out_measure.update({node.getIpAddress() : node.last_bunch_measurement});
-
-                for node in nodes[2]:
-                    out_measure.update({node.getIpAddress() : node.last_bunch_measurement});
-
-                json.dump(out_measure, outfile)
-
-
-
-	    #get experiment log
-            with open('measure.json') as data_file:
-                data = json.load(data_file)
-
-            #for node in data.keys():
-            for node in list(sort(data.keys())):
-            
-                    nodeIp=node;
-                    x = array(data.get(nodeIp));
-                    dim = x.shape
-                    figure_id = 0
-                    xaxis = []
-            
-                    if len(dim) > 2:
-                            number_type_measurements = dim[2]
-                    else:
-                            number_type_measurements = 1
-            
-                    if number_type_measurements > 1 :
-                            for meas_type_id in range(number_type_measurements):
-                                    if measurement_types[meas_type_id] == "TSF" :
-                                            min_TSF=np.min(x[:,0,meas_type_id])
-                                            for ii in range(dim[0]):
-                                                    for jj in range(dim[1]):
-                                                            xaxis.append(x[ii][jj][meas_type_id])
-            
-                    for meas_type_id in range(number_type_measurements):
-                            if not ((measurement_types[meas_type_id] == "TSF") and (number_type_measurements > 1)) :
-                                    my_dpi=100
-                                    width=1024
-                                    height=768
-            
-                                    yaxis = []
-                                    figure_id += 1
-            
-                                    #if nodeIp=="10.8.8.102" :
-                                    #if nodeIp=="10.8.8.102" or nodeIp=="10.8.8.105" or nodeIp=="10.8.8.107" or nodeIp=="10.8.8.110" or nodeIp=="10.8.8.111" or nodeIp=="10.8.8.112" or nodeIp=="10.8.8.113" or nodeIp=="10.8.8.114" or nodeIp=="10.8.8.5":
-                                    if nodeIp=="10.8.8.102" or nodeIp=="10.8.8.105" or nodeIp=="10.8.8.107" or nodeIp=="10.8.8.110" or nodeIp=="10.8.8.111" or nodeIp=="10.8.8.103" or nodeIp=="10.8.8.104" or nodeIp=="10.8.8.114" or nodeIp=="10.8.8.5":
-
-                                            print(" node : " + nodeIp + " ( plot --> " + measurement_types[meas_type_id] + " )")
-                                            for ii in range(dim[0]):
-                                                    for jj in range(dim[1]):
-                                                            yaxis.append(x[ii][jj][meas_type_id])
-            
-                                            fig=plt.figure(figure_id)
-                                            ax = fig.add_subplot(111)
-                                            #if nodeIp=="10.8.8.105" or nodeIp=="10.8.8.107" or nodeIp=="10.8.8.110":
-                                            #if nodeIp!="10.8.8.102":
-                                            nodeIp_label=nodeIp.replace("10.8.8.","sta")
-                                            ax.plot((xaxis-min_TSF)/1e6,yaxis,label=nodeIp_label);
-                                            ax.grid(True)
-                                            ax.set_xlim([0, (np.max(xaxis)-np.min(xaxis))/1e6])
-                                            if (measurement_types[meas_type_id] == "IPT"):
-                                                    ax.set_ylim([0, 25])
-            
-                                            if (measurement_types[meas_type_id] == "TX_DATA"):
-                                                    ax.set_ylim([0, 400])
-            
-                                            if (measurement_types[meas_type_id] == "RX_ACK"):
-                                                    ax.set_ylim([0, 400])
-            
-                                            if (measurement_types[meas_type_id] == "RX_ACK_RAMATCH"):
-                                                    ax.set_ylim([0, 400])
-            
-                                            if (measurement_types[meas_type_id] == "BUSY_TIME"):
-                                                    ax.set_ylim([0, 150000])
-            
-                                            if (measurement_types[meas_type_id] == "NUM_RX_MATCH"):
-                                                    ax.set_ylim([0, 400])
-
-                                            fig.set_size_inches(width/my_dpi,height/my_dpi)
-                                            plt.tight_layout()
-                                            legend = ax.legend()
-
-                                            #plt.show()
-                                            fig_filename="%s/fig_%s.pdf" % (plot_directory, measurement_types[meas_type_id])
-                                            ax.set_ylabel(measurement_types[meas_type_id]);
-                                            ax.set_xlabel('time [s]')
-                                            fig.savefig(fig_filename, format='pdf')
-
-
         self.log.info("*********** Plot measurement *************")
-        p = multiprocessing.Process(target=show_plot, args=(nodes, measurement_types, plot_title, plot_directory))
-        p.start()
-
-
-
-
+        for nodeIp in self.store.nodes():
+            self.log.info("node : %s - measurements : %d samples" % (nodeIp, self.store.rows(nodeIp)))
+
+        # the workers read the measurements from disk
+        self.store.flush()
+        tasks = self.plot_tasks(measurement_types, plot_directory)
+        pool = multiprocessing.Pool(self.plot_config['workers'])
+        result = pool.map_async(render_figure, tasks)
+        pool.close()
+        if not wait:
+            return result
+        fig_filenames = result.get()
+        pool.join()
+        return fig_filenames
 
     def generate_measurement_report(self, nodes, filename="experiment_report.pdf"):
-        """ Uses matplotlib library to plot all the measurements stored in WiFiNode object.
+        """ Uses matplotlib library to plot all the measurements stored in the measurement store.
             Uses PdfPages to create a pdf with graphical plot.
-            The measurements are stored in the last_bunch_measurement attribute of WiFiNode class.
 
         :param nodes: list of WiFiNode.
         :param filename: file name of the pdf report.
@@ -247,8 +279,8 @@ class MeasurementCollector:
             self.log.info("no measurement to include in the report. Report has not been created!")
             return
         for node in nodes:
-            self.log.info("node : %s - measurements : %s" % (str(node), node.last_bunch_measurement))
-            if node.last_bunch_measurement == []:
+            self.log.info("node : %s - measurements : %d samples" % (str(node), self.store.rows(node.getIpAddress())))
+            if self.store.rows(node.getIpAddress()) == 0 and self.statistics is None:
                 self.log.info("no measurement to include in the report. Report has not been created!")
                 return
 
@@ -264,33 +296,29 @@ class MeasurementCollector:
                        horizontalalignment='center',
                        color='green', fontsize=15)
             pdf.savefig(cover)
+            plt.close(cover)
+
+            if self.statistics is not None:
+                page = plt.figure()
+                page.text(0.02, 0.98, "\n".join(self.statistics.report_lines()), fontsize=6,
+                          verticalalignment='top', family='monospace')
+                pdf.savefig(page)
+                plt.close(page)
 
+            max_points = self.plot_config['max_points'] or 2 * self.plot_config['size'][0]
             for node in nodes:
-                x = array(node.last_bunch_measurement)
-                dim = x.shape
-                figure_id = 1
-                xaxis = []
-
-                for meas_type_id in range(dim[2]):
-                    if self.measurement_types[meas_type_id] == "TSF" :
-                        for ii in range(dim[0]):
-                            for jj in range(dim[1]):
-                                xaxis.append(x[ii][jj][meas_type_id])
-
-                for meas_type_id in range(dim[2]):
-                    if self.measurement_types[meas_type_id] != "TSF" :
-                        yaxis = []
-                        figure_id += 1
-                        for ii in range(dim[0]):
-                            for jj in range(dim[1]):
-                                yaxis.append(x[ii][jj][meas_type_id])
-                        plt.figure(figure_id)
-                        plt.plot(xaxis, yaxis)
-                        plt.title(self.measurement_types[meas_type_id])
+                if self.store.rows(node.getIpAddress()) == 0:
+                    continue
+                columns = self.store.read(node.getIpAddress())
+                xaxis = columns['TSF'] if 'TSF' in columns else columns['time']
+
+                for measurement_type in self.measurement_types:
+                    if measurement_type != "TSF" :
+                        fig = plt.figure()
+                        plt.plot(*downsample(xaxis, columns[measurement_type], self.plot_config['downsample'], max_points))
+                        plt.title("%s - %s" % (node.getIpAddress(), measurement_type))
                         plt.grid()
-                        plt.draw()
-                        time.sleep(1)
-                        pdf.savefig(cover)
-            plt.show()
+                        pdf.savefig(fig)
+                        plt.close(fig)
 
         return
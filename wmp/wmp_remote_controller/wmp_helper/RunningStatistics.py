@@ -0,0 +1,231 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import math
+from collections import deque
+
+WINDOW_SLIDING = 'sliding'
+WINDOW_TUMBLING = 'tumbling'
+
+
+class RunningStats:
+    """
+    This class defines the running count, mean, variance (Welford), sum, minimum and maximum of a sequence of
+    values, updated in O(1) per value. Values can also be removed (for sliding windows): the minimum and the
+    maximum are then kept by the window.
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def remove(self, value):
+        self.count -= 1
+        self.total -= value
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            self.total = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def variance(self):
+        """ Returns the sample variance, 0 with less than two values.
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def summary(self, duration=None):
+        """ Returns the statistics as a dictionary.
+
+        :param duration: duration of the values [s], for the rates: sum per second and values per second.
+        """
+        result = {'count': self.count,
+                  'mean': self.mean,
+                  'variance': self.variance(),
+                  'std': math.sqrt(self.variance()),
+                  'min': self.min,
+                  'max': self.max,
+                  'sum': self.total}
+        if duration:
+            result['rate'] = self.total / duration
+            result['samples_per_s'] = self.count / duration
+        return result
+
+
+class SlidingWindowStats:
+    """
+    This class defines the statistics of the values of the last `window` seconds. Every value is added once and
+    removed once from the Welford accumulator, the minimum and the maximum are the heads of two monotonic queues,
+    so an update is O(1) amortized.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.stats = RunningStats()
+        self.samples = deque()
+        self._min = deque()
+        self._max = deque()
+
+    def add(self, timestamp, value):
+        self.samples.append((timestamp, value))
+        self.stats.add(value)
+        while self._min and self._min[-1][1] > value:
+            self._min.pop()
+        self._min.append((timestamp, value))
+        while self._max and self._max[-1][1] < value:
+            self._max.pop()
+        self._max.append((timestamp, value))
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """ Removes the values older than now - window.
+        """
+        oldest = now - self.window
+        samples = self.samples
+        while samples and samples[0][0] < oldest:
+            self.stats.remove(samples.popleft()[1])
+        while self._min and self._min[0][0] < oldest:
+            self._min.popleft()
+        while self._max and self._max[0][0] < oldest:
+            self._max.popleft()
+
+    def summary(self):
+        result = self.stats.summary(self.window)
+        result['min'] = self._min[0][1] if self._min else None
+        result['max'] = self._max[0][1] if self._max else None
+        return result
+
+
+class TumblingWindowStats:
+    """
+    This class defines the statistics of consecutive, non-overlapping windows of `window` seconds: the window in
+    progress and the last completed one.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.current = RunningStats()
+        self.start = None
+        self.last = None
+        self.windows = 0
+
+    def add(self, timestamp, value):
+        if self.start is None:
+            self.start = timestamp
+        elif timestamp >= self.start + self.window:
+            self.last = self.current.summary(self.window)
+            self.last['start'] = self.start
+            self.windows += 1
+            self.current = RunningStats()
+            self.start += self.window * math.floor((timestamp - self.start) / self.window)
+        self.current.add(value)
+
+    def summary(self):
+        current = self.current.summary(self.window)
+        current['start'] = self.start
+        return {'last': self.last, 'current': current, 'windows': self.windows}
+
+
+class MeasurementStatistics:
+    """
+    This class defines the incremental statistics of the measurements reported by the nodes, per node and per
+    measurement: sliding window, tumbling windows and totals since the start. The time of a sample is its TSF
+    when the TSF is measured, the reception time of the report otherwise. Memory does not depend on the
+    experiment duration (only on the samples of the sliding window), so the raw measurements do not have to be
+    kept for statistics.
+    """
+
+    def __init__(self, sliding_window=10.0, tumbling_window=1.0, time_metric='TSF'):
+        """
+        :param sliding_window: duration of the sliding window [s].
+        :param tumbling_window: duration of the tumbling windows [s].
+        :param time_metric: measurement with the time of the samples [us].
+        """
+        self.sliding_window = sliding_window
+        self.tumbling_window = tumbling_window
+        self.time_metric = time_metric
+        # node -> measurement -> (sliding, tumbling, total)
+        self.nodes = {}
+
+    def _metric(self, node, measurement_type):
+        metrics = self.nodes.setdefault(node, {})
+        windows = metrics.get(measurement_type)
+        if windows is None:
+            windows = (SlidingWindowStats(self.sliding_window), TumblingWindowStats(self.tumbling_window),
+                       RunningStats())
+            metrics[measurement_type] = windows
+        return windows
+
+    def add_report(self, node, measurement_types, measurements, timestamp):
+        """ Adds the samples of a report of a node.
+
+        :param measurement_types: list of measurements name, the order of the values in a sample.
+        :param measurements: list of samples (lists of values), or one sample.
+        :param timestamp: reception time of the report [s].
+        """
+        if measurements and not isinstance(measurements[0], (list, tuple)):
+            measurements = [measurements]
+        time_index = measurement_types.index(self.time_metric) if self.time_metric in measurement_types else None
+        windows = [(i, self._metric(node, measurement_type)) for i, measurement_type in enumerate(measurement_types)
+                   if i != time_index]
+        for sample in measurements:
+            sample_time = sample[time_index] / 1e6 if time_index is not None else timestamp
+            for i, (sliding, tumbling, total) in windows:
+                value = sample[i]
+                sliding.add(sample_time, value)
+                tumbling.add(sample_time, value)
+                total.add(value)
+
+    def query(self, node=None, measurement_type=None, window=WINDOW_SLIDING):
+        """ Returns the statistics of a window.
+
+        :param node: node ip address, None for all the nodes.
+        :param measurement_type: measurement name, None for all the measurements.
+        :param window: WINDOW_SLIDING, WINDOW_TUMBLING or 'total'.
+        :return: statistics dictionary of a node and a measurement, otherwise nested dictionaries node ->
+            measurement -> statistics.
+        """
+        position = {WINDOW_SLIDING: 0, WINDOW_TUMBLING: 1, 'total': 2}[window]
+        nodes = self.nodes if node is None else {node: self.nodes.get(node, {})}
+        result = {}
+        for node_ip, metrics in nodes.items():
+            result[node_ip] = dict((name, windows[position].summary()) for name, windows in metrics.items()
+                                   if measurement_type is None or name == measurement_type)
+        if node is not None and measurement_type is not None:
+            return result[node].get(measurement_type)
+        return result
+
+    def report_lines(self):
+        """ Returns one text line per node and measurement with the sliding window and total statistics.
+        """
+        lines = []
+        for node in sorted(self.nodes):
+            for name in sorted(self.nodes[node]):
+                sliding, tumbling, total = self.nodes[node][name]
+                window = sliding.summary()
+                lines.append("%s %s : last %gs mean %.3f std %.3f min %s max %s rate %.3f/s -- total %d samples mean %.3f"
+                             % (node, name, self.sliding_window, window['mean'], window['std'], window['min'],
+                                window['max'], window['rate'], total.count, total.mean))
+        return lines
@@ -114,10 +114,16 @@ def local_control_program(controller):
         #UPI_myargs = {'interface' : interface, UPI_R.CSMA_CW : CWMIN, UPI_R.CSMA_CW_MIN : CWMIN, UPI_R.CSMA_CW_MAX : CWMAX }
         #controller.radio.set_parameter(UPI_myargs)
 
+        def clock_echo(msg):
+            #answer the controller clock probe with the node time, the controller estimates the node clock offset
+            if "clock_probe" in msg:
+                controller.send_upstream({"clock_probe" : msg["clock_probe"], "node_time" : time.time(), "ip_address" : (ip_address)})
+
         #receive message from controller
         msg = controller.recv(timeout=1)
         if msg:
-            n_tx_sta = msg["traffic_number"]
+            clock_echo(msg)
+            n_tx_sta = msg.get("traffic_number", 0)
             log.warning("num_tx_nodes=%d" % n_tx_sta )
         else:
             n_tx_sta = 0
@@ -270,7 +276,8 @@ def local_control_program(controller):
              #receive message from controller
             msg = controller.recv(timeout=1)
             if msg:
-                    n_tx_sta = msg["traffic_number"]
+                    clock_echo(msg)
+                    n_tx_sta = msg.get("traffic_number", 0)
                     log.warning("num_tx_nodes=%d" % n_tx_sta )
             else:
                     n_tx_sta = 0
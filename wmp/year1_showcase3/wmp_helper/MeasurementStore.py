@@ -0,0 +1,248 @@
+#!/usr/bin/python
+__author__ = 'Pierluigi Gallo'
+"""
+EU project WISHFUL
+"""
+
+import os
+import json
+import shutil
+import time
+import numpy as np
+
+
+class NodeColumns:
+    """
+    This class defines the on-disk measurements of one node: one column per measurement type, stored in
+    chunks of chunk_rows float64 values. Each chunk is a file memory-mapped when it is written or read, so only
+    the chunks in use are in memory. Rows are only appended. The index file (index.json) keeps the number of
+    rows and the minimum and maximum of every column in every chunk, so that a range query opens only the
+    chunks overlapping the range.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory, metrics=None, chunk_rows=65536):
+        self.directory = directory
+        index_path = os.path.join(directory, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+            self.metrics = index['metrics']
+            self.chunk_rows = index['chunk_rows']
+            self.rows = index['rows']
+            self.bounds = index['bounds']
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.metrics = list(metrics)
+            self.chunk_rows = chunk_rows
+            self.rows = 0
+            # per chunk, per metric [min, max]
+            self.bounds = []
+        self._write_chunk = None
+        self._write_maps = None
+
+    def _chunk_path(self, metric, chunk):
+        return os.path.join(self.directory, '%s.%05d.f64' % (metric, chunk))
+
+    def _open_chunk(self, chunk, mode):
+        return [np.memmap(self._chunk_path(metric, chunk), dtype=np.float64, mode=mode, shape=(self.chunk_rows,))
+                for metric in self.metrics]
+
+    def append(self, values):
+        """ Appends rows of measurements.
+
+        :param values: (rows x metrics) array.
+        """
+        done = 0
+        while done < len(values):
+            chunk, offset = divmod(self.rows, self.chunk_rows)
+            if chunk != self._write_chunk:
+                self.flush_chunk()
+                self._write_maps = self._open_chunk(chunk, 'r+' if offset else 'w+')
+                self._write_chunk = chunk
+                if chunk == len(self.bounds):
+                    self.bounds.append([[np.inf, -np.inf] for metric in self.metrics])
+            count = min(len(values) - done, self.chunk_rows - offset)
+            block = values[done:done + count]
+            bounds = self.bounds[chunk]
+            for i, column in enumerate(self._write_maps):
+                column[offset:offset + count] = block[:, i]
+                bounds[i][0] = min(bounds[i][0], float(block[:, i].min()))
+                bounds[i][1] = max(bounds[i][1], float(block[:, i].max()))
+            self.rows += count
+            done += count
+
+    def flush_chunk(self):
+        if self._write_maps is not None:
+            for column in self._write_maps:
+                column.flush()
+
+    def write_index(self):
+        """ Writes the index, replacing the previous one in one rename.
+        """
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump({'metrics': self.metrics, 'chunk_rows': self.chunk_rows, 'rows': self.rows,
+                       'bounds': self.bounds}, index_file)
+        os.rename(index_path + '.tmp', index_path)
+
+    def close(self):
+        self.flush_chunk()
+        self.write_index()
+        self._write_maps = None
+        self._write_chunk = None
+
+    def iter_chunks(self, metrics=None, start=None, stop=None, time_metric=None):
+        """ Yields the rows with start <= time_metric < stop, one chunk at a time, as a dictionary of
+            metric -> array. The arrays of a chunk with all its rows in range are read-only memory-mapped views.
+        """
+        metrics = self.metrics if metrics is None else metrics
+        columns = [self.metrics.index(metric) for metric in metrics]
+        time_column = None if time_metric is None else self.metrics.index(time_metric)
+        for chunk in range((self.rows + self.chunk_rows - 1) // self.chunk_rows):
+            rows = min(self.rows - chunk * self.chunk_rows, self.chunk_rows)
+            if time_column is not None:
+                low, high = self.bounds[chunk][time_column]
+                if (start is not None and high < start) or (stop is not None and low >= stop):
+                    continue
+            maps = [np.memmap(self._chunk_path(self.metrics[c], chunk), dtype=np.float64, mode='r',
+                              shape=(self.chunk_rows,))[:rows] for c in columns]
+            if time_column is not None and (start is not None or stop is not None):
+                if time_column in columns:
+                    times = maps[columns.index(time_column)]
+                else:
+                    times = np.memmap(self._chunk_path(time_metric, chunk), dtype=np.float64, mode='r',
+                                      shape=(self.chunk_rows,))[:rows]
+                selected = np.ones(rows, dtype=bool)
+                if start is not None:
+                    selected &= times >= start
+                if stop is not None:
+                    selected &= times < stop
+                if not selected.all():
+                    maps = [column[selected] for column in maps]
+            yield dict(zip(metrics, maps))
+
+
+def run_directory(base='measurements'):
+    """ Returns a new directory base/<date-time> for the store of one experiment run, so that a run never appends
+        to the measurements of a previous run.
+    """
+    directory = os.path.join(base, time.strftime('%Y%m%d-%H%M%S'))
+    suffix = 1
+    while os.path.exists(directory):
+        directory = os.path.join(base, '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), suffix))
+        suffix += 1
+    return directory
+
+
+class MeasurementStore:
+    """
+    This class defines an append-only store of the measurements reported by the nodes, in place of the lists
+    of the WiFiNode objects and of the measure.json dump: every report is appended to the columns of its node
+    (see NodeColumns) under directory/<node>/, so memory use does not grow with the experiment and the
+    measurements can be read back, whole or by time range, without parsing a JSON file.
+    """
+
+    def __init__(self, directory='measurements', chunk_rows=65536, index_every=16, reopen=False):
+        """
+        :param directory: directory of the store.
+        :param chunk_rows: rows per chunk file.
+        :param index_every: number of appends between two writes of the index of a node.
+        :param reopen: open and extend the store already in directory (e.g. to read it back); if False the
+            directory must not hold a store, a ValueError is raised otherwise.
+        """
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.index_every = index_every
+        self.columns = {}
+        self._appends = {}
+        if os.path.isdir(directory):
+            for node in os.listdir(directory):
+                if os.path.exists(os.path.join(directory, node, NodeColumns.INDEX_FILE)):
+                    if not reopen:
+                        raise ValueError("%s already holds a measurement store, use another directory or "
+                                         "reopen=True to extend it" % directory)
+                    self.columns[node] = NodeColumns(os.path.join(directory, node))
+
+    def append(self, node, measurement_types, measurements, timestamp=None):
+        """ Appends a report of a node.
+
+        :param node: node identifier, its ip address.
+        :param measurement_types: list of measurements name, the order of the values in a sample.
+        :param measurements: list of samples (lists of values), or one sample.
+        :param timestamp: reception time of the report, stored in the 'time' column, default is now.
+        """
+        values = np.asarray(measurements, dtype=np.float64)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        if values.shape[1] != len(measurement_types):
+            raise ValueError("%d values per sample, %d measurement types" % (values.shape[1], len(measurement_types)))
+        if not len(values):
+            return
+        metrics = ['time'] + list(measurement_types)
+        node = str(node)
+        columns = self.columns.get(node)
+        if columns is None:
+            columns = NodeColumns(os.path.join(self.directory, node), metrics, self.chunk_rows)
+            self.columns[node] = columns
+            self._appends[node] = 0
+        elif columns.metrics != metrics:
+            raise ValueError("node %s stores %s, report has %s" % (node, columns.metrics[1:], metrics[1:]))
+        stamped = np.empty((len(values), len(metrics)))
+        stamped[:, 0] = time.time() if timestamp is None else timestamp
+        stamped[:, 1:] = values
+        columns.append(stamped)
+        self._appends[node] = self._appends.get(node, 0) + 1
+        if self._appends[node] % self.index_every == 0:
+            columns.write_index()
+
+    def nodes(self):
+        return sorted(self.columns)
+
+    def metrics(self, node):
+        return list(self.columns[node].metrics)
+
+    def rows(self, node):
+        return self.columns[node].rows if node in self.columns else 0
+
+    def iter_chunks(self, node, metrics=None, start=None, stop=None, time_metric='time'):
+        """ Yields the measurements of a node chunk by chunk (see NodeColumns.iter_chunks), for reports that do
+            not need all the measurements in memory.
+
+        :param time_metric: column of the time range, 'time' (reception time) or a measurement such as 'TSF'.
+        """
+        return self.columns[node].iter_chunks(metrics, start, stop, time_metric)
+
+    def read(self, node, metrics=None, start=None, stop=None, time_metric='time'):
+        """ Returns the measurements of a node with start <= time_metric < stop.
+
+        :return: dictionary metric -> array.
+        """
+        columns = self.columns[node]
+        metrics = columns.metrics if metrics is None else metrics
+        chunks = list(columns.iter_chunks(metrics, start, stop, time_metric))
+        if not chunks:
+            return dict((metric, np.zeros(0)) for metric in metrics)
+        return dict((metric, np.concatenate([chunk[metric] for chunk in chunks])) for metric in metrics)
+
+    def flush(self):
+        """ Writes the chunks and the indexes to disk, e.g. before the store is read by another process.
+        """
+        for columns in self.columns.values():
+            columns.flush_chunk()
+            columns.write_index()
+
+    def clear(self, node):
+        """ Removes the measurements of a node.
+        """
+        columns = self.columns.pop(str(node), None)
+        self._appends.pop(str(node), None)
+        if columns is not None:
+            columns.close()
+            shutil.rmtree(columns.directory)
+
+    def close(self):
+        for columns in self.columns.values():
+            columns.close()
@@ -7,6 +7,7 @@ from controller.wishful_controller.node_manager import *
 from datetime import date, datetime, timedelta
 import re
 import time
+import gevent
 import sys
 import csv
 
@@ -26,13 +27,14 @@ class WiFiNode():
         Stores/Removes low level measurements
         Store the low level measurements type
     """
-    def __init__(self, node):
+    def __init__(self, node, wlan_ipAddress=None):
         """ Creates a new WiFiNode
+        :param wlan_ipAddress: wireless lan interface ip address, default is derived from the node ip address
         """
         self.node = node
         # eth_ipAddress_part = re.split(r'[:./\s]\s*', str(node))
         # self.wlan_ipAddress = '192.168.3.' + eth_ipAddress_part[3]
-        self.wlan_ipAddress = '192.168.3.' + str(node.ip[7:10])
+        self.wlan_ipAddress = wlan_ipAddress or wlan_address(node.ip)
         self.last_bunch_measurement = []
         self.measurement_types = []
         self.role = None
@@ -51,6 +53,46 @@ class WiFiNode():
         return self.last_bunch_measurement
 
 
+def wlan_address(ip_address):
+    """ Returns the wireless lan interface ip address of the node with control ip address ip_address
+    """
+    return '192.168.3.' + str(ip_address[7:10])
+
+
+class TestbedInventory():
+    """
+    This class defines the testbed nodes inventory, read once from the testbed csv file (ip, hostname, role,
+    platform, traffic) and indexed by control ip address, wlan ip address, role and platform. The rows keep their
+    file order, which is the order of the stations in the experiment.
+    """
+    def __init__(self, filename='testbed_nodes.csv'):
+        """ Reads the inventory, the lines starting with # are skipped
+        """
+        self.filename = filename
+        self.rows = []
+        self.by_ip = {}
+        self.by_wlan_ip = {}
+        self.by_role = {}
+        self.by_platform = {}
+        with open(filename) as csvfile:
+            reader = csv.DictReader(filter(lambda row: row[0]!='#', csvfile))
+            for row in reader:
+                row['wlan_ip'] = wlan_address(row['ip'])
+                self.rows.append(row)
+                self.by_ip[row['ip']] = row
+                self.by_wlan_ip[row['wlan_ip']] = row
+                self.by_role.setdefault(row['role'], []).append(row)
+                self.by_platform.setdefault(row['platform'], []).append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row(self, ip_address):
+        """ Returns the inventory row of the node with control ip address ip_address, None if it is not in the testbed
+        """
+        return self.by_ip.get(ip_address)
+
+
 class TestbedTopology:
     """
     This class defines an experiment controller and takes the most appropriate actions in order to :
@@ -86,47 +128,83 @@ class TestbedTopology:
 
         self.iface = "wlan0"
 
+        #testbed inventory, read at the first use (see getInventory)
+        self.inventory = None
+        #discovered nodes and WiFiNode indexed by control and wlan ip address
+        self.nodes_by_ip = {}
+        self.wifinodes_by_ip = {}
+        self.wifinodes_by_wlan_ip = {}
+
+        #per node durations of the last network bring-up, see bringUpNetwork
+        self.bringup_timings = {}
+
     def add_discovered_node(self, node):
         self.nodes.append(node)
+        self.nodes_by_ip[node.ip] = node
+
+    def getInventory(self):
+        """ Returns the testbed inventory, read from testbed_nodes.csv at the first call
+        """
+        if self.inventory is None:
+            self.inventory = TestbedInventory('testbed_nodes.csv')
+        return self.inventory
 
     def getExperimentNodesNumber(self):
-        with open('testbed_nodes.csv') as csvfile:
-            reader = csv.DictReader(filter(lambda row: row[0]!='#', csvfile))
-            for row in reader:
-                self.experiment_nodes_number += 1
+        self.experiment_nodes_number = len(self.getInventory())
         return self.experiment_nodes_number
 
+    def getNodeByIp(self, ip_address):
+        """ Returns the discovered node with control ip address ip_address, None if it is not discovered
+        """
+        return self.nodes_by_ip.get(ip_address)
+
+    def getWiFiNode(self, ip_address):
+        """ Returns the WiFiNode of the node with control ip address ip_address, None if it is not in the topology
+        """
+        return self.wifinodes_by_ip.get(ip_address)
+
+    def getWiFiNodeByWlanIp(self, wlan_ipAddress):
+        """ Returns the WiFiNode of the node with wlan ip address wlan_ipAddress, None if it is not in the topology
+        """
+        return self.wifinodes_by_wlan_ip.get(wlan_ipAddress)
+
+    def getNodesByRole(self, role, platform=None):
+        """ Returns the discovered nodes with role (AP/STA) and, if given, platform (wmp/ath), in inventory order
+        """
+        rows = self.getInventory().by_role.get(role, [])
+        return [self.nodes_by_ip[row['ip']] for row in rows
+                if row['ip'] in self.nodes_by_ip and (platform is None or row['platform'] == platform)]
+
     def initializeTestbedTopology(self):
         """ Initializes testbed setup one AP and one STA
         """
-        #get available nodes on testbed
-        nodes_ip_list = []
-        nodes_role_list = []
-        nodes_platform_list = []
-        with open('testbed_nodes.csv') as csvfile:
-            #reader = csv.DictReader(csvfile)
-            reader = csv.DictReader(filter(lambda row: row[0]!='#', csvfile))
-            for row in reader:
-                for ii in range(0, len(self.nodes)):
-                    if self.nodes[ii].ip == row['ip']:
-                        nodes_ip_list.append(row['ip'])
-                        nodes_role_list.append(row['role'])
-                        nodes_platform_list.append(row['platform'])
+        #the discovered nodes are attached to their inventory row, in inventory order
+        self.wmp_nodes = []
+        self.ath_nodes = []
+        self.wifinodes = []
+        self.wifinodes_by_ip = {}
+        self.wifinodes_by_wlan_ip = {}
+        for row in self.getInventory().rows:
+            node = self.nodes_by_ip.get(row['ip'])
+            if node is None:
+                continue
 
-                        if row['role'] == 'AP':
-                            self.ap_node = self.nodes[ii]
+            if row['role'] == 'AP':
+                self.ap_node = node
 
-                        if row['platform'] == 'wmp' and row['role'] != 'AP':
-                            self.wmp_nodes.append(self.nodes[ii])
-                            self.wmp_nodes_number += 1
+            if row['platform'] == 'wmp' and row['role'] != 'AP':
+                self.wmp_nodes.append(node)
 
-                        if row['platform'] == 'ath' and row['role'] != 'AP':
-                            self.ath_nodes.append(self.nodes[ii])
-                            self.ath_nodes_number += 1
+            if row['platform'] == 'ath' and row['role'] != 'AP':
+                self.ath_nodes.append(node)
 
-                        if row['platform'] == 'ath' or row['platform'] == 'wmp' or row['role'] == 'AP':
-                            #self.wifinodes.append(self.nodes[ii])
-                            self.wifinodes.append(WiFiNode(self.nodes[ii]))
+            if row['platform'] == 'ath' or row['platform'] == 'wmp' or row['role'] == 'AP':
+                wifinode = WiFiNode(node, row['wlan_ip'])
+                self.wifinodes.append(wifinode)
+                self.wifinodes_by_ip[row['ip']] = wifinode
+                self.wifinodes_by_wlan_ip[row['wlan_ip']] = wifinode
+        self.wmp_nodes_number = len(self.wmp_nodes)
+        self.ath_nodes_number = len(self.ath_nodes)
 
         #self.log.debug('ath_nodes_number : %s - wmp_nodes_number : %s' % (str(self.ath_nodes_number), str(self.wmp_nodes_number) ) )
         self.log.debug('ath_nodes_number : %s - wmp_nodes_number : %s' % (str(len(self.ath_nodes)), str(len(self.wmp_nodes)) ) )
@@ -147,15 +225,64 @@ class TestbedTopology:
         :return  result: True if the operation are successful execute, False otherwise
         """
 
-        self.setAP(self.ap_node, self.exp_group_name)
-        node_index = 0
-        while node_index < self.wmp_nodes_number :
-            connected = self.setSTA(self.wmp_nodes[node_index], self.exp_group_name)
-            print('Node %s connected %s' % (str( self.wmp_nodes[node_index].ip), str(connected) ))
-            node_index += 1
+        timings = self.bringUpNetwork([self.ap_node], self.wmp_nodes, self.exp_group_name)
+        for node in self.wmp_nodes:
+            print('Node %s connected %s' % (str(node.ip), str(timings[node.ip]['connected'])))
 
         return True
 
+    def bringUpNetwork(self, ap_nodes, sta_nodes, essid, timeout=60):
+        """ Setups the infrastructure BSS on all the nodes concurrently: the access points and the stations are
+            configured at the same time, one greenlet per node, then all the stations are associated at the same time
+            and their association is checked with probes at exponential intervals (see waitAssociation).
+
+        :param ap_nodes: Access Point nodes list
+        :param sta_nodes: station nodes list
+        :param essid: the SSID
+        :param timeout: maximum duration of the association of a station [s]
+        :return timings: dictionary node ip -> {'role', 'configure', 'associate' durations [s], 'probes', 'connected'},
+                         also kept in the bringup_timings attribute
+        """
+        start = time.time()
+        timings = {}
+        for node in ap_nodes:
+            timings[node.ip] = {'node': node, 'role': 'AP', 'configure': None, 'associate': None, 'probes': 0, 'connected': None}
+        for node in sta_nodes:
+            timings[node.ip] = {'node': node, 'role': 'STA', 'configure': None, 'associate': None, 'probes': 0, 'connected': False}
+
+        def configure(node, setup):
+            node_start = time.time()
+            setup(node)
+            timings[node.ip]['configure'] = time.time() - node_start
+
+        def associate(node):
+            node_start = time.time()
+            connected, probes = self.waitAssociation(node, essid, timeout)
+            timings[node.ip]['associate'] = time.time() - node_start
+            timings[node.ip]['probes'] = probes
+            timings[node.ip]['connected'] = connected
+
+        # the access points and the stations do not depend on each other before the association
+        greenlets = [gevent.spawn(configure, node, lambda ap_node: self.setAP(ap_node, essid)) for node in ap_nodes]
+        greenlets += [gevent.spawn(configure, node, self.configureSTA) for node in sta_nodes]
+        gevent.joinall(greenlets)
+        configured = time.time()
+        gevent.joinall([gevent.spawn(associate, node) for node in sta_nodes])
+
+        self.bringup_timings = timings
+        self.log.info('network bring-up : %.1fs (configuration %.1fs, association %.1fs)'
+                      % (time.time() - start, configured - start, time.time() - configured))
+        for ip in sorted(timings):
+            timing = timings[ip]
+            self.log.info('  %s %-3s configure %s associate %s probes %d connected %s'
+                          % (ip, timing['role'], self._format_duration(timing['configure']),
+                             self._format_duration(timing['associate']), timing['probes'], str(timing['connected'])))
+        return timings
+
+    @staticmethod
+    def _format_duration(duration):
+        return '-' if duration is None else '%.2fs' % duration
+
     def setAP(self, node, essid):
         """ Creates infrastructure BSS, uses node such as Access Point
         :param node: elected Access Point Node
@@ -163,7 +290,7 @@ class TestbedTopology:
         """
         #eth_ipAddress_part = re.split(r'[:./\s]\s*', str(node.ip))
         #wlan_ipAddress = '192.168.3.' + eth_ipAddress_part[6]
-        wlan_ipAddress = '192.168.3.' + str(node.ip[7:10])
+        wlan_ipAddress = wlan_address(node.ip)
 
         #stop hostpad
         rvalue = self.controller.nodes(node).net.stop_hostapd()
@@ -183,10 +310,19 @@ class TestbedTopology:
         """ Associate node to infrastructure BSS
         :param node: elected station node by associate
         :param essid: the SSID
+        :return connected: True if the station is associated, False otherwise
+        """
+        self.configureSTA(node)
+        connected, probes = self.waitAssociation(node, essid)
+        return connected
+
+    def configureSTA(self, node):
+        """ Configures the station interface before the association
+        :param node: elected station node
         """
         # eth_ipAddress_part = re.split(r'[:./\s]\s*', str(node))
         # wlan_ipAddress = '192.168.3.' + eth_ipAddress_part[6]
-        wlan_ipAddress = '192.168.3.' + str(node.ip[7:10])
+        wlan_ipAddress = wlan_address(node.ip)
 
         #stop hostpad
         rvalue = self.controller.nodes(node).net.stop_hostapd()
@@ -196,17 +332,32 @@ class TestbedTopology:
         rvalue = self.controller.nodes(node).radio.set_power(15)
         #set modulation rate
         rvalue = self.controller.nodes(node).radio.set_modulation_rate(2)
-        connected = False
-        for ii in range(10):
-            #associate station
-            rvalue = self.controller.nodes(node).net.connect_to_network(self.iface, essid)
-            time.sleep(2)
+
+    def waitAssociation(self, node, essid, timeout=20, first_probe=0.25, max_probe=4):
+        """ Associates the station and waits for the association: the connection state is probed after
+            first_probe seconds, then at intervals doubled up to max_probe seconds; the association request is sent
+            again every max_probe seconds until timeout.
+        :param node: elected station node by associate
+        :param essid: the SSID
+        :return connected, probes: True if the station is associated, and the number of probes sent
+        """
+        start = time.time()
+        probe_interval = first_probe
+        probes = 0
+        #associate station
+        self.controller.nodes(node).net.connect_to_network(self.iface, essid)
+        while time.time() - start < timeout:
+            gevent.sleep(probe_interval)
             #dump connection
             rvalue = self.controller.nodes(node).net.network_dump(self.iface)
+            probes += 1
             #self.log.debug('dump connection :\n%s\n'  % (str(rvalue) ))
             flow_info_lines = rvalue.rstrip().split('\n')
             if flow_info_lines[0][0:9] == "Connected" :
-                connected = True
-                break
+                return True, probes
+            if probe_interval >= max_probe:
+                #associate station again
+                self.controller.nodes(node).net.connect_to_network(self.iface, essid)
+            probe_interval = min(probe_interval * 2, max_probe)
 
-        return connected
\ No newline at end of file
+        return False, probes
\ No newline at end of file